@@ -0,0 +1,18 @@
+import os
+from polus.samplers.INDEX.indexSampling import SELECT
+from polus.trajectories.features import FeatureSampler
+
+# Diversity-based selection on the ALF features of the per-atom .csv files,
+# i.e. without XYZ trajectory nor alignment, followed by index-based sampling
+TRAIN = [100,250,500,750,1000]
+OUT   = "DATASETS"
+
+job = FeatureSampler(systemName="ETL",inputDir="input_files",standardize=True,writeFerebusInputs=True,outputDir="OUTPUT-ETL",sampleSize=TRAIN.copy())
+job.Execute()
+
+if not os.path.isdir(OUT):
+    os.mkdir(OUT)
+for train_set_size in TRAIN:
+    outdir = os.path.join(OUT,"INDEX-SAMPLING-"+str(train_set_size))
+    sel    = SELECT(allProp=False,props=["iqa"],valTest=True,externalSet=job.externalSet,considerExtSet=True,indexFile=job.divIndexFiles[train_set_size],trainSize=train_set_size,validSize=1000,testSize=1000,systemName="ETL",inputDir="input_files",outputDir=outdir,randomSeed=20)
+    sel.Execute()
@@ -0,0 +1,9 @@
+from polus.trajectories.diversity import Sampler
+
+# Online diversity-based selection while the MD engine is still writing md.xyz:
+# every new frame is aligned to the reference and appended to OUTPUT-UREA/UREA-INDEX-ONLINE.dat
+# and UREA-SAMPLE-ONLINE.xyz if it lies further than the threshold from all selected frames.
+# The job stops once no new frame has been written for idleTimeout seconds.
+if __name__ == "__main__":
+    job = Sampler(systemName="UREA",rotMethod="KU",weightsVector="HL1:2",online=True,threshold=0.10,pollInterval=5.0,idleTimeout=600.0,outputDir="OUTPUT-UREA",filename="md.xyz")
+    job.Execute()
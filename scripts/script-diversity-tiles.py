@@ -0,0 +1,12 @@
+import sys
+from polus.trajectories.diversity import Sampler
+
+# Usage: python script-diversity-tiles.py NTILES [TILE-INDEX]
+# With a tile index (1-based, e.g. $SGE_TASK_ID) only that task's tiles of the RMSD
+# matrix are computed; without it the tiles are merged and geometries selected.
+ntiles    = int(sys.argv[1])
+tileIndex = int(sys.argv[2])-1 if len(sys.argv) > 2 else None
+
+if __name__ == "__main__":
+    job = Sampler(systemName="UREA",rotateTraj=True,rotMethod="KU",weightsVector="HL1:2",ncores=16,tileSize=4096,ntiles=ntiles,tileIndex=tileIndex,autoStop=False,outputDir="OUTPUT-UREA",filename="urea.xyz",sampleSize=[500])
+    job.Execute()
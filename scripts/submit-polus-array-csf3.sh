@@ -0,0 +1,15 @@
+#!/bin/bash --login
+# RMSD matrix split across NTILES array tasks (qsub -N polus-tiles submit-polus-array-csf3.sh).
+# Tiles are then merged, and geometries selected, by a job submitted with -hold_jid polus-tiles
+# that runs: python script-diversity-tiles.py $NTILES
+#$ -cwd 
+#$ -pe smp.pe 16
+#$ -t 1-32
+
+NTILES=32
+
+source ~/.venv/polus/bin/activate
+
+export OMP_NUM_THREADS=1
+
+python script-diversity-tiles.py $NTILES $SGE_TASK_ID
@@ -0,0 +1,81 @@
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans, kmeans_plusplus
+from polus.trajectories.calculators import ComputeDistanceTile
+from polus.trajectories.selection import FarthestPointSelector
+from polus.utils.logging import RaiseError
+
+
+def KMeansPlusPlusCandidates(X,ncandidates,randomSeed=None):
+    """
+    Indices of the k-means++ seeds of X: every seed is drawn with a probability
+    proportional to its squared distance to the seeds drawn before, so that seeds
+    spread over the whole data set.
+
+    Parameters:
+    - X:           array -> Weighted coordinates (nframes,3*natoms), see WeightedCoordinates
+    - ncandidates: int   -> Number of seeds
+    - randomSeed:  int   -> Seed of the random number generator
+    """
+    _, indices = kmeans_plusplus(X,n_clusters=ncandidates,random_state=randomSeed)
+    return np.unique(indices)
+
+def CoresetCandidates(X,ncandidates,batchSize=4096,maxIter=10,randomSeed=None):
+    """
+    Indices of the frames closest to the centres of a mini-batch k-means clustering
+    of X, i.e. a set of ncandidates actual frames covering the data set. The clustering
+    only ever works on mini-batches, and centres are mapped back to frames block by block.
+
+    Parameters:
+    - X:           array -> Weighted coordinates (nframes,3*natoms), see WeightedCoordinates
+    - ncandidates: int   -> Number of clusters
+    - batchSize:   int   -> Number of frames per mini-batch
+    - maxIter:     int   -> Maximum number of passes over the data set
+    - randomSeed:  int   -> Seed of the random number generator
+    """
+    kmeans = MiniBatchKMeans(n_clusters=ncandidates,batch_size=batchSize,max_iter=maxIter,n_init=1,compute_labels=False,random_state=randomSeed)
+    kmeans.fit(X)
+    return np.unique(NearestFrames(X,kmeans.cluster_centers_.astype(X.dtype,copy=False),batchSize*16))
+
+def NearestFrames(X,centres,blockSize=65536):
+    # Index of the frame closest to every centre, one GEMM per block of frames (k-d trees do poorly in 3*natoms dimensions)
+    sqC     = np.einsum("ij,ij->i",centres,centres)
+    best    = np.full(len(centres),np.inf)
+    indices = np.zeros(len(centres),dtype=np.int64)
+    for i0 in range(0,X.shape[0],blockSize):
+        block = X[i0:i0+blockSize]
+        D2    = np.einsum("ij,ij->i",block,block)[:,None] - 2.0*(block @ centres.T) + sqC[None,:]
+        rows  = np.argmin(D2,axis=0)
+        dmin  = D2[rows,np.arange(len(centres))]
+        found = dmin < best
+        best[found], indices[found] = dmin[found], i0+rows[found]
+    return indices
+
+def SelectCandidates(X,ncandidates,method="coreset",batchSize=4096,randomSeed=None):
+    ncandidates = min(ncandidates,X.shape[0])
+    if method == "kmeans++":
+        return KMeansPlusPlusCandidates(X,ncandidates,randomSeed)
+    elif method == "coreset":
+        return CoresetCandidates(X,ncandidates,batchSize,randomSeed=randomSeed)
+    else:
+        RaiseError(message=f"Invalid approximate selection method {method}")
+
+def OrderCandidates(X,candidates,initialDistances,size=None):
+    """
+    Farthest-point ordering of a (small) set of candidate frames, the distances between
+    candidates being Euclidean distances of their weighted coordinates (RMSDs of
+    pre-aligned frames). Returns the ordered frame indices and their smallest distances.
+
+    Parameters:
+    - X:                array -> Weighted coordinates (nframes,3*natoms)
+    - candidates:       array -> Indices of the candidate frames
+    - initialDistances: array -> Distances of the candidates used for the first pick (e.g. to the centroid)
+    - size:             int   -> Number of frames to order, all candidates if None
+    """
+    Xc       = np.asarray(X[candidates],dtype=np.float64)
+    sq       = np.einsum("ij,ij->i",Xc,Xc)
+    row      = lambda c: ComputeDistanceTile(Xc[[c]],Xc,sq[[c]],sq)[0]
+    selector = FarthestPointSelector(len(candidates),row,initialDistances)
+    size     = len(candidates) if size == None else min(size,len(candidates))
+    for _ in range(size):
+        selector.Next()
+    return np.asarray(candidates)[selector.selected], np.array(selector.smallestDistances)
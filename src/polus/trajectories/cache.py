@@ -0,0 +1,134 @@
+import os
+import json
+import hashlib
+import numpy as np
+from polus.utils.logging import RaiseWarning
+
+CACHE_VERSION  = 1
+HASH_BLOCKSIZE = 1 << 20
+HASH_NBLOCKS   = 16
+
+
+def FingerprintFile(filename,blockSize=HASH_BLOCKSIZE,nblocks=HASH_NBLOCKS):
+    """
+    Computes a content hash of a (possibly very large) file. Small files are hashed
+    entirely; larger ones are hashed through nblocks evenly spaced blocks (first and
+    last blocks included), so that the cost does not grow with the file size.
+
+    Parameters:
+    - filename:  str -> Path to the file
+    - blockSize: int -> Size (bytes) of each hashed block
+    - nblocks:   int -> Number of hashed blocks
+    """
+    size   = os.path.getsize(filename)
+    sha    = hashlib.sha256(str(size).encode())
+    with open(filename,"rb") as f:
+        if size <= blockSize*nblocks:
+            sha.update(f.read())
+        else:
+            for offset in np.linspace(0,size-blockSize,nblocks,dtype=np.int64):
+                f.seek(int(offset))
+                sha.update(f.read(blockSize))
+    return sha.hexdigest()
+
+def UserCacheDir():
+    """
+    Per-user directory holding the trajectory caches ($XDG_CACHE_HOME/polus, or
+    ~/.cache/polus), so that nothing is written next to the trajectories themselves.
+    """
+    return os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"),".cache"),"polus")
+
+def ResultsKey(fields):
+    """
+    Content address of results derived from a trajectory: a short hash of the JSON
+    representation of the fields (trajectory hash and settings) they depend on.
+    Files among the fields are represented by their FingerprintFile hash.
+    """
+    fields = {key:FingerprintFile(value) if isinstance(value,str) and os.path.isfile(value) else value for key, value in fields.items()}
+    return hashlib.sha256(json.dumps(fields,sort_keys=True).encode()).hexdigest()[:16]
+
+def WriteAtomically(path,write):
+    # Readers in other processes only ever see complete files
+    tmpPath = path+f".{os.getpid()}.tmp"
+    try:
+        with open(tmpPath,"wb") as f:
+            write(f)
+        os.replace(tmpPath,path)
+    except OSError:
+        if os.path.isfile(tmpPath):
+            os.remove(tmpPath)
+        raise
+
+
+class TrajectoryCache():
+    """
+    Binary cache of a trajectory file. Arrays derived from the trajectory are stored as
+    .npy files in a hidden subdirectory of cacheDir (UserCacheDir() if None) named after
+    the trajectory and its path, so that a shared cacheDir holds one cache per trajectory,
+    and memory-mapped on later runs. All entries are invalidated together whenever the
+    path, size, modification time or content hash of the trajectory changes. A cache
+    that cannot be read or written is ignored, and the trajectory read as if uncached.
+    """
+    def __init__(self,filename,cacheDir=None):
+        self.filename     = os.path.abspath(filename)
+        tail              = os.path.basename(self.filename)
+        pathHash          = hashlib.sha256(self.filename.encode()).hexdigest()[:8]
+        self.cacheDir     = os.path.join(UserCacheDir() if cacheDir == None else cacheDir,"."+tail+"-"+pathHash+".polus")
+        self.metaFilename = os.path.join(self.cacheDir,"meta.json")
+        self.key          = None
+        self.valid        = None
+        self.writable     = True
+
+    def Key(self):
+        if self.key == None:
+            stat     = os.stat(self.filename)
+            self.key = {"version":CACHE_VERSION,"path":self.filename,"size":stat.st_size,"mtime":stat.st_mtime_ns,"hash":None}
+        if self.key["hash"] == None:
+            self.key["hash"] = FingerprintFile(self.filename)
+        return self.key
+
+    def IsValid(self):
+        if self.valid == None:
+            self.valid = False
+            if os.path.isfile(self.metaFilename):
+                try:
+                    with open(self.metaFilename,"r") as f:
+                        meta = json.load(f)
+                except (OSError,ValueError):
+                    meta = dict()
+                stat = os.stat(self.filename)
+                # Cheap checks first: the file is hashed only if size and mtime agree
+                if meta.get("path")==self.filename and meta.get("size")==stat.st_size and meta.get("mtime")==stat.st_mtime_ns:
+                    self.valid = meta == self.Key()
+        return self.valid
+
+    def EntryPath(self,name):
+        return os.path.join(self.cacheDir,name+".npy")
+
+    def Load(self,name,mmap=True):
+        if self.IsValid() and os.path.isfile(self.EntryPath(name)):
+            try:
+                return np.load(self.EntryPath(name),mmap_mode="r" if mmap else None)
+            except (OSError,ValueError):
+                RaiseWarning(message=f"Program unable to read trajectory cache entry {self.EntryPath(name)}")
+        return None
+
+    def Save(self,name,array):
+        if not self.writable:
+            return
+        try:
+            if not os.path.isdir(self.cacheDir):
+                os.makedirs(self.cacheDir)
+            if not self.IsValid():
+                # Stale entries belong to an older version of the trajectory, other files are left alone
+                for entry in os.listdir(self.cacheDir):
+                    path = os.path.join(self.cacheDir,entry)
+                    if os.path.isfile(path) and (entry.endswith(".npy") or path == self.metaFilename):
+                        os.remove(path)
+                WriteAtomically(self.metaFilename,lambda f: f.write(json.dumps(self.Key()).encode()))
+                self.valid = True
+            WriteAtomically(self.EntryPath(name),lambda f: np.save(f,array))
+        except OSError:
+            # Warn once, the run goes on uncached
+            self.writable = False
+            RaiseWarning(message=f"Program unable to write trajectory cache in {self.cacheDir}")
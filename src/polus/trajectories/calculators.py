@@ -1,12 +1,13 @@
 import os
+import numpy as np
+from scipy.spatial.transform import Rotation
 
+# Superposition methods: scipy Rotation ("R"), Kabsch-Umeyama ("K"/"KU") and QCP (RMSDs of unaligned frames)
+ROTATION_METHODS = ["KU","K","R","QCP"]
 
 def RotateGeometry(Ref_geom,Test_geom,rotMethod="K"):
-    import numpy as np
-    import sys
-    from scipy.spatial.transform import Rotation as R
     if rotMethod == "R":
-        rot, _, _ = R.align_vectors(Ref_geom, Test_geom, return_sensitivity=True)
+        rot, _, _ = Rotation.align_vectors(Ref_geom, Test_geom, return_sensitivity=True)
         ROT_geom = np.array(rot.apply(Test_geom))
     else:
         Ref_geom, Test_geom = np.array(Ref_geom), np.array(Test_geom)
@@ -15,44 +16,300 @@ def RotateGeometry(Ref_geom,Test_geom,rotMethod="K"):
 
     return ROT_geom
 
+def RotateGeometries(Ref_geom,Test_geoms,rotMethod="KU",blockSize=100000):
+    """
+    Superposes every frame of Test_geoms (nframes,natoms,3) onto Ref_geom (natoms,3).
+    Kabsch-Umeyama superpositions are computed for blocks of blockSize frames at once
+    (see kabsch_umeyama_batch) and applied with a single matmul per block.
+    """
+    rotated = np.empty(Test_geoms.shape,dtype=Test_geoms.dtype)
+    if rotMethod == "R":
+        for i in range(Test_geoms.shape[0]):
+            rotated[i] = RotateGeometry(Ref_geom,Test_geoms[i],rotMethod)
+        return rotated
+    A = np.asarray(Ref_geom,dtype=np.float64)
+    for k in range(0,Test_geoms.shape[0],blockSize):
+        B       = np.asarray(Test_geoms[k:k+blockSize],dtype=np.float64)
+        R, c, t = kabsch_umeyama_batch(A,B)
+        # t + c * R @ b for every atom b of every frame
+        rotated[k:k+blockSize] = c[:,None,None]*np.matmul(B,R.transpose(0,2,1)) + t[:,None,:]
+    return rotated
+
 
 
 def ComputeRMSD(geom1,geom2,rotMethod,rotated,weights_):
-    from polus.trajectories.globals import weightsVect
-    import numpy as np
-    import math
-    import sys
-    from scipy.spatial.transform import Rotation as R
-    if not isinstance(geom1,np.ndarray):
-        g1 = np.array(geom1)
-    else:
-        g1 = geom1
-    if not isinstance(geom2,np.ndarray):
-        g2 = np.array(geom2)
-    else:
-        g2 = geom2
-    # Apply weight correction
+    g1 = np.asarray(geom1)
+    g2 = np.asarray(geom2)
     assert g1.shape == g2.shape
-    # Rotate structures if necessary (not yet rotated)
-    #if not rotated:
+    rmsd = ComputeRMSDOneToMany(g1,g2[None],SqrtWeights(weights_,g1.shape[0]),rotated,rotMethod)
+
+    return rmsd[0]
+
+def SqrtWeights(weights_,natoms):
+    if weights_ is None:
+        return np.ones(natoms)
+    return np.sqrt(np.asarray(weights_,dtype=np.float64))
+
+def ComputeRMSDOneToMany(Ref_geom,Test_geoms,sqrtWeights,rotated=True,rotMethod="KU"):
+    """
+    Weighted RMSDs between Ref_geom (natoms,3) and every frame of Test_geoms
+    (nframes,natoms,3), returned as an (nframes,) array. Frames that are not yet
+    superposed (rotated=False) are aligned onto Ref_geom in one batched call first.
+    sqrtWeights holds the square roots of the atomic weights (see SqrtWeights).
+    """
+    if not rotated and rotMethod == "QCP":
+        return ComputeQCPRMSD(Ref_geom[None],Test_geoms,sqrtWeights**2)[0]
     if not rotated:
-        if rotMethod == "R":
-            rot, _, _ = R.align_vectors(g1, g2, return_sensitivity=True)
-            diff = np.array(g1) - np.array(rot.apply(g2))
-        else:
-            R, c, t  = kabsch_umeyama(g1,g2)
-            g2 = np.array([t + c * R @ b for b in g2])
-            diff = g1 - g2
-    else:
-        diff = g1 - g2
-    # Apply weights correction
-    for i in range(diff.shape[0]):
-        diff[i,:] = math.sqrt(weights_[i])*diff[i,:]
+        Test_geoms = RotateGeometries(Ref_geom,Test_geoms,rotMethod)
+    diff = (Test_geoms - Ref_geom)*sqrtWeights[None,:,None]
+    return np.sqrt(np.einsum("fij,fij->f",diff,diff)/Ref_geom.shape[0])
 
-    rmsd = np.sqrt((diff * diff).sum() / np.array(g2).shape[0]) 
+def ComputeRMSDManyToMany(Geoms1,Geoms2,sqrtWeights,rotated=True,rotMethod="KU"):
+    """
+    Weighted RMSDs between every frame of Geoms1 (n1,natoms,3) and every frame of
+    Geoms2 (n2,natoms,3), returned as an (n1,n2) array. Pre-aligned blocks are handled
+    with a single GEMM (see ComputeDistanceTile), with no (n1,n2,3*natoms) temporary;
+    otherwise each row aligns Geoms2 in one batched call.
+    """
+    if not rotated and rotMethod == "QCP":
+        return ComputeQCPRMSD(Geoms1,Geoms2,sqrtWeights**2)
+    if not rotated:
+        return np.array([ComputeRMSDOneToMany(geom,Geoms2,sqrtWeights,False,rotMethod) for geom in Geoms1]).reshape(len(Geoms1),len(Geoms2))
+    natoms = Geoms1.shape[1]
+    scale  = sqrtWeights[None,:,None]/np.sqrt(natoms)
+    X1     = (np.asarray(Geoms1,dtype=np.float64)*scale).reshape(len(Geoms1),natoms*3)
+    X2     = (np.asarray(Geoms2,dtype=np.float64)*scale).reshape(len(Geoms2),natoms*3)
+    # Centred rows keep the GEMM identity accurate (see WeightedCoordinates)
+    centre = X2.mean(axis=0) if len(X2) > 0 else 0.0
+    X1, X2 = X1-centre, X2-centre
+    return ComputeDistanceTile(X1,X2,np.einsum("ij,ij->i",X1,X1),np.einsum("ij,ij->i",X2,X2))
 
+def ComputeQCPRMSD(Geoms1,Geoms2,weights_,maxIter=50,evalPrec=1e-11,maxPairs=1<<20):
+    """
+    Minimum weighted RMSDs, over all rigid superpositions, between every frame of Geoms1
+    (n1,natoms,3) and every frame of Geoms2 (n2,natoms,3), returned as an (n1,n2) array.
+    Uses the quaternion characteristic polynomial (QCP) method of Theobald (2005) as
+    implemented by Liu, Agrafiotis & Theobald (2010): the largest eigenvalue of the 4x4 key
+    matrix is found by Newton iterations on its characteristic polynomial, vectorized over
+    all pairs, so that no SVD or rotation matrix is ever formed. The superposition itself
+    is weighted, so results can be slightly smaller than with an unweighted Kabsch fit.
+    At most maxPairs pairs are processed at once to bound temporary arrays.
+    """
+    weights_ = np.asarray(weights_,dtype=np.float64)
+    A  = np.asarray(Geoms1,dtype=np.float64)
+    A  = A - np.einsum("i,fij->fj",weights_,A)[:,None,:]/weights_.sum()
+    GA = np.einsum("i,fij,fij->f",weights_,A,A)
+    step = max(1,maxPairs//max(1,len(A)))
+    rmsd = np.empty(shape=(len(A),len(Geoms2)))
+    for k in range(0,len(Geoms2),step):
+        B  = np.asarray(Geoms2[k:k+step],dtype=np.float64)
+        B  = B - np.einsum("i,fij->fj",weights_,B)[:,None,:]/weights_.sum()
+        GB = np.einsum("i,fij,fij->f",weights_,B,B)
+        rmsd[:,k:k+step] = QCPBlock(A,B,GA,GB,weights_,maxIter,evalPrec)
     return rmsd
 
+def QCPBlock(A,B,GA,GB,weights_,maxIter,evalPrec):
+    # A and B are centred frames, GA and GB their weighted inner products
+    natoms = A.shape[1]
+    # Inner-product matrices of all pairs with one GEMM: M[a,b,j,k] = sum_i w_i A[a,i,j] B[b,i,k]
+    M    = np.tensordot(A*weights_[None,:,None],B,axes=([1],[1])).transpose(0,2,1,3)
+    E0   = 0.5*(GA[:,None] + GB[None,:])
+    lmax = QCPLargestEigenvalue(M,E0,maxIter,evalPrec)
+    return np.sqrt(np.abs(2.0*(E0 - lmax))/natoms)
+
+def QCPLargestEigenvalue(M,E0,maxIter=50,evalPrec=1e-11):
+    """
+    Largest eigenvalue of the QCP key matrices built from the inner-product matrices
+    M (...,3,3), found by Newton-Raphson on the characteristic polynomial starting from
+    its upper bound E0 = (GA+GB)/2, vectorized over all leading dimensions.
+    """
+    # Contiguous copies of the nine entries keep the elementwise arithmetic fast
+    (Sxx, Sxy, Sxz), (Syx, Syy, Syz), (Szx, Szy, Szz) = np.ascontiguousarray(np.moveaxis(M,(-2,-1),(0,1)))
+    Sxx2, Syy2, Szz2 = Sxx*Sxx, Syy*Syy, Szz*Szz
+    Sxy2, Syz2, Sxz2 = Sxy*Sxy, Syz*Syz, Sxz*Sxz
+    Syx2, Szy2, Szx2 = Syx*Syx, Szy*Szy, Szx*Szx
+    SyzSzymSyySzz2   = 2.0*(Syz*Szy - Syy*Szz)
+    Sxx2Syy2Szz2Syz2Szy2 = Syy2 + Szz2 - Sxx2 + Syz2 + Szy2
+    C2 = -2.0*(Sxx2 + Syy2 + Szz2 + Sxy2 + Syx2 + Sxz2 + Szx2 + Syz2 + Szy2)
+    C1 = 8.0*(Sxx*Syz*Szy + Syy*Szx*Sxz + Szz*Sxy*Syx - Sxx*Syy*Szz - Syz*Szx*Sxy - Szy*Syx*Sxz)
+    SxzpSzx, SyzpSzy, SxypSyx = Sxz + Szx, Syz + Szy, Sxy + Syx
+    SyzmSzy, SxzmSzx, SxymSyx = Syz - Szy, Sxz - Szx, Sxy - Syx
+    SxxpSyy, SxxmSyy          = Sxx + Syy, Sxx - Syy
+    Sxy2Sxz2Syx2Szx2 = Sxy2 + Sxz2 - Syx2 - Szx2
+    C0 = (Sxy2Sxz2Syx2Szx2*Sxy2Sxz2Syx2Szx2
+          + (Sxx2Syy2Szz2Syz2Szy2 + SyzSzymSyySzz2)*(Sxx2Syy2Szz2Syz2Szy2 - SyzSzymSyySzz2)
+          + (-SxzpSzx*SyzmSzy + SxymSyx*(SxxmSyy - Szz))*(-SxzmSzx*SyzpSzy + SxymSyx*(SxxmSyy + Szz))
+          + (-SxzpSzx*SyzpSzy - SxypSyx*(SxxpSyy - Szz))*(-SxzmSzx*SyzmSzy - SxypSyx*(SxxpSyy + Szz))
+          + (SxypSyx*SyzpSzy + SxzpSzx*(SxxmSyy + Szz))*(-SxymSyx*SyzmSzy + SxzpSzx*(SxxpSyy + Szz))
+          + (SxypSyx*SyzmSzy + SxzmSzx*(SxxmSyy - Szz))*(-SxymSyx*SyzpSzy + SxzmSzx*(SxxpSyy - Szz)))
+    # Newton-Raphson for the largest root, starting from its upper bound
+    lmax = np.array(E0,dtype=np.float64)
+    for i in range(maxIter):
+        x2    = lmax*lmax
+        b     = (x2 + C2)*lmax
+        a     = b + C1
+        denom = 2.0*x2*lmax + b + a
+        delta = np.divide(a*lmax + C0,denom,out=np.zeros_like(denom),where=denom!=0.0)
+        lmax  = lmax - delta
+        if np.all(np.abs(delta) <= np.abs(evalPrec*lmax)):
+            break
+    return lmax
+
+def QCPRotations(M,lmax,evecPrec=1e-10):
+    """
+    Optimal rotations R (...,3,3), R b superposing frame B onto frame A, from the inner-product
+    matrices M = sum_i a_i b_i^T (...,3,3) and the largest eigenvalues of their key matrices K.
+    The rotation quaternion is the row of the adjugate of (K - lmax I) with the largest norm
+    (cofactor expressions of Liu, Agrafiotis & Theobald (2010)). Also returns a mask of the
+    rotations that are well defined (False for degenerate eigenvalues).
+    """
+    (Sxx, Sxy, Sxz), (Syx, Syy, Syz), (Szx, Szy, Szz) = np.ascontiguousarray(np.moveaxis(M,(-2,-1),(0,1)))
+    # Entries of the symmetric matrix K - lmax I
+    a11, a12, a13, a14 = Sxx+Syy+Szz-lmax, Syz-Szy, Szx-Sxz, Sxy-Syx
+    a22, a23, a24      = Sxx-Syy-Szz-lmax, Sxy+Syx, Szx+Sxz
+    a33, a34           = Syy-Sxx-Szz-lmax, Syz+Szy
+    a44                = Szz-Sxx-Syy-lmax
+    a21, a31, a41, a32, a42, a43 = a12, a13, a14, a23, a24, a34
+    a3344_4334, a3244_4234, a3243_4233 = a33*a44-a43*a34, a32*a44-a42*a34, a32*a43-a42*a33
+    a3143_4133, a3144_4134, a3142_4132 = a31*a43-a41*a33, a31*a44-a41*a34, a31*a42-a41*a32
+    a1324_1423, a1224_1422, a1223_1322 = a13*a24-a14*a23, a12*a24-a14*a22, a12*a23-a13*a22
+    a1124_1421, a1123_1321, a1122_1221 = a11*a24-a14*a21, a11*a23-a13*a21, a11*a22-a12*a21
+    rows = np.array([[ a22*a3344_4334-a23*a3244_4234+a24*a3243_4233, -a21*a3344_4334+a23*a3144_4134-a24*a3143_4133,
+                       a21*a3244_4234-a22*a3144_4134+a24*a3142_4132, -a21*a3243_4233+a22*a3143_4133-a23*a3142_4132],
+                     [ a12*a3344_4334-a13*a3244_4234+a14*a3243_4233, -a11*a3344_4334+a13*a3144_4134-a14*a3143_4133,
+                       a11*a3244_4234-a12*a3144_4134+a14*a3142_4132, -a11*a3243_4233+a12*a3143_4133-a13*a3142_4132],
+                     [ a42*a1324_1423-a43*a1224_1422+a44*a1223_1322, -a41*a1324_1423+a43*a1124_1421-a44*a1123_1321,
+                       a41*a1224_1422-a42*a1124_1421+a44*a1122_1221, -a41*a1223_1322+a42*a1123_1321-a43*a1122_1221],
+                     [ a32*a1324_1423-a33*a1224_1422+a34*a1223_1322, -a31*a1324_1423+a33*a1124_1421-a34*a1123_1321,
+                       a31*a1224_1422-a32*a1124_1421+a34*a1122_1221, -a31*a1223_1322+a32*a1123_1321-a33*a1122_1221]])
+    norm = np.einsum("rc...,rc...->r...",rows,rows)
+    best = np.argmax(norm,axis=0)
+    q    = np.take_along_axis(rows,best[None,None],axis=0)[0]
+    qsqr = np.take_along_axis(norm,best[None],axis=0)[0]
+    ok   = qsqr > evecPrec*np.maximum(np.abs(lmax),1.0)**6
+    a, x, y, z = q/np.sqrt(np.where(ok,qsqr,1.0))
+    R    = np.empty(M.shape)
+    R[...,0,0], R[...,0,1], R[...,0,2] = a*a+x*x-y*y-z*z, 2.0*(x*y-a*z), 2.0*(x*z+a*y)
+    R[...,1,0], R[...,1,1], R[...,1,2] = 2.0*(x*y+a*z), a*a-x*x+y*y-z*z, 2.0*(y*z-a*x)
+    R[...,2,0], R[...,2,1], R[...,2,2] = 2.0*(x*z-a*y), 2.0*(y*z+a*x), a*a-x*x-y*y+z*z
+    return R, ok
+
+class PoolRMSDKernel():
+    """
+    Aligned weighted RMSDs from any geometry (e.g. a running centroid) to every frame of a
+    fixed pool (nframes,natoms,3), for repeated queries. Pool frames are centred once and
+    all covariance matrices come from a single GEMM; Kabsch-Umeyama RMSDs are then obtained
+    from the optimal rotations (QCP quaternions rather than one SVD per frame) and the
+    weighted covariances, without rotating any frame.
+    Results match ComputeRMSDOneToMany(Ref_geom,Geoms,sqrtWeights,False,rotMethod).
+    """
+    def __init__(self,Geoms,sqrtWeights,rotMethod="KU"):
+        self.Geoms       = Geoms
+        self.sqrtWeights = sqrtWeights
+        self.weights     = sqrtWeights**2
+        self.rotMethod   = rotMethod
+        self.natoms      = Geoms.shape[1]
+        if rotMethod == "QCP":
+            # QCP superpositions are weighted, frames are centred on their weighted means
+            B            = np.asarray(Geoms,dtype=np.float64)
+            self.B       = B - np.einsum("i,fij->fj",self.weights,B)[:,None,:]/self.weights.sum()
+            self.G       = np.einsum("i,fij,fij->f",self.weights,self.B,self.B)
+        elif rotMethod != "R":
+            B            = np.asarray(Geoms,dtype=np.float64)
+            B            = B - B.mean(axis=1)[:,None,:]
+            self.G       = np.einsum("i,fij,fij->f",self.weights,B,B)
+            self.Gu      = np.einsum("fij,fij->f",B,B)
+            # Rows (frame,k) hold coordinate k of every atom of the frame
+            self.Bt      = np.ascontiguousarray(B.transpose(0,2,1)).reshape(len(B)*3,self.natoms)
+
+    def __call__(self,Ref_geom):
+        A = np.asarray(Ref_geom,dtype=np.float64)
+        if self.rotMethod == "R":
+            return ComputeRMSDOneToMany(A,self.Geoms,self.sqrtWeights,False,self.rotMethod)
+        if self.rotMethod == "QCP":
+            A  = A - (self.weights @ A)/self.weights.sum()
+            GA = np.einsum("i,ij,ij->",self.weights,A,A)
+            return QCPBlock(A[None],self.B,np.array([GA]),self.G,self.weights,50,1e-11)[0]
+        A  = A - A.mean(axis=0)
+        GA = np.einsum("i,ij,ij->",self.weights,A,A)
+        # M[f,j,k] = sum_i A[i,j] B[f,i,k] (unweighted, for the rotation) and its weighted counterpart
+        HB = (self.Bt @ np.concatenate([A,A*self.weights[:,None]],axis=1)).reshape(-1,3,6)
+        M  = HB[...,:3].transpose(0,2,1)
+        Mw = HB[...,3:].transpose(0,2,1)
+        # Optimal proper rotations of kabsch_umeyama_batch, through QCP quaternions (no SVD)
+        lmax  = QCPLargestEigenvalue(M,0.5*(np.einsum("ij,ij->",A,A)+self.Gu))
+        R, ok = QCPRotations(M,lmax)
+        if not np.all(ok):
+            # Degenerate eigenvalues: rotations from the SVD of the covariance
+            U, D, VT = np.linalg.svd(M[~ok])
+            d  = np.sign(np.linalg.det(U)*np.linalg.det(VT))
+            U[...,:,-1] *= d[:,None]
+            R[~ok] = np.matmul(U,VT).transpose(0,2,1)
+        # sum_i w_i |R b_i - a_i|^2 = GB + GA - 2 sum_jk R_kj Mw_jk
+        msd = (self.G + GA - 2.0*np.einsum("fkj,fjk->f",R,Mw))/self.natoms
+        return np.sqrt(np.maximum(msd,0.0))
+
+def WeightedCoordinates(Geoms,sqrtWeights,dtype=np.float64):
+    """
+    Flattens pre-aligned frames (nframes,natoms,3) into rows whose Euclidean distances
+    are the weighted RMSDs. Rows are centred on the mean frame: distances are unchanged
+    but norms shrink, which keeps the GEMM identity accurate in float32.
+    """
+    natoms = Geoms.shape[1]
+    X      = (np.asarray(Geoms,dtype=np.float64)*(sqrtWeights[None,:,None]/np.sqrt(natoms))).reshape(len(Geoms),natoms*3)
+    X      = X - X.mean(axis=0)
+    return X.astype(dtype,copy=False)
+
+def FrameSum(Geoms,frameWeights=None):
+    """
+    (Weighted) sum of the frames (nframes,natoms,3) as one reduction over the frame axis,
+    returned with the sum of weights: their ratio is the average frame, and the sums of
+    successive blocks of a streamed trajectory can be accumulated.
+    """
+    if frameWeights is None:
+        return np.sum(Geoms,axis=0,dtype=np.float64), float(len(Geoms))
+    frameWeights = np.asarray(frameWeights,dtype=np.float64)
+    return np.tensordot(frameWeights,np.asarray(Geoms,dtype=np.float64),axes=(0,0)), float(frameWeights.sum())
+
+def ClosestFrame(Geoms,RefGeom,sqrtWeights,blockSize=10000):
+    """
+    Index of the frame (nframes,natoms,3) with the smallest weighted squared deviation
+    from RefGeom without superposition, and that deviation. For frames aligned on a
+    common reference, the frame closest to the (weighted) average frame is the medoid:
+    it minimises the (weighted) sum of squared RMSDs to all other frames.
+    """
+    weights2        = sqrtWeights**2
+    bestID, bestDev = None, np.inf
+    for k0 in range(0,len(Geoms),blockSize):
+        dev = np.einsum("nij,i->n",(np.asarray(Geoms[k0:k0+blockSize],dtype=np.float64)-RefGeom)**2,weights2)
+        k   = int(np.argmin(dev))
+        if dev[k] < bestDev:
+            bestID, bestDev = k0+k, float(dev[k])
+    return bestID, bestDev
+
+def ComputeDistanceTile(X1,X2,sq1,sq2):
+    # sqrt(||a||^2 + ||b||^2 - 2a.b) with a single GEMM
+    D2 = sq1[:,None] + sq2[None,:] - 2.0*(X1 @ X2.T)
+    np.maximum(D2,0.0,out=D2)
+    return np.sqrt(D2,out=D2)
+
+def IterRMSDTiles(Geoms,sqrtWeights,tileSize=2048,dtype=np.float32):
+    # Yields (i0,j0,tile) for every upper-triangle tile of the RMSD matrix of pre-aligned frames
+    return IterDistanceTiles(WeightedCoordinates(Geoms,sqrtWeights,dtype),tileSize)
+
+def IterDistanceTiles(X,tileSize=2048):
+    # Yields (i0,j0,tile) for every upper-triangle tile of the Euclidean distance matrix of the rows of X
+    N  = X.shape[0]
+    sq = np.einsum("ij,ij->i",X,X)
+    for i0 in range(0,N,tileSize):
+        i1 = min(i0+tileSize,N)
+        for j0 in range(i0,N,tileSize):
+            j1   = min(j0+tileSize,N)
+            tile = ComputeDistanceTile(X[i0:i1],X[j0:j1],sq[i0:i1],sq[j0:j1])
+            if i0 == j0:
+                np.fill_diagonal(tile,0.0)
+            yield i0, j0, tile
+
 #rigid_transform_3D function taken from:
 # https://gist.github.com/oshea00/dfb7d657feca009bf4d095d4cb8ea4be
 # Needs fixing
@@ -121,7 +378,6 @@ def kabsch_(A, B, scale=False):
     return c, R, t
 
 def kabsch_umeyama(A, B,scale=False):
-    import numpy as np
     assert A.shape == B.shape
     n, m = A.shape
 
@@ -142,3 +398,26 @@ def kabsch_umeyama(A, B,scale=False):
 
     return R, c, t
 
+def kabsch_umeyama_batch(A, B, scale=False):
+    # Stacked version of kabsch_umeyama: A (n,m) is the reference, B (nframes,n,m)
+    assert A.shape == B.shape[1:]
+    n, m = A.shape
+
+    EA = np.mean(A, axis=0)
+    EB = np.mean(B, axis=1)
+    VarA = np.mean(np.linalg.norm(A - EA, axis=1) ** 2)
+
+    H = np.einsum("ij,fik->fjk", A - EA, B - EB[:, None, :]) / n
+    U, D, VT = np.linalg.svd(H)
+    d = np.sign(np.linalg.det(U) * np.linalg.det(VT))
+    S = np.ones((B.shape[0], m))
+    S[:, -1] = d
+
+    R = np.matmul(U * S[:, None, :], VT)
+    c = VarA / np.sum(D * S, axis=1)
+    if not scale:
+        c = np.ones(B.shape[0])
+    t = EA - c[:, None] * np.einsum("fij,fj->fi", R, EB)
+
+    return R, c, t
+
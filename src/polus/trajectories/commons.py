@@ -3,15 +3,27 @@ import math
 import sys
 import time
 import numpy as np
-from polus.utils.logging import RaiseError, PrintInfo
+from polus.utils.logging import RaiseError, RaiseWarning, PrintInfo
 from polus.utils.printing import PrintOnTerminal
-from polus.trajectories.calculators import RotateGeometry, ComputeRMSD
+from polus.trajectories.calculators import RotateGeometries, ComputeRMSD, ComputeRMSDOneToMany, SqrtWeights, FrameSum, ClosestFrame
+from polus.trajectories.readers import ReadXYZTrajectory, ReadXYZHeader, IterXYZBlocks, IndexXYZFrames, ReadXYZFramesAt, ReadIndexFile
+from polus.trajectories.cache import TrajectoryCache
+from polus.trajectories.writers import WriteXYZFrames
+from polus.trajectories.matrices import MatrixStore, CreateMatrixStore
 from polus.trajectories.globals import weightsVect
 
+CENTROID_METHODS = ["mean","medoid"]
+
 
 class File():
-    def __init__(self,filename,refGeomFilename=None,natoms=None,atoms=None):
+    def __init__(self,filename,refGeomFilename=None,natoms=None,atoms=None,dtype=np.float64,cache=True,cacheDir=None,matrixStorage="dense",matrixFilename=None):
         self.filename         = filename
+        self.dtype            = dtype
+        self.cache            = None
+        if cache:
+            self.cache        = TrajectoryCache(filename,cacheDir)
+        self.labels           = None
+        self.firstGeom        = None
         self.natoms           = natoms
         self.atoms            = atoms
         self.refGeomFilename  = refGeomFilename
@@ -22,9 +34,13 @@ class File():
         self.nME              = None
         self.history          = None
         self.jump             = None
+        self.frameOffsets     = None
         self.rotTraj          = None
         self.matrRMSD         = None
+        self.matrixStorage    = matrixStorage
+        self.matrixFilename   = matrixFilename
         self.centroid         = None
+        self.medoidID         = None
         self.argsRMSD         = None
         self.argcount         = None
         self.refGeom          = None
@@ -36,7 +52,7 @@ class File():
         if self.userWeights == None:
             if isinstance(weightDef,list):
                 if self.atoms == None:
-                    self.ProcessFile()
+                    self.ReadHeader()
                 if len(weightDef)==self.natoms and (isinstance(weightDef[0],int) or isinstance(weightDef[0],float)):
                     self.userWeights = weightDef
                 else:
@@ -44,7 +60,7 @@ class File():
             elif isinstance(weightDef,str):
                 if "HL" in weightDef:
                     if self.atoms == None:
-                        self.ProcessFile()
+                        self.ReadHeader()
                     heavy = eval(weightDef.split("L")[1].split(":")[0]) 
                     light = eval(weightDef.split("L")[1].split(":")[1]) 
                     self.userWeights = [1.0]*self.natoms
@@ -58,29 +74,113 @@ class File():
         weightsVect = self.userWeights
         W           = self.userWeights
 
+    def GetSqrtWeights(self):
+        return SqrtWeights(self.userWeights,self.natoms)
+
     def ProcessFile(self):
-        if (self.natoms == None):
-            self.natoms = 0
-            self.atoms  = list()
-            with open(self.filename,"r") as xyz_file:
-                content = xyz_file.readlines()
-            self.content = content
-            for line in content[2:]:
-                line = line.split()
-                if (len(line)==4):
-                   self.natoms +=1
-                   self.atoms.append(line[0]+str(self.natoms))
-                else:
-                    break
-            self.ngeoms = int(len(self.content)/(self.natoms+2))
-            self.nME    = self.ngeoms*self.ngeoms
-            self.jump   = self.natoms + 2
+        if self.natoms != None and not isinstance(self.natoms,int):
+            RaiseError(message=" Program cannot set the number of atoms")
+        if self.history is None:
+            self.LoadTrajectory()
+        if self.natoms != None and self.natoms != self.history.shape[1]:
+            RaiseError(message=" Number of atoms inconsistent with trajectory file")
+        self.ngeoms = self.history.shape[0]
+        self.natoms = self.history.shape[1]
+        self.atoms  = [label+str(i+1) for i,label in enumerate(self.labels.tolist())]
+        self.nME    = self.ngeoms*self.ngeoms
+        self.jump   = self.natoms + 2
+
+    def ReadHeader(self):
+        # Atom labels and first frame only; the trajectory itself is not loaded
+        if self.labels is None:
+            self.labels, self.firstGeom = ReadXYZHeader(self.filename,self.dtype)
+        if self.firstGeom is None:
+            self.firstGeom = np.array(self.history[0])
+        if self.natoms != None and self.natoms != self.labels.shape[0]:
+            RaiseError(message=" Number of atoms inconsistent with trajectory file")
+        self.natoms = self.labels.shape[0]
+        self.atoms  = [label+str(i+1) for i,label in enumerate(self.labels.tolist())]
+        self.jump   = self.natoms + 2
+
+    def LoadCachedTrajectory(self):
+        # Memory-map the binary sidecar if the trajectory did not change since it was written
+        if self.history is None and self.cache != None:
+            labels  = self.cache.Load("labels",mmap=False)
+            history = self.cache.Load("coords-"+np.dtype(self.dtype).name)
+            if labels is not None and history is not None:
+                self.labels, self.history = labels, history
+        return self.history is not None
+
+    def GetFrameOffsets(self):
+        # Byte offset of every frame, built in one scan of the file and kept in the trajectory cache
+        if self.frameOffsets is None:
+            self.ReadHeader()
+            if self.cache != None:
+                self.frameOffsets = self.cache.Load("frame-offsets",mmap=False)
+            if self.frameOffsets is None:
+                print(f"POLUS: Indexing frames of {self.filename}")
+                self.frameOffsets = IndexXYZFrames(self.filename,self.natoms)
+                if self.cache != None:
+                    self.cache.Save("frame-offsets",self.frameOffsets)
+        return self.frameOffsets
+
+    def ReadFrames(self,frameIDs):
+        """
+        Returns the frames frameIDs (in that order) as a (nframes,natoms,3) array. Loaded or
+        cached trajectories are indexed; otherwise only the requested frames are read from
+        the XYZ file, by seeking to their byte offsets (see GetFrameOffsets).
+
+        Parameters:
+        - frameIDs: list -> IDs of the frames, or INDEX file listing them
+        """
+        if isinstance(frameIDs,str):
+            frameIDs = ReadIndexFile(frameIDs)
+        frameIDs = np.asarray(frameIDs,dtype=np.int64).ravel()
+        if self.history is not None or self.LoadCachedTrajectory():
+            self.ProcessFile()
+            if len(frameIDs) > 0 and (frameIDs.min() < 0 or frameIDs.max() >= self.ngeoms):
+                RaiseError(message=f" Frame IDs out of range (number of geometries {self.ngeoms})")
+            return np.array(self.history[frameIDs])
+        return ReadXYZFramesAt(self.filename,self.GetFrameOffsets(),frameIDs,self.natoms,self.dtype)
+
+    def LoadTrajectory(self):
+        if not self.LoadCachedTrajectory():
+            self.labels, self.history = ReadXYZTrajectory(self.filename,self.dtype)
+            if self.cache != None:
+                self.cache.Save("labels",self.labels)
+                self.cache.Save("coords-"+np.dtype(self.dtype).name,self.history)
 
+    def IterFrames(self,blockSize=1000,start=0,stop=None,stride=1):
+        """
+        Yields the trajectory as (frameIDs, frames) blocks of at most blockSize frames,
+        frames being a (nframes,natoms,3) array. Loaded or cached trajectories are sliced;
+        otherwise the XYZ file is streamed so that memory stays bounded by the block size.
+
+        Parameters:
+        - blockSize: int -> Maximum number of frames per block
+        - start:     int -> ID of the first frame
+        - stop:      int -> ID of the frame at which iteration stops (excluded)
+        - stride:    int -> Step between two frames
+        """
+        if self.history is not None or self.LoadCachedTrajectory():
+            self.ProcessFile()
+            ids = np.arange(self.ngeoms)[start:stop:stride]
+            for k in range(0,len(ids),blockSize):
+                blockIDs = ids[k:k+blockSize]
+                yield blockIDs, self.history[blockIDs[0]:blockIDs[-1]+1:stride]
         else:
-            if (isinstance(self.natoms,int)):
-                self.natoms = self.natoms
-            else:
-                RaiseError(message=" Program cannot set the number of atoms")
+            self.ReadHeader()
+            for blockIDs, frames in IterXYZBlocks(self.filename,self.natoms,blockSize,start,stop,stride,self.dtype):
+                yield blockIDs, frames
+
+    def GetReferenceGeometry(self,Ref_Geom=None):
+        if Ref_Geom==None:
+            self.ReadHeader()
+            return self.firstGeom
+        return self.ReadRefGeom(Ref_Geom)
+
+    def AlignFrames(self,RefGeom,frames,rotMethod="KU"):
+        return RotateGeometries(RefGeom,frames,rotMethod)
 
     def SetArgsRMSD(self,kind="Half"):
         count = 0
@@ -118,63 +218,45 @@ class File():
         return i,j
 
     def SetHistory(self):
-        self.history = dict()
-        if (self.content==None):
+        if self.history is None:
             self.ProcessFile()
-        for i in range(self.ngeoms):
-            self.history[i] = list()
-            geom            = self.content[i*self.jump:(i+1)*self.jump]
-            for j in range(2,self.jump):
-                atom = geom[j].split()[1:]
-                self.history[i].append([eval(x) for x in atom])
 
     def RotateTrajectory(self,Ref_Geom=None,rotateTraj=True,rotMethod="KU"):
         print("POLUS: Rotating trajectory")
-        if self.history==None:
+        if self.history is None:
             self.SetHistory()
-        if Ref_Geom==None:
-            RefGeom = self.history[0]
-        else:
-            RefGeom = self.ReadRefGeom(Ref_Geom)
-        if self.rotTraj==None and rotateTraj:
+        RefGeom = self.GetReferenceGeometry(Ref_Geom)
+        if self.rotTraj is None and rotateTraj:
             self.rotated    = True
-            #self.rotTraj    = dict()
-            self.rotTraj    = list()
-            for i in range(self.ngeoms):
-                Test_Geom       = self.history[i]
-                #self.rotTraj[i] = RotateGeometry(RefGeom,Test_Geom,rotMethod)
-                self.rotTraj.append(RotateGeometry(RefGeom,Test_Geom,rotMethod))
+            self.rotTraj    = self.AlignFrames(RefGeom,self.history,rotMethod)
         else:
-            self.rotated    = False
             if not rotateTraj:
-                #self.rotTraj    = dict()
-                self.rotTraj    = list()
-                for i in range(self.ngeoms):
-                    #self.rotTraj[i] = np.array(self.history[i])
-                    self.rotTraj.append(np.array(self.history[i]))
-            #elif isinstance(self.rotTraj,dict):
-            elif isinstance(self.rotTraj,list):
+                # Unrotated trajectory is a view of the history array
+                self.rotated    = False
+                self.rotTraj    = self.history
+            elif isinstance(self.rotTraj,np.ndarray):
+                # Already rotated by an earlier call
                 self.rotTraj = self.rotTraj
             else:
                 RaiseError(message= " Invalid rotated trajectory")
 
+    def NewRMSDMatrix(self,dtype=np.float64):
+        return CreateMatrixStore(self.matrixStorage,self.ngeoms,dtype,self.matrixFilename)
+
     def ComputeRMSDMatrix(self,Ref_Geom=None,rotateTraj=True,rotMethod="KU"):
         #msg_         = "Computing RMSD matrix"
         #start        = time.time()
         print("POLUS: Computing RMSD matrix")
-        if self.matrRMSD==None:
-            if self.rotTraj == None:
+        if self.matrRMSD is None:
+            if self.rotTraj is None:
                 self.RotateTrajectory(Ref_Geom,rotateTraj,rotMethod)
-            self.matrRMSD = np.zeros(shape=(self.ngeoms,self.ngeoms))
-            #PrintInfo(message = msg_)
-            #PrintOnTerminal(msg = msg_)
-            for i in range(self.ngeoms):
-                self.matrRMSD[i,i] = 0.0
-                for j in range(i+1,self.ngeoms):
-                    self.matrRMSD[i,j] = ComputeRMSD(self.rotTraj[i],self.rotTraj[j],self.rotated,self.userWeights)
-                    self.matrRMSD[j,i] = self.matrRMSD[i,j]
+            self.matrRMSD = self.NewRMSDMatrix()
+            sqrtWeights   = self.GetSqrtWeights()
+            for i in range(self.ngeoms-1):
+                row = ComputeRMSDOneToMany(self.rotTraj[i],self.rotTraj[i+1:],sqrtWeights,self.rotated,rotMethod)
+                self.matrRMSD.SetBlock(i,i+1,row[None,:])
         else:
-            if isinstance(self.matrRMSD,np.ndarray):
+            if isinstance(self.matrRMSD,MatrixStore):
                 self.matrRMSD = self.matrRMSD
             else:
                 RaiseError(message= " Invalid RMSD matrix")
@@ -186,38 +268,106 @@ class File():
 
         return rmsd
      
-    def ComputeCentroid(self,Ref_Geom=None):
+    def GetFrameWeights(self,frameWeights,nframes=None):
+        # Per-frame weights given as a list/array or as a file of one weight per line
+        if isinstance(frameWeights,str):
+            if not os.path.isfile(frameWeights):
+                RaiseError(message=f" Program cannot find frame weights file {frameWeights}")
+            frameWeights = np.loadtxt(frameWeights,ndmin=1)
+        weights = np.asarray(frameWeights,dtype=np.float64).ravel()
+        if nframes != None and len(weights) != nframes:
+            RaiseError(message=f" Number of frame weights ({len(weights)}) differs from number of geometries ({nframes})")
+        if np.any(weights < 0.0) or weights.sum() <= 0.0:
+            RaiseError(message=" Frame weights must be non-negative with a positive sum")
+        return weights
+
+    def ComputeCentroid(self,Ref_Geom=None,method="mean",frameWeights=None):
+        """
+        Centroid of the (rotated) trajectory, computed as one reduction over the frame axis.
+
+        Parameters:
+        - Ref_Geom:     str  -> Reference geometry, used if the trajectory is not rotated yet
+        - method:       str  -> "mean" (average frame) or "medoid" (frame closest to the average frame)
+        - frameWeights: list -> Per-frame weights, or file of one weight per line, of a weighted average
+        """
         print("POLUS: Computing Virtual Traj. Centroid")
-        if self.rotTraj==None:
+        if method not in CENTROID_METHODS:
+            RaiseError(message=f"Invalid centroid method {method}")
+        if self.rotTraj is None:
             self.RotateTrajectory(Ref_Geom)
-        self.centroid = list()
-        # TODO: Replace dict with list
-        #atoms    = dict()
-        atoms    = list()
-        for i in range(self.natoms):
-            atoms.append([])
-            atoms[i] = [0.0,0.0,0.0]
-            for j in range(self.ngeoms):
-                atoms[i][0] = atoms[i][0] + self.rotTraj[j][i,0]
-                atoms[i][1] = atoms[i][1] + self.rotTraj[j][i,1]
-                atoms[i][2] = atoms[i][2] + self.rotTraj[j][i,2]
-            atoms[i] = [x/self.ngeoms for x in atoms[i]]
-            self.centroid.append(atoms[i])
-
-        self.centroid = np.array(self.centroid)
+        weights       = None if frameWeights is None else self.GetFrameWeights(frameWeights,len(self.rotTraj))
+        total, count  = FrameSum(self.rotTraj,weights)
+        self.centroid = total/count
+        if method == "medoid":
+            self.medoidID, _ = ClosestFrame(self.rotTraj,self.centroid,self.GetSqrtWeights())
+            self.centroid    = np.array(self.rotTraj[self.medoidID],dtype=np.float64)
+            print(f"POLUS: Medoid is geometry # {self.medoidID}")
+
+    def ComputeStreamingCentroid(self,Ref_Geom=None,rotateTraj=True,rotMethod="KU",blockSize=1000,method="mean",frameWeights=None):
+        """
+        Same as ComputeCentroid for trajectories that do not fit in memory: frames are read
+        (and aligned) block by block, and block sums accumulated. The medoid needs a second
+        pass over the trajectory.
+
+        Parameters:
+        - Ref_Geom:     str  -> Reference geometry (first frame if None)
+        - rotateTraj:   bool -> Align every block onto the reference geometry
+        - rotMethod:    str  -> Alignment method
+        - blockSize:    int  -> Maximum number of frames per block
+        - method:       str  -> "mean" or "medoid"
+        - frameWeights: list -> Per-frame weights, or file of one weight per line, of a weighted average
+        """
+        print("POLUS: Computing Virtual Traj. Centroid (streaming)")
+        if method not in CENTROID_METHODS:
+            RaiseError(message=f"Invalid centroid method {method}")
+        RefGeom = self.GetReferenceGeometry(Ref_Geom)
+        weights = None if frameWeights is None else self.GetFrameWeights(frameWeights)
+        total   = 0.0
+        count   = 0.0
+        nframes = 0
+        for ids, frames in self.IterFrames(blockSize):
+            if weights is not None and ids[-1] >= len(weights):
+                RaiseError(message=f" Number of frame weights ({len(weights)}) is smaller than number of geometries")
+            if rotateTraj:
+                frames = self.AlignFrames(RefGeom,frames,rotMethod)
+            blockTotal, blockCount = FrameSum(frames,None if weights is None else weights[ids])
+            total   = total + blockTotal
+            count   = count + blockCount
+            nframes = nframes + len(ids)
+        if weights is not None and nframes != len(weights):
+            RaiseError(message=f" Number of frame weights ({len(weights)}) differs from number of geometries ({nframes})")
+        self.centroid = total/count
+        if method == "medoid":
+            sqrtWeights = self.GetSqrtWeights()
+            bestDev     = np.inf
+            for ids, frames in self.IterFrames(blockSize):
+                if rotateTraj:
+                    frames = self.AlignFrames(RefGeom,frames,rotMethod)
+                k, dev = ClosestFrame(frames,self.centroid,sqrtWeights)
+                if dev < bestDev:
+                    bestDev, self.medoidID, medoid = dev, int(ids[k]), np.array(frames[k],dtype=np.float64)
+            self.centroid = medoid
+            print(f"POLUS: Medoid is geometry # {self.medoidID}")
+
+    def ComputeRMSDToReference(self,Ref_Geom=None,rotMethod="KU",blockSize=1000,start=0,stop=None,stride=1):
+        """
+        Returns the (weighted) RMSD of every selected frame to the reference geometry
+        after optimal superposition. The trajectory is streamed block by block.
+        """
+        RefGeom     = self.GetReferenceGeometry(Ref_Geom)
+        sqrtWeights = self.GetSqrtWeights()
+        rmsd        = list()
+        for _, frames in self.IterFrames(blockSize,start,stop,stride):
+            rmsd.append(ComputeRMSDOneToMany(RefGeom,frames,sqrtWeights,False,rotMethod))
+        return np.concatenate(rmsd)
 
     def GetSeedGeometry(self,seedFilename=None):
         if seedFilename==None:
             self.ComputeCentroid()
         else:
-            with open(seedFilename,"r") as f:
-                content = f.readlines()[2:]
-            self.seed = list()
-            for i in range(len(content)):
-                self.seed.append([eval(x) for x in content[i].split()[1:]])
-             
+            _, seed       = ReadXYZTrajectory(seedFilename,self.dtype)
+            self.seed     = seed[0]
             self.centroid = self.seed.copy()
-            self.centroid = np.array(self.centroid)
 
     def GetAtomSymbol(self,label):
         symbol = ""
@@ -234,16 +384,11 @@ class File():
         PrintInfo(message = msg_)
         PrintOnTerminal(msg = msg_)
         if isinstance(filename,str) and os.path.isfile(filename):
-            if self.refGeom == None:
-                self.refGeom = list()
-                with open(filename,"r") as myfile:
-                    content = myfile.readlines()
-                for atom in content[2:]:
-                    atom = atom.split()[1:]
-                    if len(atom)==3:
-                        self.refGeom.append([eval(x) for x in atom])
+            if self.refGeom is None:
+                _, refGeom   = ReadXYZTrajectory(filename,self.dtype)
+                self.refGeom = refGeom[0]
             else:
-                if isinstance(self.refGeom,list) and isinstance(self.refGeom[0][0],float):
+                if isinstance(self.refGeom,np.ndarray) and self.refGeom.ndim==2:
                     self.refGeom = self.refGeom
                 else:
                     RaiseError(message="Invalid Reference Geometry")
@@ -322,7 +467,7 @@ class File():
         return listAtoms
 
     def GetSortedAtomList(self):
-        if self.atoms==None:
+        if self.atoms is None:
             self.ProcessFile()
         atoms = []
         count = 0
@@ -334,19 +479,23 @@ class File():
             count+=1
         return atoms
    
-    def ExtractSubTrajectory(self,atoms=None,geomRange=None,outputFilename=None):
+    def ExtractSubTrajectory(self,atoms=None,geomRange=None,outputFilename=None,blockSize=1000,geomIDs=None):
+        # geomRange: None (whole trajectory) or (start,stop[,stride]); geomIDs: frame IDs or INDEX file, read by seeking
         if outputFilename == None:
             outputFilename = os.path.join(os.getcwd(),"SUBTRAJECTORY.xyz")
-        if self.history   == None:
-            self.SetHistory()
         if atoms          == None:
             atoms          = [1]
-        f = open(outputFilename,"w")
         if geomRange      == None:
-            for i in range(self.ngeoms):
-                geom = self.history[i]
-                f.write(f"{len(atoms)}\n\n")
-                for j in atoms:
-                    f.write(f"{self.atoms[j-1]:<6} {geom[j-1][0]:12.6f} {geom[j-1][1]:>12.6f} {geom[j-1][2]:>12.6f}\n")
+            geomRange      = (0,None)
+        self.ReadHeader()
+        if geomIDs is not None:
+            geomIDs = ReadIndexFile(geomIDs) if isinstance(geomIDs,str) else list(geomIDs)
+            blocks  = (self.ReadFrames(geomIDs[k:k+blockSize]) for k in range(0,len(geomIDs),blockSize))
+        else:
+            blocks  = (frames for _, frames in self.IterFrames(blockSize,*geomRange))
+        columns = [j-1 for j in atoms]
+        f = open(outputFilename,"w")
+        for frames in blocks:
+            WriteXYZFrames(f,frames[:,columns],[self.atoms[j] for j in columns],[""]*len(frames),labelWidth=6,coordsFormat=" %12.6f %12.6f %12.6f\n")
 
         f.close()
@@ -0,0 +1,86 @@
+import re
+import numpy as np
+from polus.utils.logging import RaiseError
+
+DESCRIPTORS    = ["inverse-distances","coulomb"]
+ATOMIC_NUMBERS = {"H":1,"He":2,"Li":3,"Be":4,"B":5,"C":6,"N":7,"O":8,"F":9,"Ne":10,
+                  "Na":11,"Mg":12,"Al":13,"Si":14,"P":15,"S":16,"Cl":17,"Ar":18,
+                  "K":19,"Ca":20,"Fe":26,"Cu":29,"Zn":30,"Se":34,"Br":35,"I":53}
+
+
+def AtomicNumbers(labels):
+    # Atomic numbers from atom labels such as "C", "c1" or "Cl12"
+    numbers = list()
+    for label in labels:
+        symbol = re.match(r"[A-Za-z]+",str(label))
+        symbol = "" if symbol == None else symbol.group(0)
+        symbol = symbol[:2].capitalize() if symbol[:2].capitalize() in ATOMIC_NUMBERS else symbol[:1].upper()
+        if symbol not in ATOMIC_NUMBERS:
+            RaiseError(message=f" Unknown element for atom label {label}")
+        numbers.append(ATOMIC_NUMBERS[symbol])
+    return np.array(numbers,dtype=np.float64)
+
+def InverseDistances(Geoms,blockSize=1000,dtype=np.float64):
+    """
+    Inverse interatomic distances of every frame (nframes,natoms,3), i.e. rows of
+    natoms*(natoms-1)/2 entries in the pair order of scipy.spatial.distance.pdist,
+    computed for a whole block of frames at once.
+
+    Parameters:
+    - Geoms:     array -> Frames (aligned or not, the descriptor is rotation invariant)
+    - blockSize: int   -> Number of frames per block
+    - dtype:     type  -> Precision of the descriptors
+    """
+    N, natoms = Geoms.shape[0], Geoms.shape[1]
+    i, j      = np.triu_indices(natoms,k=1)
+    out       = np.empty(shape=(N,len(i)),dtype=dtype)
+    for k0 in range(0,N,blockSize):
+        G = np.asarray(Geoms[k0:k0+blockSize],dtype=np.float64)
+        out[k0:k0+len(G)] = 1.0/np.linalg.norm(G[:,i]-G[:,j],axis=2)
+    return out
+
+def CoulombEigenvalues(Geoms,Z,blockSize=1000,dtype=np.float64):
+    """
+    Eigenvalues, sorted in decreasing order, of the Coulomb matrix of every frame:
+    C_ii = 0.5*Z_i^2.4 and C_ij = Z_i*Z_j/|r_i-r_j|. The eigenvalues do not depend on
+    atom ordering within a frame, and the matrices of a block are diagonalised together.
+
+    Parameters:
+    - Geoms:     array -> Frames (nframes,natoms,3)
+    - Z:         array -> Atomic numbers (natoms)
+    - blockSize: int   -> Number of frames per block
+    - dtype:     type  -> Precision of the descriptors
+    """
+    N, natoms = Geoms.shape[0], Geoms.shape[1]
+    ZZ        = np.outer(Z,Z)
+    diag      = np.arange(natoms)
+    out       = np.empty(shape=(N,natoms),dtype=dtype)
+    for k0 in range(0,N,blockSize):
+        G    = np.asarray(Geoms[k0:k0+blockSize],dtype=np.float64)
+        D    = np.linalg.norm(G[:,:,None,:]-G[:,None,:,:],axis=3)
+        D[:,diag,diag] = 1.0
+        C    = ZZ[None,:,:]/D
+        C[:,diag,diag] = 0.5*Z**2.4
+        out[k0:k0+len(G)] = np.linalg.eigvalsh(C)[:,::-1]
+    return out
+
+def ComputeDescriptors(Geoms,kind="inverse-distances",labels=None,blockSize=1000,dtype=np.float64):
+    """
+    Fixed-length, alignment-free descriptor of every frame, whose Euclidean distances
+    can replace RMSDs in diversity-based selections.
+
+    Parameters:
+    - Geoms:     array -> Frames (nframes,natoms,3)
+    - kind:      str   -> "inverse-distances" or "coulomb" (Coulomb matrix eigenvalues)
+    - labels:    list  -> Atom labels (required for "coulomb")
+    - blockSize: int   -> Number of frames per block
+    - dtype:     type  -> Precision of the descriptors
+    """
+    if kind == "inverse-distances":
+        return InverseDistances(Geoms,blockSize,dtype)
+    elif kind == "coulomb":
+        if labels is None:
+            RaiseError(message=" Atom labels are required for Coulomb matrix descriptors")
+        return CoulombEigenvalues(Geoms,AtomicNumbers(labels),blockSize,dtype)
+    else:
+        RaiseError(message=f"Invalid descriptor {kind}")
@@ -1,22 +1,122 @@
 import os
-import tracemalloc
 import time
 import sys
 import math
-import copy
-from polus.trajectories.commons import File
+import json
+from polus.trajectories.commons import File, CENTROID_METHODS
 from polus.utils.logging import RaiseError, PrintInfo
 from polus.utils.printing import PrintOnTerminal, PrintGBMessage
-from polus.trajectories.calculators import ComputeRMSD
-import  multiprocessing as mp
+from polus.trajectories.calculators import ROTATION_METHODS, ComputeRMSDOneToMany, IterRMSDTiles, IterDistanceTiles, WeightedCoordinates, PoolRMSDKernel, FrameSum
+from polus.trajectories.descriptors import DESCRIPTORS, ComputeDescriptors
+from polus.trajectories.approximate import SelectCandidates, OrderCandidates
+from polus.trajectories.neighbours import SpatialIndex, DynamicSpatialIndex, ComputeCoverage
+from polus.trajectories.selection import FarthestPointSelector
+from polus.trajectories.readers import TailXYZBlocks, ReadIndexFile
+from polus.trajectories.parallel import SharedRMSDEngine, PartitionTiles, TileFilename
+from polus.trajectories.cache import WriteAtomically, ResultsKey
+from polus.trajectories.matrices import MATRIX_STORAGES, WrapMatrixStore, SharedMemoryModule
+from polus.trajectories.writers import FormatXYZFrames, WriteXYZFrames, WriteMatrixText, SaveDistanceMatrix, MATRIX_FORMATS
+from polus.utils.profiling import Profiler
+from multiprocessing import get_all_start_methods
 from multiprocessing.pool import ThreadPool
 import numpy as np
 
+# Options taking one of a few values: option -> (name in error messages, valid values)
+SAMPLER_CHOICES   = {"rotMethod":("rotation method",ROTATION_METHODS),
+                     "rmsdEngine":("RMSD engine",["pool","gemm"]),
+                     "precision":("precision",["float32","float64",np.float32,np.float64]),
+                     "matrixStorage":("RMSD matrix storage",MATRIX_STORAGES),
+                     "mpSM":("multiprocessing start method",[None]+get_all_start_methods()),
+                     "spatialIndex":("spatial index",[None,"balltree","kdtree"]),
+                     "approxMethod":("approximate selection method",[None,"kmeans++","coreset"]),
+                     "sampleOutput":("sample output mode",["full","manifest"]),
+                     "centroidMethod":("centroid method",CENTROID_METHODS),
+                     "metric":("diversity metric",["rmsd"]+DESCRIPTORS)}
+# Numerical options: option -> smallest valid value (None always allowed)
+SAMPLER_MINIMA    = {"ncores":1,"selectPrintPace":1,"chunkSize":1,"tileSize":1,"ntiles":1,"tileIndex":0,"checkpointPace":1,
+                     "approxOversample":1,"approxBatchSize":1,"newFramesStart":1,"pollInterval":0.0,"idleTimeout":0.0}
+# Input files: option -> name in error messages
+SAMPLER_FILES     = {"refGeomFilename":"reference geometry","seedFilename":"seed geometry","initialIndexFile":"index"}
+# Modes (see Sampler.GetModes) that cannot be combined: mode -> modes it excludes
+SAMPLER_CONFLICTS = {"descriptor metrics":["group averages","RMSD tiles"],
+                     "matrix-free selections":["RMSD tiles"],
+                     "spatial indices":["RMSD tiles"],
+                     "warm starts":["group averages","approximate selections","RMSD tiles","spatial indices"],
+                     "online selections":["group averages","approximate selections","RMSD tiles","warm starts","checkpoints"]}
+
 
 
 class Sampler(File):
-    def __init__(self,filename,ncores=16,printPace=10,performSelection=True,writeFerebusInputs=True,nbatches=None,chunkSize=500,groupAverage=False,weightsVector=None,rotateTraj=False,refGeom=None,seedGeom=None,parallel=False,natoms=None,atoms=None,sampleSize=100,systemName="MOL",outputDir=None,mpSM=None,autoStop=False,threshold=None,rotMethod="KU"):
-        super().__init__(filename,natoms,atoms)
+    """
+    Diversity-based (farthest-point) selection of the geometries of an XYZ trajectory:
+    starting from the centroid (or a seed geometry), the geometry farthest from those
+    already selected is picked until the sample sizes (or, with autoStop, the smallest
+    threshold) are reached. Distances are weighted RMSDs, or Euclidean distances between
+    descriptors. Samples, INDEX and DIVERSITY files are written to outputDir. All options
+    and their combinations are checked on construction (see CheckOptions).
+
+    Parameters:
+    - filename:           str   -> Path to the XYZ trajectory
+    - ncores:             int   -> Number of worker processes building the RMSD matrix
+    - printPace:          int   -> Number of picks between two progress lines
+    - performSelection:   bool  -> Select geometries once the RMSD matrix is built
+    - writeFerebusInputs: bool  -> Order every geometry, so that the external set follows diversity order
+    - nbatches:           int   -> Unused (batches follow from chunkSize)
+    - chunkSize:          int   -> Number of rows per batch of the RMSD matrix (frames per block online)
+    - groupAverage:       bool  -> Pick the geometry farthest from the running average of the selection
+    - weightsVector:      str   -> Atomic weights, e.g. "HL1:2", or a list of one weight per atom
+    - rotateTraj:         bool  -> Align every frame onto the reference before computing RMSDs
+    - refGeom:            str   -> XYZ file of the reference geometry (first frame if None)
+    - seedGeom:           str   -> XYZ file of the geometry the first pick is farthest from (centroid if None)
+    - parallel:           bool  -> Build the RMSD matrix with worker processes (always above 1000 geometries)
+    - natoms:             int   -> Number of atoms (read from the trajectory if None)
+    - atoms:              list  -> Atom labels (read from the trajectory if None)
+    - sampleSize:         int   -> Sample size(s) (list allowed)
+    - systemName:         str   -> Prefix of output files
+    - outputDir:          str   -> Output directory (current directory if None)
+    - mpSM:               str   -> Start method of worker processes (platform default if None)
+    - autoStop:           bool  -> Stop once the selection distance drops below the smallest threshold
+    - threshold:          float -> Threshold(s) (list allowed) of the selection distance, in angstrom for RMSDs
+    - rotMethod:          str   -> Superposition: "KU"/"K" (Kabsch-Umeyama), "R" (scipy Rotation) or "QCP"
+                                   (quaternion characteristic polynomial RMSDs of frames that are not
+                                   pre-aligned, Kabsch-Umeyama alignment with rotateTraj)
+    - cache:              bool  -> Keep parsed frames and results in a binary cache (see TrajectoryCache)
+    - cacheDir:           str   -> Directory of the cache (per-user cache directory, ~/.cache/polus, if None)
+    - rmsdEngine:         str   -> "pool" (aligned RMSDs) or "gemm" (BLAS tiles, pre-aligned trajectories)
+    - tileSize:           int   -> Number of rows/columns of RMSD matrix tiles
+    - precision:          str   -> "float32" or "float64" entries of the RMSD matrix
+    - matrixStorage:      str   -> "dense", "condensed" (upper triangle) or "memmap" (dense, on disk)
+    - matrixFilename:     str   -> Backing file of "memmap" or "condensed" matrices
+    - matrixFree:         bool  -> Compute distance rows during the selection instead of storing the matrix
+    - ntiles:             int   -> Number of tasks sharing the RMSD matrix (see SetRMSDMatrix)
+    - tileIndex:          int   -> Task computing its share of the tiles (merge step if None)
+    - tileDir:            str   -> Directory of the tiles
+    - checkpoint:         bool  -> Save completed matrix batches and the selection, and resume from them
+    - checkpointDir:      str   -> Directory of checkpoints (<SYS>-CHECKPOINT in outputDir if None)
+    - checkpointPace:     int   -> Number of picks between two selection checkpoints
+    - cacheResults:       bool  -> Reuse farthest-point orderings computed with the same settings
+    - cacheMatrix:        bool  -> Reuse in-memory RMSD matrices computed with the same settings
+    - approxMethod:       str   -> Approximate selection over "kmeans++" or "coreset" candidates (exact if None)
+    - approxOversample:   int   -> Number of coreset candidates per geometry of the largest sample
+    - approxBatchSize:    int   -> Mini-batch size of the coreset k-means
+    - randomSeed:         int   -> Seed of approximate selections
+    - spatialIndex:       str   -> "balltree" or "kdtree" neighbour queries instead of the RMSD matrix
+    - metric:             str   -> "rmsd" or a descriptor ("inverse-distances", "coulomb")
+    - initialIndexFile:   str   -> INDEX file of a previous selection to continue (warm start)
+    - newFramesStart:     int   -> ID of the first frame appended since the previous selection
+    - online:             bool  -> Select frames of a trajectory still being written (see SelectOnline)
+    - pollInterval:       float -> Seconds between two checks for new frames (online)
+    - idleTimeout:        float -> Seconds without new frames after which online selections stop
+    - profile:            bool  -> Time every stage and write a report
+    - profileReport:      str   -> Report file (<SYS>-PROFILE.json in outputDir if None, .csv allowed)
+    - centroidMethod:     str   -> "mean" (of aligned frames) or "medoid" (descriptor medoid with a
+                                   descriptor metric) centroid
+    - frameWeights:       list  -> Weights of the frames in the centroid (file of one weight per line allowed)
+    - sampleOutput:       str   -> "full" (one XYZ file per sample) or "manifest" (nested samples as
+                                   JSON prefixes of the largest one)
+    """
+    def __init__(self,filename,ncores=16,printPace=10,performSelection=True,writeFerebusInputs=True,nbatches=None,chunkSize=500,groupAverage=False,weightsVector=None,rotateTraj=False,refGeom=None,seedGeom=None,parallel=False,natoms=None,atoms=None,sampleSize=100,systemName="MOL",outputDir=None,mpSM=None,autoStop=False,threshold=None,rotMethod="KU",cache=True,cacheDir=None,rmsdEngine="pool",tileSize=2048,precision="float32",matrixStorage="dense",matrixFilename=None,matrixFree=False,ntiles=None,tileIndex=None,tileDir=None,checkpoint=False,checkpointDir=None,checkpointPace=100,cacheResults=True,cacheMatrix=False,approxMethod=None,approxOversample=4,approxBatchSize=4096,randomSeed=None,spatialIndex=None,metric="rmsd",initialIndexFile=None,newFramesStart=None,online=False,pollInterval=1.0,idleTimeout=60.0,profile=False,profileReport=None,centroidMethod="mean",frameWeights=None,sampleOutput="full"):
+        super().__init__(filename,natoms=natoms,atoms=atoms,cache=cache,cacheDir=cacheDir,matrixStorage=matrixStorage,matrixFilename=matrixFilename)
         self.divIndexFiles   = None
         self.samplePool      = None
         self.largestSubSample= None
@@ -35,6 +135,9 @@ class Sampler(File):
         self.writeFBSInputs  = writeFerebusInputs
         self.seedFilename    = seedGeom
         self.tmpcentroid     = None
+        self.poolKernel      = None
+        self.matrixFree      = matrixFree
+        self.selector        = None
         if isinstance(sampleSize,int):
             self.sampleSize  = [sampleSize]
         elif isinstance(sampleSize,list) and isinstance(sampleSize[0],int):
@@ -42,6 +145,8 @@ class Sampler(File):
         else:
             RaiseError(message="Invalid Sample Size")
         self.selectedXYZ     = None
+        self.sampleText      = None
+        self.sampleMaster    = None
         self.outputDir       = outputDir
         self.parallel        = parallel
         self.autoStop        = autoStop
@@ -50,100 +155,474 @@ class Sampler(File):
         self.systemName      = systemName
         self.rotateTraj      = rotateTraj
         self.rotMethod       = rotMethod
-        if mpSM == None:
-            self.mpSM        = "spawn"
-        else:
-            self.mpSM        = mpSM
-
-        if isinstance(threshold,float):
+        self.rmsdEngine      = rmsdEngine
+        self.tileSize        = tileSize
+        self.precision       = precision
+        self.ntiles          = ntiles
+        self.tileIndex       = tileIndex
+        self.tileDir         = tileDir
+        self.checkpoint      = checkpoint
+        self.checkpointDir   = checkpointDir
+        self.checkpointPace  = checkpointPace
+        self.cacheResults    = cacheResults
+        self.cacheMatrix     = cacheMatrix
+        self.resultsKey      = None
+        self.approxMethod    = approxMethod
+        self.approxOversample= approxOversample
+        self.approxBatchSize = approxBatchSize
+        self.randomSeed      = randomSeed
+        self.spatialIndex    = spatialIndex
+        self.index           = None
+        self.weightedCoords  = None
+        self.metric          = metric
+        self.descriptors     = None
+        self.descCentroid    = None
+        self.initialIndexFile= initialIndexFile
+        self.newFramesStart  = newFramesStart
+        self.newFramesKernel = None
+        self.newFramesRef    = None
+        self.newFrames       = None
+        self.previousFrames  = None
+        self.online          = online
+        self.pollInterval    = pollInterval
+        self.idleTimeout     = idleTimeout
+        self.profiler        = Profiler(profile)
+        self.profileReport   = profileReport
+        self.centroidMethod  = centroidMethod
+        self.frameWeights    = frameWeights
+        self.sampleOutput    = sampleOutput
+        # Worker processes use the platform's default start method unless mpSM is given
+        self.mpSM            = mpSM
+        if isinstance(threshold,(int,float)):
             self.threshold = [threshold]
         elif threshold==None:
             self.threshold = [0.05]
         else:
             self.threshold = threshold
+        self.CheckOptions()
+        self.precision       = np.dtype(self.precision)
+        if self.matrixStorage == "memmap" and self.matrixFilename == None:
+            outDir              = os.getcwd() if self.outputDir == None else self.outputDir
+            self.matrixFilename = os.path.join(outDir,self.systemName.upper()+"-RMSD-MATRIX.mmap")
+        if self.checkpoint and self.checkpointDir == None:
+            outDir              = os.getcwd() if self.outputDir == None else self.outputDir
+            self.checkpointDir  = os.path.join(outDir,self.systemName.upper()+"-CHECKPOINT")
+        if profile and self.profileReport == None:
+            outDir              = os.getcwd() if self.outputDir == None else self.outputDir
+            self.profileReport  = os.path.join(outDir,self.systemName.upper()+"-PROFILE.json")
+
+    def GetModes(self):
+        # Selection modes switched on by the options
+        return {"descriptor metrics":self.metric != "rmsd","group averages":self.groupAverage,"matrix-free selections":self.matrixFree,
+                "approximate selections":self.approxMethod != None,"RMSD tiles":self.ntiles != None,"spatial indices":self.spatialIndex != None,
+                "warm starts":self.initialIndexFile != None,"online selections":self.online,"checkpoints":self.checkpoint}
+
+    def CheckOptions(self):
+        # All option values and combinations are checked here, before the trajectory is read
+        for option, (name, values) in SAMPLER_CHOICES.items():
+            if getattr(self,option) not in values:
+                RaiseError(message=f"Invalid {name} {getattr(self,option)}")
+        for option, minimum in SAMPLER_MINIMA.items():
+            if getattr(self,option) != None and getattr(self,option) < minimum:
+                RaiseError(message=f"Invalid {option} {getattr(self,option)} (smallest valid value {minimum})")
+        for option, name in SAMPLER_FILES.items():
+            if getattr(self,option) != None and not os.path.isfile(getattr(self,option)):
+                RaiseError(message=f" Program cannot find {name} file {getattr(self,option)}")
+        if min(self.sampleSize) < 1 or min(self.threshold) <= 0.0:
+            RaiseError(message=" Sample sizes and thresholds must be positive")
+        if self.tileIndex != None and (self.ntiles == None or self.tileIndex >= self.ntiles):
+            RaiseError(message=f" Invalid tile index {self.tileIndex} (number of tiles {self.ntiles})")
+        modes = self.GetModes()
+        for mode, excluded in SAMPLER_CONFLICTS.items():
+            conflicts = [other for other in excluded if modes[mode] and modes[other]]
+            if len(conflicts) > 0:
+                listed = conflicts[0] if len(conflicts) == 1 else ", ".join(conflicts[:-1])+" or "+conflicts[-1]
+                RaiseError(message=f" {mode.capitalize()} are not available with {listed}")
+        if self.metric == "rmsd" and not self.rotateTraj and (modes["spatial indices"] or modes["approximate selections"] or self.rmsdEngine == "gemm"):
+            RaiseError(message=" Spatial indices, approximate selections and the GEMM RMSD engine require a pre-aligned trajectory (rotateTraj=True)")
+        if modes["warm starts"] and self.newFramesStart == None:
+            RaiseError(message=" A warm start (initialIndexFile) requires the ID of the first new frame (newFramesStart)")
+
+    def __getstate__(self):
+        # Worker processes never need the (possibly huge or disk-backed) RMSD matrix
+        state = self.__dict__.copy()
+        state["matrRMSD"] = None
+        state["index"]    = None
+        state["poolKernel"] = None
+        state["newFramesKernel"] = None
+        return state
 
-        tracemalloc.start()
+    def IsFullOrdering(self):
+        # FEREBUS inputs need the ordering of every geometry, which approximate selections do not provide
+        return self.writeFBSInputs and self.approxMethod == None
 
     def UpdateSampleSize(self,condition):
         if condition:
-            self.sampleSize.append(len(self.samplePool))
+            # Geometries of a warm start are already selected when the pool is ordered
+            self.sampleSize.append(len(self.samplePool)+(0 if self.selectedGeoms == None else len(self.selectedGeoms)))
         else:
             self.sampleSize=self.sampleSize
 
-    def SetRMSDMatrix(self):
-        print(f"POLUS: Traced memory {tracemalloc.get_traced_memory()}")
+    def LoadAndRotate(self):
+        # Reading and alignment of the trajectory, profiled as two stages
+        with self.profiler.Stage("loading"):
+            self.SetHistory()
+        with self.profiler.Stage("rotation"):
+            self.RotateTrajectory(self.refGeomFilename,self.rotateTraj,self.rotMethod)
+
+    def SetSamplePool(self):
         # Rotate Trajectory
-        self.RotateTrajectory(self.refGeomFilename,self.rotateTraj,self.rotMethod)
+        self.LoadAndRotate()
         # Set sample pool
-        #if not isinstance(self.rotTraj,dict):
-        if not isinstance(self.rotTraj,list):
+        if not isinstance(self.rotTraj,np.ndarray):
             RaiseError(message=" Unable to execute diversity-based sampling")
         else:
-            #self.samplePool = [x for x in self.rotTraj.keys()]
             self.samplePool = [x for x in range(len(self.rotTraj))]
+        if self.checkpoint:
+            self.CheckCheckpointMetadata()
         # Compute Seed/Centroid
-        if self.seedFilename == None:
-            self.ComputeCentroid()
+        with self.profiler.Stage("centroid"):
+            if self.seedFilename == None:
+                self.ComputeSampleCentroid()
+            else:
+                self.GetSeedGeometry(self.seedFilename)
+
+    def ComputeSampleCentroid(self):
+        # Descriptor distances do not need aligned frames, but the centroid geometry does: the mean is taken
+        # over frames aligned onto the reference block by block, the medoid is the frame of the descriptor medoid
+        if self.metric == "rmsd" or (self.rotated and self.centroidMethod == "mean"):
+            self.ComputeCentroid(method=self.centroidMethod,frameWeights=self.frameWeights)
+        elif self.centroidMethod == "medoid":
+            self.GetDescriptorCentroid()
+            self.centroid = np.array(self.rotTraj[self.medoidID],dtype=np.float64)
+            print(f"POLUS: Medoid is geometry # {self.medoidID}")
         else:
-            self.GetSeedGeometry(self.seedFilename)
+            print("POLUS: Computing Virtual Traj. Centroid of the frames aligned onto the reference")
+            RefGeom = self.GetReferenceGeometry(self.refGeomFilename)
+            weights = None if self.frameWeights is None else self.GetFrameWeights(self.frameWeights,len(self.rotTraj))
+            total   = 0.0
+            count   = 0.0
+            for i0 in range(0,len(self.rotTraj),self.chunkSize):
+                frames                 = self.AlignFrames(RefGeom,self.rotTraj[i0:i0+self.chunkSize],self.rotMethod)
+                blockTotal, blockCount = FrameSum(frames,None if weights is None else weights[i0:i0+self.chunkSize])
+                total                  = total + blockTotal
+                count                  = count + blockCount
+            self.centroid = total/count
 
-        # Compute RMSD matrix
-        print(f"POLUS: Traced memory {tracemalloc.get_traced_memory()}")
-        if self.parallel or self.ngeoms>1000:
-            # Checking user-defined chunk size
-            if self.chunkSize > self.ngeoms:
-                self.chunkSize = self.ngeoms
-            # Init RMSD matrix
-            self.matrRMSD  = np.zeros(shape=(self.ngeoms,self.ngeoms),dtype=np.float32)
-            ngeometries    = self.matrRMSD.shape[0]
-            nelements      = ngeometries*ngeometries
-            nSubBlocks     = math.ceil(ngeometries/float(self.chunkSize))
-            print(f"POLUS: Traced memory {tracemalloc.get_traced_memory()}")
-            if self.nbatches == None:
-                self.nbatches = math.ceil(ngeometries/float(self.chunkSize))
-            print(f"POLUS:{' # Geometries in dataset':<30} {ngeometries:>45}")
-            print(f"POLUS:{' # Entries of RMSD matrix':<30} {nelements:>45}")
-            print(f"POLUS:{' # Sub-Blocks of RMSD matrix':<30} {nSubBlocks:>45}")
-            print(f"POLUS:{' # Batches for computing RMSD matrix':<40} {self.nbatches:>35}")
-            print(f"POLUS: Filling in the RMSD matrix. This step can take a very long time!!!")
-            print(f"POLUS: Filling in the RMSD matrix. This step can take a very long time!!!")
-            print(f"POLUS: Filling in the RMSD matrix. This step can take a very long time!!!")
-            # Set list of arguments (indices)
-            #self.SetArgsRMSD(kind="Full")
-            # Fill in sub-blocks of RMSD Matrix
-            lwbound     = 0
-            print(f"POLUS: Traced memory {tracemalloc.get_traced_memory()}")
-            for n in range(self.nbatches):
-                upbound = ngeometries*self.chunkSize*(n+1)
-                dim_max = (n+1)*self.chunkSize
-                if dim_max<=ngeometries:
-                    list_args           = [x for x in range(lwbound,upbound)]
-                    self.tempRMSDMatrix = np.zeros(shape=(self.chunkSize*self.ngeoms),dtype=np.float32)
-                else:
-                    remGeoms            = ngeometries - n*self.chunkSize
-                    list_args           = [x for x in range(lwbound,nelements)]
-                    self.tempRMSDMatrix = np.zeros(shape=(remGeoms*self.ngeoms),dtype=np.float32)
-                print(f"POLUS: Creating new pool of processes for batch # {n+1}")
-                print(f"POLUS: Traced memory {tracemalloc.get_traced_memory()}")
-                with mp.Pool(processes=self.ncores) as p:
-                    results=p.map(func=self.FillRMSDMatrix,iterable=list_args) 
-                # Collecting results
-                for i, result in enumerate(results,start=0):
-                    self.tempRMSDMatrix[i] = result
-                lwbound     = upbound
-                # Transfer data from block to big matrix
-                for j in range(len(list_args)):
-                    arg1,arg2 = self.GetArgRMSD(list_args[j])
-                    self.matrRMSD[arg1,arg2] = self.tempRMSDMatrix[j] 
-                self.tempRMSDMatrix            = None
-                print(f"POLUS: Destroying processes")
-                print(f"POLUS: Traced memory {tracemalloc.get_traced_memory()}")
+    def IsTileTask(self):
+        # A tile task only computes and saves its own share of the RMSD matrix
+        return self.ntiles != None and self.tileIndex != None
+
+    def GetMatrixMetadata(self):
+        # Settings that must be shared by all tasks and runs contributing to one RMSD matrix
+        return {"filename":os.path.abspath(self.filename),"ngeoms":self.ngeoms,"tileSize":self.tileSize,"dtype":self.precision.str,
+                "rotated":self.rotated,"rotMethod":self.rotMethod,"refGeom":self.refGeomFilename,"weights":self.GetSqrtWeights().tolist(),
+                "metric":self.metric}
+
+    def CheckMetadata(self,metaFilename,meta,write=False):
+        # Files next to metaFilename may only be reused by runs with the same settings
+        if os.path.isfile(metaFilename):
+            with open(metaFilename,"r") as f:
+                if json.load(f) != meta:
+                    RaiseError(message=f" Files in {os.path.dirname(metaFilename)} were computed with different settings")
+        elif write:
+            if not os.path.isdir(os.path.dirname(metaFilename)):
+                os.makedirs(os.path.dirname(metaFilename),exist_ok=True)
+            WriteAtomically(metaFilename,lambda f: f.write(json.dumps(meta).encode()))
         else:
-            Ref_Geom=None
-            self.ComputeRMSDMatrix(Ref_Geom,self.rotateTraj,self.rotMethod)
-        print(f"POLUS: RMSD matrix successfully built !!!")
-        print(f"POLUS: RMSD matrix successfully built !!!")
-        print(f"POLUS: RMSD matrix successfully built !!!")
+            RaiseError(message=f" No files found in {os.path.dirname(metaFilename)}")
+
+    def CheckTileMetadata(self,write=False):
+        self.CheckMetadata(os.path.join(self.tileDir,"TILES.json"),self.GetMatrixMetadata(),write)
+
+    def CheckCheckpointMetadata(self):
+        meta = self.GetMatrixMetadata()
+        meta.update({"chunkSize":self.chunkSize,"seed":self.seedFilename,"groupAverage":self.groupAverage,"matrixFree":self.matrixFree})
+        self.CheckMetadata(os.path.join(self.checkpointDir,"CHECKPOINT.json"),meta,write=True)
+
+    def BatchCheckpoint(self,firstRow):
+        return os.path.join(self.checkpointDir,f"BATCH-{firstRow}.npy")
+
+    def SaveBatchCheckpoint(self,firstRow,lastRow):
+        # Upper-triangle part of the rows of a completed batch
+        block = self.matrRMSD.Rows(np.arange(firstRow,lastRow),np.arange(firstRow,self.ngeoms))
+        WriteAtomically(self.BatchCheckpoint(firstRow),lambda f: np.save(f,block))
+
+    def LoadBatchCheckpoint(self,firstRow):
+        if not self.checkpoint or not os.path.isfile(self.BatchCheckpoint(firstRow)):
+            return False
+        self.matrRMSD.SetBlock(firstRow,firstRow,np.load(self.BatchCheckpoint(firstRow)))
+        return True
+
+    def SelectionCheckpoint(self):
+        return os.path.join(self.checkpointDir,"SELECTION.npz")
+
+    def GetSelectionState(self):
+        state = {"selectedGeoms":np.array(self.selectedGeoms,dtype=np.int64),"smallestRMSDs":np.array(self.smallestRMSDs,dtype=np.float64)}
+        if self.selector is not None:
+            state["minDist"]     = self.selector.minDist
+        if self.groupAverage:
+            state["centroid"]    = np.asarray(self.centroid)
+            state["tmpcentroid"] = np.asarray(self.tmpcentroid)
+        return state
+
+    def RestoreSelection(self,state,size=None):
+        # A prefix (size) of a selection is restored without its min-distance state, which it cannot be extended from
+        self.selectedGeoms = np.asarray(state["selectedGeoms"][:size]).tolist()
+        self.smallestRMSDs = np.asarray(state["smallestRMSDs"][:size]).tolist()
+        selected           = set(self.selectedGeoms)
+        self.samplePool    = [x for x in self.samplePool if x not in selected]
+        if "minDist" in state and (size == None or size == len(state["selectedGeoms"])):
+            self.selector                   = FarthestPointSelector(self.ngeoms,self.GetDistanceRow,NeighbourRow=self.GetSelectorNeighbourRow())
+            self.selector.minDist           = np.array(state["minDist"])
+            self.selector.selected          = self.selectedGeoms.copy()
+            self.selector.smallestDistances = self.smallestRMSDs.copy()
+        if "centroid" in state and (size == None or size == len(state["selectedGeoms"])):
+            self.centroid      = np.array(state["centroid"])
+            self.tmpcentroid   = np.array(state["tmpcentroid"])
+        elif "centroid" in state:
+            # Running average of the restored prefix
+            self.centroid      = np.mean(self.rotTraj[self.selectedGeoms],axis=0)
+            self.tmpcentroid   = self.centroid
+
+    def SaveSelectionCheckpoint(self):
+        state = self.GetSelectionState()
+        WriteAtomically(self.SelectionCheckpoint(),lambda f: np.savez(f,**state))
+
+    def LoadSelectionCheckpoint(self):
+        if not self.checkpoint or not os.path.isfile(self.SelectionCheckpoint()):
+            return
+        # Checkpoints of a run with larger sample sizes (or smaller thresholds) are cut to the requested selection
+        state = np.load(self.SelectionCheckpoint())
+        size  = self.GetRequestedSelectionSize(state["smallestRMSDs"])
+        self.RestoreSelection(state,size)
+        if size == None:
+            print(f"POLUS: Resuming selection from checkpoint ({len(self.selectedGeoms)} geometries selected)")
+        else:
+            print(f"POLUS: Selection of {size} geometries read from checkpoint")
+
+    def ClearCheckpoint(self):
+        # Checkpoint files are only kept until the run they belong to completes
+        if not self.checkpoint or not os.path.isdir(self.checkpointDir):
+            return
+        for entry in os.listdir(self.checkpointDir):
+            if entry in ["SELECTION.npz","CHECKPOINT.json"] or (entry.startswith("BATCH-") and entry.endswith(".npy")):
+                os.remove(os.path.join(self.checkpointDir,entry))
+        if len(os.listdir(self.checkpointDir)) == 0:
+            os.rmdir(self.checkpointDir)
+
+    def GetMatrixDtype(self):
+        # Precision the distances are actually stored with, which depends on the path building them
+        if self.matrixFree or self.spatialIndex != None:
+            return np.dtype(np.float64)
+        if self.ntiles != None or self.metric != "rmsd" or self.rmsdEngine == "gemm":
+            return self.precision
+        if (self.parallel or self.ngeoms>1000) and SharedMemoryModule() != None:
+            return np.dtype(np.float32)
+        return np.dtype(np.float64)
+
+    def GetResultsKey(self):
+        # Content address of the RMSD matrix and of the farthest-point ordering
+        if self.resultsKey == None:
+            fields          = {"trajectory":self.cache.Key()["hash"],"weights":self.userWeights,"rotMethod":self.rotMethod,
+                               "rotateTraj":self.rotateTraj,"refGeom":self.refGeomFilename,"seed":self.seedFilename,
+                               "metric":self.metric,"centroid":self.centroidMethod,"precision":self.GetMatrixDtype().str,
+                               "rmsdEngine":self.rmsdEngine,"matrixStorage":self.matrixStorage,
+                               "frameWeights":self.frameWeights if self.frameWeights is None or isinstance(self.frameWeights,str) else np.asarray(self.frameWeights,dtype=np.float64).tolist()}
+            self.resultsKey = ResultsKey(fields)
+        return self.resultsKey
+
+    def GetMatrixCacheName(self):
+        # Only in-memory stores are cached, memory-mapped ones already live in their own file
+        kind = {"dense":"DenseMatrix","condensed":"CondensedMatrix"}.get(self.matrixStorage)
+        if self.cache == None or not self.cacheMatrix or kind == None:
+            return None, None
+        return kind, "rmsd-"+kind+"-"+self.GetResultsKey()
+
+    def LoadCachedRMSDMatrix(self):
+        kind, name = self.GetMatrixCacheName()
+        data       = None if name == None else self.cache.Load(name)
+        if data is None:
+            return False
+        self.matrRMSD = WrapMatrixStore(kind,self.ngeoms,data)
+        print(f"POLUS: RMSD matrix read from cache {self.cache.EntryPath(name)}")
+        return True
+
+    def SaveCachedRMSDMatrix(self):
+        kind, name = self.GetMatrixCacheName()
+        if name != None and self.cache.Load(name) is None:
+            self.cache.Save(name,self.matrRMSD.data)
+
+    def GetOrderingCacheName(self,field):
+        return "fps-"+self.GetResultsKey()+"-"+field
+
+    def LoadCachedOrdering(self):
+        # Longest farthest-point ordering computed so far with the same settings (group averages are not cached)
+        if self.cache == None or not self.cacheResults or self.groupAverage or self.approxMethod != None or self.initialIndexFile != None:
+            return None
+        state = dict()
+        for field in ["selectedGeoms","smallestRMSDs","minDist"]:
+            array = self.cache.Load(self.GetOrderingCacheName(field))
+            if array is not None:
+                state[field] = array
+        if "selectedGeoms" not in state or "smallestRMSDs" not in state:
+            return None
+        return state
+
+    def SaveCachedOrdering(self):
+        if self.cache == None or not self.cacheResults or self.groupAverage or self.approxMethod != None or self.initialIndexFile != None:
+            return
+        state = self.LoadCachedOrdering()
+        if state is None or len(state["selectedGeoms"]) < len(self.selectedGeoms):
+            for field, array in self.GetSelectionState().items():
+                self.cache.Save(self.GetOrderingCacheName(field),array)
+
+    def GetRequestedSelectionSize(self,smallestRMSDs):
+        # Number of picks answering the requested sample sizes (or thresholds), None if smallestRMSDs is too short
+        if not self.autoStop:
+            size = min(max(self.sampleSize+([self.ngeoms] if self.IsFullOrdering() else [])),self.ngeoms)
+            return size if size <= len(smallestRMSDs) else None
+        below = np.nonzero(np.asarray(smallestRMSDs) <= min(self.threshold))[0]
+        if len(below) > 0:
+            return int(below[0])+1
+        return len(smallestRMSDs) if len(smallestRMSDs) == self.ngeoms else None
+
+    def IsSelectionCached(self):
+        # The key depends on the number of frames through the matrix precision
+        with self.profiler.Stage("loading"):
+            self.SetHistory()
+        state = self.LoadCachedOrdering()
+        if state is None:
+            return False
+        return self.GetRequestedSelectionSize(state["smallestRMSDs"]) != None
+
+    def LoadCachedSelection(self):
+        state = self.LoadCachedOrdering()
+        if state is None:
+            return
+        size  = self.GetRequestedSelectionSize(state["smallestRMSDs"])
+        if size == None and "minDist" not in state:
+            return
+        self.RestoreSelection(state,size)
+        if size == None:
+            print(f"POLUS: Extending cached ordering of {len(self.selectedGeoms)} geometries")
+        else:
+            print(f"POLUS: Selection of {size} geometries read from cached ordering")
+
+    def CheckpointSelection(self):
+        if self.checkpoint and len(self.selectedGeoms)%self.checkpointPace==0:
+            self.SaveSelectionCheckpoint()
+
+    def ComputeRMSDTiles(self):
+        if not 0 <= self.tileIndex < self.ntiles:
+            RaiseError(message=f" Invalid tile index {self.tileIndex} (number of tiles {self.ntiles})")
+        if not os.path.isdir(self.tileDir):
+            os.makedirs(self.tileDir,exist_ok=True)
+        self.CheckTileMetadata(write=True)
+        tiles = PartitionTiles(self.ngeoms,self.tileSize,self.ntiles,self.tileIndex)
+        # Tiles saved by an earlier (interrupted) run of the same task are not recomputed
+        todo  = [tile for tile in tiles if not os.path.isfile(TileFilename(self.tileDir,tile))]
+        print(f"POLUS: Computing {len(todo)} of {len(tiles)} RMSD tiles of task {self.tileIndex+1}/{self.ntiles} in {self.tileDir}")
+        if len(todo) > 0:
+            with SharedRMSDEngine(self.rotTraj,self.GetSqrtWeights(),None,self.rotated,self.rotMethod,self.ncores,self.tileSize,self.mpSM) as engine:
+                engine.SaveTiles(todo,self.tileDir,self.precision)
+
+    def MergeRMSDTiles(self):
+        self.CheckTileMetadata()
+        tiles   = PartitionTiles(self.ngeoms,self.tileSize)
+        missing = [TileFilename(self.tileDir,tile) for tile in tiles if not os.path.isfile(TileFilename(self.tileDir,tile))]
+        if len(missing) > 0:
+            RaiseError(message=f" {len(missing)} of {len(tiles)} RMSD tiles are missing (e.g. {missing[0]})")
+        print(f"POLUS: Merging {len(tiles)} RMSD tiles from {self.tileDir}")
+        self.matrRMSD = self.NewRMSDMatrix(self.precision)
+        for tile in tiles:
+            self.matrRMSD.SetBlock(tile[0],tile[2],np.load(TileFilename(self.tileDir,tile)))
+        self.matrRMSD.Flush()
+
+    def SetRMSDMatrix(self,tileIndex=None,ntiles=None):
+        """
+        Builds the RMSD matrix. With a tile partition (ntiles and tileIndex set) only the
+        tiles of task tileIndex out of ntiles are computed and saved to tileDir, e.g. by one
+        scheduler array task each; with ntiles set and no tileIndex the saved tiles are
+        merged into the RMSD matrix.
+
+        Parameters:
+        - tileIndex: int -> Index of this task in [0,ntiles)
+        - ntiles:    int -> Number of tasks sharing the RMSD matrix
+        """
+        if tileIndex != None:
+            self.tileIndex = tileIndex
+        if ntiles != None:
+            self.ntiles    = ntiles
+        if self.ntiles != None and self.tileDir == None:
+            outDir         = os.getcwd() if self.outputDir == None else self.outputDir
+            self.tileDir   = os.path.join(outDir,self.systemName.upper()+"-RMSD-TILES")
+        if self.IsTileTask():
+            self.LoadAndRotate()
+            with self.profiler.Stage("matrix"):
+                self.ComputeRMSDTiles()
+            return
+        self.SetSamplePool()
+        # Compute RMSD matrix
+        with self.profiler.Stage("matrix"):
+            if self.LoadCachedRMSDMatrix():
+                return
+            elif self.ntiles != None:
+                self.MergeRMSDTiles()
+            elif self.metric != "rmsd":
+                print(f"POLUS: Filling in the {self.metric} distance matrix with BLAS tiles of size {self.tileSize}")
+                self.matrRMSD = self.NewRMSDMatrix(self.precision)
+                for i0, j0, tile in IterDistanceTiles(self.GetWeightedCoordinates(self.precision),self.tileSize):
+                    self.matrRMSD.SetBlock(i0,j0,tile)
+            elif self.rmsdEngine == "gemm":
+                print(f"POLUS: Filling in the RMSD matrix with BLAS tiles of size {self.tileSize}")
+                self.matrRMSD = self.NewRMSDMatrix(self.precision)
+                for i0, j0, tile in IterRMSDTiles(self.rotTraj,self.GetSqrtWeights(),self.tileSize,self.precision):
+                    self.matrRMSD.SetBlock(i0,j0,tile)
+            elif (self.parallel or self.ngeoms>1000) and SharedMemoryModule() != None:
+                # Checking user-defined chunk size
+                if self.chunkSize > self.ngeoms:
+                    self.chunkSize = self.ngeoms
+                # Init RMSD matrix
+                self.matrRMSD  = self.NewRMSDMatrix(self.GetMatrixDtype())
+                ngeometries    = self.matrRMSD.shape[0]
+                nelements      = ngeometries*ngeometries
+                nSubBlocks     = math.ceil(ngeometries/float(self.chunkSize))
+                if self.nbatches == None:
+                    self.nbatches = math.ceil(ngeometries/float(self.chunkSize))
+                print(f"POLUS:{' # Geometries in dataset':<30} {ngeometries:>45}")
+                print(f"POLUS:{' # Entries of RMSD matrix':<30} {nelements:>45}")
+                print(f"POLUS:{' # Sub-Blocks of RMSD matrix':<30} {nSubBlocks:>45}")
+                print(f"POLUS:{' # Batches for computing RMSD matrix':<40} {self.nbatches:>35}")
+                print("POLUS: Filling in the RMSD matrix. This step can take a very long time!!!")
+                print("POLUS: Filling in the RMSD matrix. This step can take a very long time!!!")
+                print("POLUS: Filling in the RMSD matrix. This step can take a very long time!!!")
+                # Set list of arguments (indices)
+                #self.SetArgsRMSD(kind="Full")
+                # Fill in sub-blocks of RMSD Matrix (upper triangle only, the store handles symmetry)
+                # Workers share coordinates and matrix, and only receive tile coordinates
+                print("POLUS: Creating pool of processes sharing coordinates and RMSD matrix")
+                with SharedRMSDEngine(self.rotTraj,self.GetSqrtWeights(),self.matrRMSD,self.rotated,self.rotMethod,self.ncores,self.tileSize,self.mpSM) as engine:
+                    for n in range(self.nbatches):
+                        firstRow  = n*self.chunkSize
+                        lastRow   = min((n+1)*self.chunkSize,ngeometries)
+                        if self.LoadBatchCheckpoint(firstRow):
+                            print(f"POLUS: Batch # {n+1} (rows {firstRow+1}-{lastRow}) restored from checkpoint")
+                            continue
+                        print(f"POLUS: Computing batch # {n+1} (rows {firstRow+1}-{lastRow})")
+                        engine.ComputeRows(firstRow,lastRow)
+                        if self.checkpoint:
+                            self.SaveBatchCheckpoint(firstRow,lastRow)
+                print("POLUS: Destroying processes")
+            else:
+                if self.parallel:
+                    print("POLUS: No shared memory before Python 3.8, the RMSD matrix is built in a single process")
+                Ref_Geom=None
+                self.ComputeRMSDMatrix(Ref_Geom,self.rotateTraj,self.rotMethod)
+            print("POLUS: RMSD matrix successfully built !!!")
+            print("POLUS: RMSD matrix successfully built !!!")
+            print("POLUS: RMSD matrix successfully built !!!")
+            self.SaveCachedRMSDMatrix()
 
 
     def GenerateSample(self):
@@ -155,8 +634,9 @@ class Sampler(File):
             #else:
             #    for i in range(len(self.selectedGeoms)):
             #        self.selectedXYZ[i] = np.array(self.history[self.selectedGeoms[i]])
+            frames               = self.ReadFrames(self.selectedGeoms)
             for i in range(len(self.selectedGeoms)):
-                self.selectedXYZ[i] = np.array(self.history[self.selectedGeoms[i]])
+                self.selectedXYZ[i] = frames[i]
 
     def WriteRotatedXYZTraj(self,outputFilename=None):
         # Set outputDir
@@ -176,14 +656,7 @@ class Sampler(File):
         self.RotateTrajectory(self.refGeomFilename)
         # Write Output Filename
         with open(outputFilename,"w") as myfile:
-            #for key in self.rotTraj.keys():
-            for key in range(len(self.rotTraj)):
-                myfile.write(str(self.natoms)+"\n")
-                myfile.write("GEOM-"+str(key)+"\n")
-                geom = self.rotTraj[key].tolist()
-                for i in range(self.natoms):
-                    atom = geom[i]
-                    myfile.write(f"{self.atoms[i][0]:<5} {atom[0]:>12.8f} {atom[1]:>12.8f} {atom[2]:>12.8f} \n")
+            WriteXYZFrames(myfile,self.rotTraj,[atom[0] for atom in self.atoms],["GEOM-"+str(key) for key in range(len(self.rotTraj))])
 
 
     def WriteSampleXYZ(self,sample_filename=None):
@@ -197,14 +670,97 @@ class Sampler(File):
             sample_filename = os.path.join(outDir,self.systemName.upper()+"-SAMPLE-"+str(len(self.selectedGeoms))+".xyz")
             if os.path.isfile(sample_filename):
                 os.remove(sample_filename)
+        # Samples of several sizes share their leading frames: the text of the largest one is reused
+        keys  = list(self.selectedXYZ.keys())
+        if self.sampleText == None or self.sampleText["keys"][:len(keys)] != keys or self.sampleText["geoms"][:len(keys)] != list(self.selectedGeoms[:len(keys)]):
+            frames          = np.array([self.selectedXYZ[key] for key in keys]).reshape(len(keys),self.natoms,3)
+            self.sampleText = {"keys":keys,"geoms":list(self.selectedGeoms[:len(keys)]),
+                               "frames":FormatXYZFrames(frames,[atom[0] for atom in self.atoms],["GEOM-"+str(key) for key in keys])}
         with open(sample_filename,"w") as myfile:
-            for key in self.selectedXYZ.keys():
-                myfile.write(str(self.natoms)+"\n")
-                myfile.write("GEOM-"+str(key)+"\n")
-                geom = self.selectedXYZ[key].tolist()
-                for i in range(self.natoms):
-                    atom = geom[i]
-                    myfile.write(f"{self.atoms[i][0]:<5} {atom[0]:>12.8f} {atom[1]:>12.8f} {atom[2]:>12.8f} \n")
+            for k0 in range(0,len(keys),1000):
+                myfile.write("".join(self.sampleText["frames"][k0:min(k0+1000,len(keys))]))
+        if len(keys) == len(self.sampleText["keys"]):
+            # Largest sample written so far: the samples nested in it are its leading frames
+            self.sampleMaster = sample_filename
+
+    def GetSampleFilename(self,size,extension=".xyz"):
+        outDir = os.getcwd() if self.outputDir == None else self.outputDir
+        if not os.path.isdir(outDir):
+            os.mkdir(outDir)
+        return os.path.join(outDir,self.systemName.upper()+"-SAMPLE-"+str(size)+extension)
+
+    def WriteSampleManifest(self):
+        """
+        Writes, instead of a SAMPLE file, the manifest of the current sample: a nested
+        sample of the largest SAMPLE file (master), whose text holds the sample in its
+        first nbytes bytes. MaterializeSample turns the manifest into the SAMPLE file.
+        """
+        size     = len(self.selectedGeoms)
+        if self.sampleMaster == None or self.sampleText["geoms"][:size] != list(self.selectedGeoms):
+            RaiseError(message=f" Sample of size {size} is not nested in the largest sample")
+        manifest = {"master":os.path.basename(self.sampleMaster),"masterSize":len(self.sampleText["keys"]),"size":size,
+                    "nbytes":sum([len(frame) for frame in self.sampleText["frames"][:size]])}
+        filename = self.GetSampleFilename(size,".json")
+        WriteAtomically(filename,lambda f: f.write(json.dumps(manifest,indent=2).encode()))
+        # A full SAMPLE file left by an earlier run would no longer match the manifest
+        if os.path.isfile(self.GetSampleFilename(size)) and self.GetSampleFilename(size) != self.sampleMaster:
+            os.remove(self.GetSampleFilename(size))
+
+    def MaterializeSample(self,size,outputFilename=None,blockSize=1<<24):
+        """
+        Writes the SAMPLE file of a sample recorded by a manifest (sampleOutput="manifest")
+        by copying the leading bytes of its master SAMPLE file. Returns the path of the file.
+
+        Parameters:
+        - size:           int -> Sample size
+        - outputFilename: str -> Output file (SAMPLE-<size>.xyz in outputDir if None)
+        - blockSize:      int -> Number of bytes copied at once
+        """
+        manifestFilename = self.GetSampleFilename(size,".json")
+        if not os.path.isfile(manifestFilename):
+            RaiseError(message=f" Program cannot find sample manifest {manifestFilename}")
+        with open(manifestFilename,"r") as f:
+            manifest = json.load(f)
+        master = os.path.join(os.path.dirname(manifestFilename),manifest["master"])
+        if not os.path.isfile(master) or os.path.getsize(master) < manifest["nbytes"]:
+            RaiseError(message=f" Master sample {master} of manifest {manifestFilename} is missing or truncated")
+        if outputFilename == None:
+            outputFilename = self.GetSampleFilename(size)
+        def Copy(out):
+            with open(master,"rb") as src:
+                remaining = manifest["nbytes"]
+                while remaining > 0:
+                    chunk     = src.read(min(blockSize,remaining))
+                    out.write(chunk)
+                    remaining = remaining - len(chunk)
+        WriteAtomically(outputFilename,Copy)
+        print(f"POLUS: Sample of size {size} written to {outputFilename}")
+        return outputFilename
+
+    def WriteNestedSamples(self,sampleSizes):
+        """
+        Writes the outputs of the samples of sampleSizes, leading parts of the current
+        (largest) selection. Frames are shared with the largest sample, not copied; with
+        sampleOutput="manifest" a manifest replaces each SAMPLE file (see MaterializeSample).
+
+        Parameters:
+        - sampleSizes: list -> Sizes of the nested samples, in decreasing order
+        """
+        allGeoms, allXYZ, allRMSDs = self.selectedGeoms, self.selectedXYZ, self.smallestRMSDs
+        geomKeys = list(allXYZ.keys())
+        for sampleSize in sampleSizes:
+            self.selectedGeoms = allGeoms[:sampleSize]
+            self.smallestRMSDs = allRMSDs[:sampleSize]
+            if self.sampleOutput == "manifest":
+                self.WriteSampleManifest()
+            else:
+                self.selectedXYZ = {key:allXYZ[key] for key in geomKeys[:sampleSize]}
+                self.WriteSampleXYZ()
+            self.WriteDiversityMetrics()
+            self.WriteIndexFile()
+            self.WriteCoverage()
+        if self.sampleOutput == "manifest" and len(sampleSizes) > 0:
+            self.selectedXYZ = {key:allXYZ[key] for key in geomKeys[:sampleSizes[-1]]}
 
     def WriteDiversityMetrics(self,div_filename=None):
         if div_filename==None:
@@ -219,8 +775,7 @@ class Sampler(File):
                 os.remove(div_filename)
         with open(div_filename,"w") as myfile:
             myfile.write("#FIELDS GEOM-ID sRMSD(A)\n")
-            for i in range(len(self.smallestRMSDs)):
-                myfile.write(f"{i:<7} {self.smallestRMSDs[i]:>12.8f} \n")
+            myfile.write("".join([f"{i:<7} {value:>12.8f} \n" for i, value in enumerate(self.smallestRMSDs)]))
 
     def WriteIndexFile(self,index_filename=None):
         if index_filename==None:
@@ -237,12 +792,36 @@ class Sampler(File):
             self.divIndexFiles = dict()
         self.divIndexFiles[len(self.selectedGeoms)] = index_filename
         with open(index_filename,"w") as myfile:
-            for i in self.selectedGeoms:
-                myfile.write(f"{i:<7}\n")
+            myfile.write("".join([f"{i:<7}\n" for i in self.selectedGeoms]))
+
+    def WriteCoverage(self,coverage_filename=None):
+        # Fraction of the trajectory, and of the external set, lying within each threshold of the sample
+        if self.spatialIndex == None:
+            return
+        if coverage_filename==None:
+            if self.outputDir==None:
+                outDir        = os.getcwd()
+            else:
+                if not os.path.isdir(self.outputDir):
+                    os.mkdir(self.outputDir)
+                outDir    = self.outputDir
+            coverage_filename = os.path.join(outDir,self.systemName.upper()+"-COVERAGE-"+str(len(self.selectedGeoms))+".dat")
+        nearest     = self.GetNearestSelectedDistances()
+        thresholds  = sorted(self.threshold)
+        trajectory  = ComputeCoverage(nearest,thresholds)
+        external    = ComputeCoverage(nearest[np.asarray(self.externalSet,dtype=np.int64)],thresholds)
+        with open(coverage_filename,"w") as myfile:
+            myfile.write("#FIELDS THRESHOLD(A) TRAJ-COVERAGE EXT-COVERAGE\n")
+            for i in range(len(thresholds)):
+                myfile.write(f"{thresholds[i]:<12.6f} {trajectory[i]:>12.8f} {external[i]:>12.8f} \n")
+                print(f"POLUS: Sample of {len(self.selectedGeoms)} covers {100*trajectory[i]:.2f}% of the trajectory and {100*external[i]:.2f}% of the external set within {thresholds[i]} A")
 
     def WriteCentroid(self,centroid_filename=None):
+        if self.initialIndexFile != None:
+            # A warm start never visits the previous frames, whose centroid was written by the previous run
+            return
         if not isinstance(self.centroid,np.ndarray):
-            self.ComputeCentroid()
+            self.ComputeSampleCentroid()
         if centroid_filename==None:
             if self.outputDir==None:
                 outDir        = os.getcwd()
@@ -254,50 +833,157 @@ class Sampler(File):
             if os.path.isfile(centroid_filename):
                 os.remove(centroid_filename)
         with open(centroid_filename,"w") as myfile:
-            myfile.write(f"{self.natoms}\n")
-            myfile.write(f"{self.systemName.upper()}-CENTROID\n")
-            for i in range(self.natoms):
-                symbol = self.GetAtomSymbol(self.atoms[i])
-                coords = self.centroid[i]
-                myfile.write(f"{symbol:<7} {coords[0]:>12.8f} {coords[1]:>12.8f} {coords[2]:>12.8f} \n")
-
-    def WriteDistanceMatrix(self,outputFilename=None):
+            WriteXYZFrames(myfile,np.asarray(self.centroid)[None],[self.GetAtomSymbol(atom) for atom in self.atoms],[f"{self.systemName.upper()}-CENTROID"],labelWidth=7)
+
+    def WriteDistanceMatrix(self,outputFilename=None,fileFormat="txt"):
+        """
+        Writes the RMSD (or descriptor distance) matrix.
+
+        Parameters:
+        - outputFilename: str -> Output file (DISTANCE-MATRIX.<ext> in outputDir if None)
+        - fileFormat:     str -> "txt" (one "ID1 ID2 value" line per entry), "npy" (dense binary),
+                                 "condensed" (binary upper triangle, scipy order) or "npz" (compressed condensed)
+        """
+        if fileFormat not in MATRIX_FORMATS:
+            RaiseError(message=f"Invalid distance matrix format {fileFormat}")
         if outputFilename == None:
+            basename = {"txt":"DISTANCE-MATRIX.dat","npy":"DISTANCE-MATRIX.npy","condensed":"DISTANCE-MATRIX-CONDENSED.npy","npz":"DISTANCE-MATRIX.npz"}[fileFormat]
             if self.outputDir == None:
-                outputFilename = os.path.join(os.getcwd(),"DISTANCE-MATRIX.dat")
+                outputFilename = os.path.join(os.getcwd(),basename)
             else:
                 if not os.path.isdir(self.outputDir):
                     os.mkdir(self.outputDir)
-                outputFilename = os.path.join(self.outputDir,"DISTANCE-MATRIX.dat")
-        if self.matrRMSD == None:
+                outputFilename = os.path.join(self.outputDir,basename)
+        if self.matrRMSD is None:
             self.SetRMSDMatrix()
-        data = self.matrRMSD.tolist()
-        with open(outputFilename,"w") as f:
-            f.write("#FIELDS GEOM-ID1 GEOM-ID2 RMSD(angstrom)\n")
-            for i in range(self.ngeoms):
-                for j in range(self.ngeoms):
-                    f.write(f"{i+1:>10} {j+1:>10} {self.matrRMSD[i,j]:>12.6f}\n")
+        if fileFormat == "txt":
+            with open(outputFilename,"w") as f:
+                f.write("#FIELDS GEOM-ID1 GEOM-ID2 RMSD(angstrom)\n")
+                WriteMatrixText(f,self.matrRMSD)
+        else:
+            SaveDistanceMatrix(self.matrRMSD,outputFilename,fileFormat)
+        print(f"POLUS: Distance matrix written to {outputFilename}")
+
+
+    def GetDescriptors(self):
+        # Descriptors of all frames, read from (or saved to) the trajectory cache
+        if self.descriptors is None:
+            name = "descriptors-"+self.metric
+            if self.cache != None:
+                self.descriptors = self.cache.Load(name)
+            if self.descriptors is None:
+                self.SetHistory()
+                print(f"POLUS: Computing {self.metric} descriptors of {self.ngeoms} geometries")
+                self.descriptors = ComputeDescriptors(self.history,self.metric,self.labels)
+                if self.cache != None:
+                    self.cache.Save(name,self.descriptors)
+        return self.descriptors
+
+    def GetDescriptorCentroid(self):
+        # Descriptor of the seed geometry, or (weighted) mean descriptor, or descriptor closest to it for a medoid
+        # (the mean geometry of an unaligned trajectory is meaningless)
+        if self.descCentroid is None:
+            if self.seedFilename == None:
+                descriptors = np.asarray(self.GetDescriptors())
+                weights     = None if self.frameWeights is None else self.GetFrameWeights(self.frameWeights,len(descriptors))
+                self.descCentroid = np.average(descriptors,axis=0,weights=weights)
+                if self.centroidMethod == "medoid":
+                    self.medoidID     = int(np.argmin(np.linalg.norm(descriptors-self.descCentroid,axis=1)))
+                    self.descCentroid = descriptors[self.medoidID]
+            else:
+                self.descCentroid = ComputeDescriptors(np.asarray(self.centroid)[None],self.metric,self.labels)[0]
+        return self.descCentroid
+
+    def GetWeightedCoordinates(self,dtype=np.float64):
+        # Rows whose Euclidean distances are the diversity distances: descriptors, or flattened aligned frames (see WeightedCoordinates)
+        if self.metric != "rmsd":
+            # Centred on the mean descriptor, as WeightedCoordinates, for accurate float32 GEMM distances
+            if self.weightedCoords is None:
+                X                   = np.asarray(self.GetDescriptors(),dtype=np.float64)
+                self.weightedCoords = X - X.mean(axis=0)
+            return self.weightedCoords.astype(dtype,copy=False)
+        if not self.rotated:
+            RaiseError(message=" Spatial queries require a pre-aligned trajectory (rotateTraj=True)")
+        if np.dtype(dtype) != np.float64:
+            return WeightedCoordinates(self.rotTraj,self.GetSqrtWeights(),dtype)
+        if self.weightedCoords is None:
+            self.weightedCoords = WeightedCoordinates(self.rotTraj,self.GetSqrtWeights(),np.float64)
+        return self.weightedCoords
 
+    def GetSpatialIndex(self):
+        # Index over all frames, built once
+        if self.index == None:
+            print(f"POLUS: Building {self.spatialIndex if self.spatialIndex != None else 'balltree'} spatial index over {self.ngeoms} geometries")
+            self.index = SpatialIndex(self.GetWeightedCoordinates(),kind=self.spatialIndex if self.spatialIndex != None else "balltree")
+        return self.index
+
+    def GetNeighbours(self,Geom_IDs,radius):
+        # Geometries within radius (RMSD, angstrom) of each of Geom_IDs
+        return self.GetSpatialIndex().QueryRadius(self.GetWeightedCoordinates()[Geom_IDs],radius)
+
+    def GetNeighbourRow(self,Geom_ID,radius):
+        # IDs of, and distances to, the geometries within radius of one geometry (see FarthestPointSelector)
+        X   = self.GetWeightedCoordinates()
+        ids = self.GetNeighbours([Geom_ID],radius)[0]
+        return ids, np.linalg.norm(X[ids]-X[Geom_ID],axis=1)
+
+    def GetSelectorNeighbourRow(self):
+        # Selections driven by the spatial index read no distance matrix
+        return None if self.spatialIndex == None else self.GetNeighbourRow
+
+    def GetNearestSelectedDistances(self,Test_Geom_IDs=None):
+        # RMSD of each test geometry (all by default) to its closest selected geometry, through an index over the selection
+        X = self.GetWeightedCoordinates()
+        if Test_Geom_IDs is None:
+            Test_Geom_IDs = np.arange(self.ngeoms)
+        sampleIndex = SpatialIndex(X,self.selectedGeoms,kind=self.spatialIndex if self.spatialIndex != None else "balltree")
+        return sampleIndex.QueryNearest(X[Test_Geom_IDs])[0][:,0]
 
     def GetSmallestRMSD(self,Test_Geom_ID):
+        return self.GetSmallestRMSDs([Test_Geom_ID])[0]
+
+    def GetSmallestRMSDs(self,Test_Geom_IDs):
+        # Distance of each test geometry to the centroid (first pick) or to its closest selected geometry
+        if self.selectedGeoms == None and self.metric != "rmsd":
+            return np.linalg.norm(self.GetDescriptors()[Test_Geom_IDs]-self.GetDescriptorCentroid(),axis=1)
         if self.selectedGeoms == None:
-            RMSD_array = ComputeRMSD(self.rotTraj[Test_Geom_ID],self.centroid,self.rotMethod,False,self.userWeights)
-        else:
-            RMSD_array = self.matrRMSD[Test_Geom_ID,self.selectedGeoms]
-        return np.min(RMSD_array)
+            return ComputeRMSDOneToMany(self.centroid,self.rotTraj[Test_Geom_IDs],self.GetSqrtWeights(),False,self.rotMethod)
+        if self.matrRMSD is None or self.spatialIndex != None:
+            return self.GetNearestSelectedDistances(Test_Geom_IDs)
+        return np.min(self.matrRMSD.Rows(Test_Geom_IDs,self.selectedGeoms),axis=1)
+
+    def GetDistanceRow(self,Geom_ID):
+        # Distances from one geometry to all others: read from the RMSD matrix or computed on the fly
+        if self.initialIndexFile != None:
+            row = np.full(self.ngeoms,-np.inf)
+            row[self.newFramesStart:] = self.GetNewFrameDistances(Geom_ID)
+            return row
+        if self.matrRMSD is None and self.metric != "rmsd":
+            X = self.GetWeightedCoordinates()
+            return np.linalg.norm(X-X[Geom_ID],axis=1)
+        if self.matrRMSD is None:
+            return ComputeRMSDOneToMany(self.rotTraj[Geom_ID],self.rotTraj,self.GetSqrtWeights(),self.rotated,self.rotMethod)
+        return self.matrRMSD.Row(Geom_ID)
+
+    def SetSelector(self):
+        initialDistances = np.full(self.ngeoms,-np.inf)
+        initialDistances[self.samplePool] = self.GetSmallestRMSDs(self.samplePool)
+        self.selector    = FarthestPointSelector(self.ngeoms,self.GetDistanceRow,initialDistances,NeighbourRow=self.GetSelectorNeighbourRow())
 
     def SetExternalSet(self):
         if self.externalSet == None:
             self.externalSet = list()
-            if self.writeFBSInputs:
+            if self.IsFullOrdering():
                 maxTrainSize     = sorted(self.sampleSize,reverse=True)[1]
                 self.externalSet = self.selectedGeoms[maxTrainSize:]
+                if self.initialIndexFile != None:
+                    # Frames left out by the previous run of a warm start are not part of the ordering
+                    ordered          = set(self.selectedGeoms)
+                    self.externalSet = self.externalSet+[ID for ID in range(self.ngeoms) if ID not in ordered]
             else:
                 maxTrainSize     = sorted(self.sampleSize,reverse=True)[0]
-                self.externalSet = list()
-                for ID in self.samplePool:
-                    if ID not in self.selectedGeoms:
-                        self.externalSet.append(ID)
+                selected         = set(self.selectedGeoms)
+                self.externalSet = [ID for ID in range(self.ngeoms) if ID not in selected]
         print(f"POLUS: External Set Size {len(self.externalSet)}")
 
     def SelectGeoms(self):
@@ -328,13 +1014,9 @@ class Sampler(File):
             #        if smallest_rmsd > best_rmsd:
             #            best_rmsd = smallest_rmsd
             #            best      = geomID
-            best      = self.samplePool[0]
-            best_rmsd = self.GetSmallestRMSD(best)
-            for geomID in self.samplePool[1:]: 
-                smallest_rmsd = self.GetSmallestRMSD(geomID)
-                if smallest_rmsd > best_rmsd:
-                    best_rmsd = smallest_rmsd
-                    best      = geomID
+            if self.selector == None:
+                self.SetSelector()
+            best, best_rmsd = self.selector.Next()
         else:
             #with mp.Pool(processes=self.ncores) as p:
             #    results   = p.map(func=self.GetSmallestRMSD2,iterable=args) 
@@ -366,151 +1048,325 @@ class Sampler(File):
 
     # GetCentroid method needed too
     def SetCentroid(self,poolIDs):
-        if len(poolIDs)==1 and self.tmpcentroid == None:
-            self.centroid    =  self.rotTraj[poolIDs[0]]
-            self.tmpcentroid =  self.rotTraj[poolIDs[0]]
+        # Running average of the selected geometries, updated with the latest one in O(natoms)
+        newGeom = self.rotTraj[poolIDs[-1]]
+        if len(poolIDs)==1 or self.tmpcentroid is None:
+            self.centroid    = np.array(newGeom)
         else:
-            tmp              = np.array(self.tmpcentroid)
             ngeoms           = len(poolIDs)
-            expandedTmp      = float(ngeoms-1)*tmp
-            newGeom          = np.array(self.rotTraj[poolIDs[-1]])
-            self.centroid    = (expandedTmp+newGeom)/float(ngeoms) 
-            self.tmpcentroid = self.centroid.copy()
-            #ngeoms      = len(poolIDs)
-            #centroid    = [[0.0,0.0,0.0] for i in range(self.natoms)]
-            #geoms       = list()
-            #for ID in poolIDs:
-            #    geom=self.rotTraj[ID]
-            #    for j in range(self.natoms):
-            #        centroid[j] = centroid[j]+geom[j]
-            #for k in range(self.natoms):
-            #    centroid[k] = centroid[k]/float(ngeoms)
-            #self.centroid    = centroid
-            #self.tmpcentroid = centroid
-        
-        
+            self.centroid    = (float(ngeoms-1)*self.tmpcentroid+newGeom)/float(ngeoms)
+        self.tmpcentroid = self.centroid
+
     def GetSmallestRMSD2(self,Test_Geom_ID):   
-        if self.selectedGeoms == None:
-            minRMSD = ComputeRMSD(self.rotTraj[Test_Geom_ID],self.centroid,self.rotMethod,False,self.userWeights)
-        else:
-            minRMSD = ComputeRMSD(self.rotTraj[Test_Geom_ID],self.centroid,self.rotMethod,False,self.userWeights)
-        return minRMSD
+        return ComputeRMSDOneToMany(self.centroid,self.rotTraj[[Test_Geom_ID]],self.GetSqrtWeights(),False,self.rotMethod)[0]
 
     def GetNextHitStructure(self,Test_Geom_IDs):   
-        hit     = Test_Geom_IDs[0]
-        dist    = ComputeRMSD(self.rotTraj[hit],self.centroid,self.rotMethod,False,self.userWeights)
-        for gid in Test_Geom_IDs[1:]:
-            dist_    = ComputeRMSD(self.rotTraj[hit],self.centroid,self.rotMethod,False,self.userWeights)
-            if dist_ > dist:
-                dist = dist_
-                hit  = gid
-        #cs      = math.ceil(len(Test_Geom_IDs)/self.ncores)
-        #pool    = ThreadPool(self.ncores)
-        #results = pool.map(func=self.GetSmallestRMSD2,iterable=Test_Geom_IDs,chunksize=cs)
-        #dist    = max(results)
-        #hit     = Test_Geom_IDs[results.index(dist)]
-        return hit, dist
+        # Aligned RMSDs from the running centroid to every frame in one batched call, restricted to the test geometries
+        if self.poolKernel == None:
+            self.poolKernel = PoolRMSDKernel(self.rotTraj,self.GetSqrtWeights(),self.rotMethod)
+        Test_Geom_IDs = np.asarray(Test_Geom_IDs,dtype=np.int64)
+        dists   = self.poolKernel(self.centroid)[Test_Geom_IDs]
+        hitPos  = int(np.argmax(dists))
+        return int(Test_Geom_IDs[hitPos]), float(dists[hitPos])
+
+    def ReadInitialSelection(self):
+        # Previously selected IDs, and their selection distances if the DIVERSITY file of the same run is found
+        selected     = ReadIndexFile(self.initialIndexFile)
+        distances    = [np.nan]*len(selected)
+        divFilename  = os.path.join(os.path.dirname(self.initialIndexFile),os.path.basename(self.initialIndexFile).replace("-INDEX-","-DIVERSITY-"))
+        if divFilename != self.initialIndexFile and os.path.isfile(divFilename):
+            with open(divFilename,"r") as f:
+                values = [float(line.split()[1]) for line in f if len(line.split()) > 1 and not line.startswith("#")]
+            if len(values) == len(selected):
+                distances = values
+        return selected, distances
+
+    def GetNewFrame(self,Geom_ID):
+        # Only the new frames and the previous selection are read by a warm start
+        if Geom_ID >= self.newFramesStart:
+            frame = self.newFrames[Geom_ID-self.newFramesStart]
+        else:
+            frame = self.previousFrames[Geom_ID]
+        if self.newFramesRef is not None:
+            frame = self.AlignFrames(self.newFramesRef,frame[None],self.rotMethod)[0]
+        return frame
+
+    def GetNewFrameDistances(self,Geom_ID):
+        # Distances from one (previously selected or new) geometry to every new frame
+        return self.newFramesKernel(self.GetNewFrame(Geom_ID))
+
+    def SetWarmStart(self):
+        """
+        Continues the farthest-point selection of a previous run, read from its INDEX file,
+        over the frames appended to the trajectory since then (IDs from newFramesStart on).
+        Only distances between new frames and the previous selection or the new picks are
+        computed, so that the cost grows with the number of new frames, not with the
+        length of the trajectory: the previous frames are neither parsed nor held in memory,
+        apart from the previously selected ones.
+        """
+        self.ReadHeader()
+        selected, distances = self.ReadInitialSelection()
+        if len(selected) == 0:
+            RaiseError(message=f" Index file {self.initialIndexFile} is empty")
+        if max(selected) >= self.newFramesStart:
+            RaiseError(message=f" Index file {self.initialIndexFile} lists geometries beyond the first new frame")
+        blocks = [np.asarray(frames,dtype=np.float64) for _, frames in self.IterFrames(self.chunkSize,start=self.newFramesStart)]
+        if len(blocks) == 0:
+            RaiseError(message=f" Invalid first new frame {self.newFramesStart} (no geometry from there on)")
+        newFrames           = np.concatenate(blocks,axis=0)
+        self.ngeoms         = self.newFramesStart+len(newFrames)
+        self.newFrames      = newFrames
+        self.previousFrames = dict(zip(selected,np.asarray(self.ReadFrames(selected),dtype=np.float64)))
+        print(f"POLUS: Warm start from {len(selected)} geometries of {self.initialIndexFile} over {self.ngeoms-self.newFramesStart} new geometries")
+        if self.metric != "rmsd":
+            X = ComputeDescriptors(newFrames,self.metric,self.labels)
+            self.newFramesKernel = lambda frame: np.linalg.norm(X-ComputeDescriptors(frame[None],self.metric,self.labels)[0],axis=1)
+        elif self.rotateTraj:
+            # Same pre-aligned RMSDs as a cold run, previous frames being aligned to the reference on the fly
+            self.newFramesRef = self.GetReferenceGeometry(self.refGeomFilename)
+            aligned = self.AlignFrames(self.newFramesRef,newFrames,self.rotMethod)
+            self.newFramesKernel = lambda frame: ComputeRMSDOneToMany(frame,aligned,self.GetSqrtWeights(),True,self.rotMethod)
+        else:
+            self.newFramesKernel = PoolRMSDKernel(newFrames,self.GetSqrtWeights(),self.rotMethod)
+        initialDistances = np.full(self.ngeoms,-np.inf)
+        initialDistances[self.newFramesStart:] = np.inf
+        for Geom_ID in selected:
+            np.minimum(initialDistances[self.newFramesStart:],self.GetNewFrameDistances(Geom_ID),out=initialDistances[self.newFramesStart:])
+        self.samplePool    = list(range(self.newFramesStart,self.ngeoms))
+        self.selectedGeoms = selected
+        self.smallestRMSDs = distances
+        self.selector      = FarthestPointSelector(self.ngeoms,self.GetDistanceRow,initialDistances,keepInitial=True)
+        self.selector.selected          = list(selected)
+        self.selector.smallestDistances = list(distances)
+
+    def GetOnlineCoordinates(self,frames,RefGeom):
+        # Rows whose Euclidean distances are the online distances: descriptors, or weighted frames aligned to the reference
+        if self.metric != "rmsd":
+            return ComputeDescriptors(frames,self.metric,self.labels)
+        aligned = self.AlignFrames(RefGeom,frames,self.rotMethod)
+        return ((aligned-RefGeom)*(self.GetSqrtWeights()[None,:,None]/np.sqrt(self.natoms))).reshape(len(frames),self.natoms*3)
+
+    def SelectOnline(self):
+        """
+        Online diversity-based selection of a trajectory still being written by an MD engine.
+        The file is tailed (see TailXYZBlocks); every new frame is aligned to the reference
+        and accepted if its RMSD (or descriptor distance) to the nearest selected frame
+        exceeds the smallest threshold, the autoStop criterion. The nearest selected frame
+        is found through a DynamicSpatialIndex, so that the cost per frame does not depend
+        on the length of the trajectory. Accepted frames are appended to the INDEX, SAMPLE
+        and DIVERSITY files (suffix ONLINE) as they are selected. As in the batch selection,
+        the first selected frame is measured against the seed geometry (or the reference
+        geometry); without either, the first frame is its own reference and its distance is
+        written as nan.
+        """
+        outDir    = os.getcwd() if self.outputDir == None else self.outputDir
+        if not os.path.isdir(outDir):
+            os.makedirs(outDir)
+        prefix    = os.path.join(outDir,self.systemName.upper())
+        threshold = min(self.threshold)
+        index     = DynamicSpatialIndex(kind=self.spatialIndex if self.spatialIndex != None else "balltree")
+        RefGeom   = None
+        SeedX     = None
+        nframes   = 0
+        self.selectedGeoms = list()
+        self.smallestRMSDs = list()
+        self.divIndexFiles = {"online":prefix+"-INDEX-ONLINE.dat"}
+        print(f"POLUS: Online selection from {self.filename} (threshold {threshold})")
+        with open(prefix+"-INDEX-ONLINE.dat","w") as indexFile, open(prefix+"-SAMPLE-ONLINE.xyz","w") as sampleFile, open(prefix+"-DIVERSITY-ONLINE.dat","w") as divFile:
+            divFile.write("#FIELDS GEOM-ID sRMSD(A)\n")
+            if self.seedFilename == None and self.refGeomFilename == None:
+                divFile.write("#SEED GEOM-ID 0 is the reference geometry, its sRMSD is undefined\n")
+            for frameIDs, frames in TailXYZBlocks(self.filename,self.natoms,self.chunkSize,self.pollInterval,self.idleTimeout,self.dtype):
+                if RefGeom is None:
+                    # The header can only be read once the first frame is complete
+                    self.ReadHeader()
+                    self.SetWeights(self.weightsVector)
+                    RefGeom = self.GetReferenceGeometry(self.refGeomFilename)
+                    if self.seedFilename != None:
+                        self.GetSeedGeometry(self.seedFilename)
+                        SeedX = self.GetOnlineCoordinates(np.asarray(self.seed)[None],RefGeom)[0]
+                    elif self.refGeomFilename != None:
+                        SeedX = self.GetOnlineCoordinates(np.asarray(RefGeom)[None],RefGeom)[0]
+                # One query for the whole block, frames accepted within the block being compared directly
+                X           = self.GetOnlineCoordinates(frames,RefGeom)
+                nearest, _  = index.QueryNearest(X)
+                accepted    = list()
+                for k in range(len(frameIDs)):
+                    dist = nearest[k]
+                    if len(accepted) > 0:
+                        dist = min(dist,float(np.min(np.linalg.norm(X[accepted]-X[k],axis=1))))
+                    if dist <= threshold:
+                        continue
+                    if not np.isfinite(dist):
+                        # The first selected frame has no nearest selected frame, its distance is to the seed (or reference)
+                        dist = np.nan if SeedX is None else float(np.linalg.norm(X[k]-SeedX))
+                    index.Add(X[k],frameIDs[k])
+                    accepted.append(k)
+                    self.selectedGeoms.append(int(frameIDs[k]))
+                    self.smallestRMSDs.append(dist)
+                # Frames accepted in the block are written together
+                keys = range(len(self.selectedGeoms)-len(accepted),len(self.selectedGeoms))
+                indexFile.write("".join([f"{frameIDs[k]:<7}\n" for k in accepted]))
+                divFile.write("".join([f"{key:<7} {self.smallestRMSDs[key]:>12.8f} \n" for key in keys]))
+                WriteXYZFrames(sampleFile,frames[accepted],[atom[0] for atom in self.atoms],["GEOM-"+str(key) for key in keys])
+                for f in [indexFile,sampleFile,divFile]:
+                    f.flush()
+                nframes = nframes + len(frameIDs)
+                print(f"POLUS: {nframes:>10} frames read {len(self.selectedGeoms):>10} selected")
+        self.ngeoms = nframes
+        self.divIndexFiles[len(self.selectedGeoms)] = self.divIndexFiles["online"]
+        print(f"POLUS: No new frame for {self.idleTimeout} s, online selection stopped")
+
+    def SelectApproximate(self):
+        """
+        Approximate diversity-based selection for very large trajectories: a pool of candidate
+        frames covering the aligned trajectory is drawn with k-means++ seeding (largest sample
+        size candidates) or a mini-batch k-means coreset (approxOversample times more), and
+        only the candidates are then ordered by farthest-point selection. With autoStop the
+        stopping size is set by the smallest threshold, not by the sample sizes: the candidate
+        pool is doubled until its ordering reaches the threshold (or holds every frame).
+        """
+        largestSampleSize  = min(max(self.sampleSize),self.ngeoms)
+        ncandidates        = largestSampleSize if self.approxMethod == "kmeans++" else self.approxOversample*largestSampleSize
+        X                  = self.GetWeightedCoordinates(np.float32)
+        candidates         = None
+        while True:
+            print(f"POLUS: Drawing {min(ncandidates,self.ngeoms)} candidate geometries ({self.approxMethod})")
+            previous       = 0 if candidates is None else len(candidates)
+            candidates     = SelectCandidates(X,ncandidates,self.approxMethod,self.approxBatchSize,self.randomSeed)
+            print(f"POLUS: Ordering {len(candidates)} candidate geometries")
+            order, dists   = OrderCandidates(X,candidates,self.GetSmallestRMSDs(candidates.tolist()),None if self.autoStop else largestSampleSize)
+            size           = self.GetRequestedSelectionSize(dists)
+            if not self.autoStop or size != None or ncandidates >= self.ngeoms or len(candidates) <= previous:
+                break
+            print(f"POLUS: Smallest threshold {min(self.threshold)} not reached by {len(candidates)} candidates")
+            ncandidates    = 2*ncandidates
+        self.selectedGeoms = order[:size].tolist()
+        self.smallestRMSDs = dists[:size].tolist()
+        selected           = set(self.selectedGeoms)
+        self.samplePool    = [x for x in self.samplePool if x not in selected]
 
     def SelectAndWrite(self):
-        self.UpdateSampleSize(self.writeFBSInputs)
-        print(f"POLUS: Selection of diverse geometries in progress...")
+        self.UpdateSampleSize(self.IsFullOrdering())
+        print("POLUS: Selection of diverse geometries in progress...")
         self.selectStartTime = time.time()
+        with self.profiler.Stage("selection"):
+            self.LoadSelectionCheckpoint()
+            if self.selectedGeoms == None:
+                self.LoadCachedSelection()
+            if self.selectedGeoms == None and self.approxMethod != None:
+                self.SelectApproximate()
+        nselected = 0 if self.selectedGeoms == None else len(self.selectedGeoms)
         if not self.autoStop:
-            largestSampleSize = max(self.sampleSize)
-            for i in range(largestSampleSize):
-                if (i+1)<=self.ngeoms:
-                    self.SelectGeoms()
-                    if self.groupAverage:
-                        self.SetCentroid(self.selectedGeoms)
-                else:
-                    break
-            self.SetExternalSet()
-            self.GenerateSample()
-            self.WriteSampleXYZ() 
-            self.WriteDiversityMetrics() 
-            self.WriteCentroid()
-            self.WriteIndexFile()
-            self.largestSubSample = self.selectedGeoms.copy()
-            sortedSampleSize  = sorted(self.sampleSize,reverse=True)
-            copySelectedGeoms = self.selectedGeoms.copy()
-            copySelectedXYZ   = copy.deepcopy(self.selectedXYZ)
-            copySmallestRMSDs = self.smallestRMSDs.copy()
-            geomKeys          = list(copySelectedXYZ.keys())
-            if len(self.sampleSize)>1:
-                for sampleSize in sortedSampleSize[1:]:
-                    self.selectedGeoms = copySelectedGeoms[:sampleSize]
-                    self.selectedXYZ   = {key:copySelectedXYZ[key] for key in geomKeys[:sampleSize]}
-                    self.smallestRMSDs = copySmallestRMSDs[:sampleSize]
-                    self.WriteSampleXYZ() 
-                    self.WriteDiversityMetrics() 
-                    self.WriteIndexFile()
+            largestSampleSize = max(self.sampleSize) if self.approxMethod == None else nselected
+            with self.profiler.Stage("selection"):
+                for i in range(nselected,largestSampleSize):
+                    if (i+1)<=self.ngeoms and len(self.samplePool)>0:
+                        self.SelectGeoms()
+                        if self.groupAverage:
+                            self.SetCentroid(self.selectedGeoms)
+                        self.CheckpointSelection()
+                    else:
+                        break
+                self.SaveCachedOrdering()
+            with self.profiler.Stage("writing"):
+                self.SetExternalSet()
+                self.GenerateSample()
+                self.WriteSampleXYZ() 
+                self.WriteDiversityMetrics() 
+                self.WriteCentroid()
+                self.WriteIndexFile()
+                self.WriteCoverage()
+                self.largestSubSample = self.selectedGeoms.copy()
+                sortedSampleSize  = sorted(self.sampleSize,reverse=True)
+                self.WriteNestedSamples(sortedSampleSize[1:])
+            self.ClearCheckpoint()
         else:
-            stop = False
             smallestThreshold = min(self.threshold)
-            while not stop:
-                self.SelectGeoms()
-                if self.smallestRMSDs[-1]<=smallestThreshold or len(self.smallestRMSDs)==self.ngeoms:
-                    stop = True
-                else:
-                    if self.groupAverage:
-                        self.SetCentroid(self.selectedGeoms)
-
-            self.SetExternalSet()
-            self.GenerateSample()
-            self.WriteSampleXYZ() 
-            self.WriteDiversityMetrics() 
-            self.WriteCentroid()
-            self.WriteIndexFile()
-            self.largestSubSample = self.selectedGeoms.copy()
-            sortedThreshold   = sorted(self.threshold,reverse=False)
-            copySmallestRMSDs = self.smallestRMSDs.copy()
-            copySelectedGeoms = self.selectedGeoms.copy()
-            copySelectedXYZ   = copy.deepcopy(self.selectedXYZ)
-            copySmallestRMSDs = self.smallestRMSDs.copy()
-            geomKeys          = list(copySelectedXYZ.keys())
-            if len(self.threshold)>1:
+            # The previous selection of a warm start ended below the threshold, new frames may not
+            stop = self.approxMethod != None or len(self.samplePool)==0 or (nselected>0 and self.initialIndexFile == None and (self.smallestRMSDs[-1]<=smallestThreshold or nselected==self.ngeoms))
+            with self.profiler.Stage("selection"):
+                while not stop:
+                    self.SelectGeoms()
+                    if self.smallestRMSDs[-1]<=smallestThreshold or len(self.smallestRMSDs)==self.ngeoms or len(self.samplePool)==0:
+                        stop = True
+                    else:
+                        if self.groupAverage:
+                            self.SetCentroid(self.selectedGeoms)
+                    self.CheckpointSelection()
+                self.SaveCachedOrdering()
+            with self.profiler.Stage("writing"):
+                self.SetExternalSet()
+                self.GenerateSample()
+                self.WriteSampleXYZ() 
+                self.WriteDiversityMetrics() 
+                self.WriteCentroid()
+                self.WriteIndexFile()
+                self.WriteCoverage()
+                self.largestSubSample = self.selectedGeoms.copy()
+                sortedThreshold   = sorted(self.threshold,reverse=False)
+                sampleSizes       = list()
                 for threshold in sortedThreshold[1:]:
                     sampleSize = 0
-                    for value in copySmallestRMSDs:
+                    for value in self.smallestRMSDs:
                         if value >= threshold:
                             sampleSize +=1
                         else:
                             break
-                    self.selectedGeoms = copySelectedGeoms[:sampleSize]
-                    self.selectedXYZ   = {key:copySelectedXYZ[key] for key in geomKeys[:sampleSize]}
-                    self.smallestRMSDs = copySmallestRMSDs[:sampleSize]
-                    self.WriteSampleXYZ() 
-                    self.WriteDiversityMetrics() 
-                    self.WriteIndexFile()
+                    sampleSizes.append(sampleSize)
+                self.WriteNestedSamples(sampleSizes)
+            self.ClearCheckpoint()
         # Print duration
         #PrintOnTerminal(duration = time.time()-start,msgLength=len(msg_))
 
     def Execute(self,Ref_Geom=None):
+        if self.online:
+            # The trajectory may not hold a complete frame yet, weights are set by SelectOnline
+            start_time = time.time()
+            with self.profiler.Stage("online"):
+                self.SelectOnline()
+            print(f"POLUS: Total duration (s) of the online DAS procedure {time.time() - start_time:10.6e}")
+            self.profiler.WriteReport(self.profileReport)
+            return
         # Set Weights
         self.SetWeights(self.weightsVector)
         start_time = time.time()
-        if not self.groupAverage:
-            # Set RMSD matrix
-            self.SetRMSDMatrix()
+        if self.initialIndexFile != None:
+            # The trajectory is not loaded, SetWarmStart reads the frames it needs
+            with self.profiler.Stage("loading"):
+                self.ReadHeader()
+            with self.profiler.Stage("warm start"):
+                self.SetWarmStart()
+            self.SelectAndWrite()
+            print(f"POLUS: Total duration (s) of the warm-started DAS procedure {time.time() - start_time:10.6e}")
+        elif not self.groupAverage:
+            if self.matrixFree or self.approxMethod != None or self.spatialIndex != None or self.IsSelectionCached():
+                # Distance rows are computed (or neighbours queried) during the selection, or not needed at all
+                self.SetSamplePool()
+            else:
+                # Set RMSD matrix
+                self.SetRMSDMatrix()
             end_time1 = time.time()
             print(f"POLUS: Time (s) for building RMSD matrix {end_time1 - start_time:10.6e}")
-            # Select Geometries And Write Files
-            if self.performSelection:
+            # Select Geometries And Write Files (tile tasks leave that to the merge step)
+            if self.performSelection and not self.IsTileTask():
                 self.SelectAndWrite()
                 end_time2 = time.time()
                 print(f"POLUS: Time (s) for selecting & writing geometries {end_time2 - end_time1:10.6e}")
                 print(f"POLUS: Total duration (s) of the DAS procedure {end_time2 - start_time:10.6e}")
-            print(f"POLUS: Traced memory {tracemalloc.get_traced_memory()}")
         else:
             # Rotate Trajectory
-            self.RotateTrajectory(self.refGeomFilename,self.rotateTraj,self.rotMethod)
+            self.LoadAndRotate()
             # Set sample pool
-            if not isinstance(self.rotTraj,list):
+            if not isinstance(self.rotTraj,np.ndarray):
                 RaiseError(message=" Unable to execute diversity-based sampling")
             else:
                 self.samplePool = [x for x in range(len(self.rotTraj))]
+            if self.checkpoint:
+                self.CheckCheckpointMetadata()
             # Compute Centroid
-            self.ComputeCentroid()
+            with self.profiler.Stage("centroid"):
+                self.ComputeCentroid(method=self.centroidMethod,frameWeights=self.frameWeights)
             #RaiseError(message="GroupAverage method not yet implemented")
             # Select Geometries And Write Files
             start_time = time.time()
@@ -518,5 +1374,5 @@ class Sampler(File):
             end_time1 = time.time()
             print(f"POLUS: Time (s) for selecting & writing geometries {end_time1 - start_time:10.6e}")
             print(f"POLUS: Total duration (s) of the DAS procedure {end_time1 - start_time:10.6e}")
-            print(f"POLUS: Traced memory {tracemalloc.get_traced_memory()}")
+        self.profiler.WriteReport(self.profileReport)
 
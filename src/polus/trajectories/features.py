@@ -0,0 +1,204 @@
+import os
+import time
+import numpy as np
+from polus.utils.logging import RaiseError
+from polus.utils.read_module import get_features_indices
+from polus.trajectories.calculators import ComputeDistanceTile
+from polus.trajectories.selection import FarthestPointSelector
+
+
+def ReadFeatureMatrix(filenames):
+    """
+    Reads the feature columns (see get_features_indices) of one or more per-atom .csv
+    files and places them side by side in a (npoints,nfeatures) matrix, one row per point.
+
+    Parameters:
+    - filenames: list -> Paths to the .csv files, all listing the same points in the same order
+    """
+    blocks = list()
+    for filename in filenames:
+        with open(filename,"r") as f:
+            header = f.readline().strip()
+        # Parsed as plain text like readfile does, only the feature columns being converted, straight into a float array
+        blocks.append(np.loadtxt(filename,delimiter=",",skiprows=1,usecols=get_features_indices(header),ndmin=2))
+    if len(set([len(block) for block in blocks])) != 1:
+        RaiseError(message=" Input .csv files hold different numbers of points")
+    return np.hstack(blocks)
+
+def StandardizeFeatures(X):
+    # Zero mean and unit variance per feature, so that distances and angles weigh alike (constant features are only centred)
+    std = X.std(axis=0)
+    std[std == 0.0] = 1.0
+    return (X - X.mean(axis=0))/std
+
+
+class FeatureSampler():
+    """
+    Diversity-based (farthest-point) selection run directly on the ALF features of
+    per-atom .csv files: the features are rotation invariant, so neither an XYZ
+    trajectory nor an alignment is needed. Distances between points are Euclidean
+    distances between their (standardized) feature vectors, computed with BLAS one row
+    at a time. Selections are written to the INDEX files consumed by SELECT.
+
+    Parameters:
+    - inputFiles:         list -> Per-atom .csv files (all .csv files of inputDir if None)
+    - inputDir:           str  -> Directory of the .csv files (current directory if None)
+    - atoms:              list -> Atoms (e.g. ["C1","O3"]) whose files are used, all if None
+    - standardize:        bool -> Standardize every feature before computing distances
+    - sampleSize:         int  -> Sample size(s) (list allowed)
+    - autoStop:           bool -> Stop once the selection distance drops below the smallest threshold
+    - threshold:          float-> Threshold(s) (list allowed) of the selection distance
+    - writeFerebusInputs: bool -> Order every point, so that the external set follows diversity order
+    - excludedIndexFile:  str  -> File of point IDs (one per line) never to be selected
+    - systemName:         str  -> Prefix of output files
+    - outputDir:          str  -> Output directory (current directory if None)
+    - printPace:          int  -> Number of picks between two progress lines
+    """
+    def __init__(self,inputFiles=None,inputDir=None,atoms=None,standardize=True,sampleSize=100,autoStop=False,threshold=None,writeFerebusInputs=True,excludedIndexFile=None,systemName="MOL",outputDir=None,printPace=10):
+        self.inputFiles      = [inputFiles] if isinstance(inputFiles,str) else inputFiles
+        self.inputDir        = inputDir
+        self.atoms           = atoms
+        self.standardize     = standardize
+        self.autoStop        = autoStop
+        self.writeFBSInputs  = writeFerebusInputs
+        self.excludedIndexFile = excludedIndexFile
+        self.systemName      = systemName
+        self.outputDir       = outputDir
+        self.printPace       = printPace
+        self.features        = None
+        self.npoints         = None
+        self.excludedIDs     = None
+        self.sqNorms         = None
+        self.selector        = None
+        self.selectedGeoms   = None
+        self.smallestDists   = None
+        self.externalSet     = None
+        self.divIndexFiles   = None
+        if isinstance(sampleSize,int):
+            self.sampleSize  = [sampleSize]
+        elif isinstance(sampleSize,list) and isinstance(sampleSize[0],int):
+            self.sampleSize  = sampleSize
+        else:
+            RaiseError(message="Invalid Sample Size")
+        if isinstance(threshold,float):
+            self.threshold   = [threshold]
+        elif threshold == None:
+            self.threshold   = [0.05]
+        else:
+            self.threshold   = threshold
+
+    def SetInputFiles(self):
+        if self.inputFiles == None:
+            inputDir        = os.getcwd() if self.inputDir == None else self.inputDir
+            if not os.path.isdir(inputDir):
+                RaiseError(message=f" Program cannot find input directory {inputDir}")
+            self.inputFiles = [os.path.join(inputDir,file) for file in sorted(os.listdir(inputDir)) if file.endswith(".csv")]
+            if self.atoms != None:
+                atoms           = [atom.upper() for atom in self.atoms]
+                self.inputFiles = [file for file in self.inputFiles if any(entry.upper() in atoms for entry in os.path.basename(file).split("_"))]
+        if len(self.inputFiles) == 0:
+            RaiseError(message=" Program cannot find any input .csv file")
+
+    def SetFeatures(self):
+        if self.features is None:
+            self.SetInputFiles()
+            print(f"POLUS: Reading features from {len(self.inputFiles)} .csv files")
+            self.features = ReadFeatureMatrix(self.inputFiles)
+            if self.standardize:
+                self.features = StandardizeFeatures(self.features)
+            self.npoints  = self.features.shape[0]
+            print(f"POLUS:{' # Points in dataset':<30} {self.npoints:>45}")
+            print(f"POLUS:{' # Features per point':<30} {self.features.shape[1]:>45}")
+
+    def ReadExcludedIndexFile(self):
+        self.excludedIDs = list()
+        if self.excludedIndexFile != None:
+            if not os.path.isfile(self.excludedIndexFile):
+                RaiseError(message=f" Program cannot find excluded index file {self.excludedIndexFile}")
+            with open(self.excludedIndexFile,"r") as f:
+                self.excludedIDs = [int(line.split()[0]) for line in f if len(line.split()) > 0]
+
+    def GetDistanceRow(self,pointID):
+        # Excluded points sit at -inf in every row, so that they are never picked
+        row = ComputeDistanceTile(self.features[[pointID]],self.features,self.sqNorms[[pointID]],self.sqNorms)[0]
+        row[self.excludedIDs] = -np.inf
+        return row
+
+    def SetSelector(self):
+        # First pick: the point farthest from the mean feature vector
+        self.sqNorms     = np.einsum("ij,ij->i",self.features,self.features)
+        initialDistances = np.linalg.norm(self.features - self.features.mean(axis=0),axis=1)
+        initialDistances[self.excludedIDs] = -np.inf
+        self.selector    = FarthestPointSelector(self.npoints,self.GetDistanceRow,initialDistances)
+
+    def SelectPoints(self):
+        self.SetSelector()
+        ncandidates = self.npoints - len(set(self.excludedIDs))
+        largest     = ncandidates if self.writeFBSInputs or self.autoStop else min(max(self.sampleSize),ncandidates)
+        start       = time.time()
+        print("POLUS: Selection of diverse points in progress...")
+        print(f"POLUS: {'N':>7} {'Best':>10} {'Dis':>10} {'Dur(s)':>14}")
+        for n in range(largest):
+            best, dist = self.selector.Next()
+            if best == None:
+                break
+            if n == 0 or (n+1)%self.printPace == 0:
+                print(f"POLUS: {n+1:>7} {best:>10} {dist:>10.3f} {time.time()-start:>14.4e}")
+            if self.autoStop and dist <= min(self.threshold):
+                break
+        self.selectedGeoms = list(self.selector.selected)
+        self.smallestDists = list(self.selector.smallestDistances)
+
+    def GetSampleSizes(self):
+        # Requested sizes, or number of leading picks above each threshold (the smallest one keeps the last pick)
+        if not self.autoStop:
+            return sorted([min(size,len(self.selectedGeoms)) for size in self.sampleSize],reverse=True)
+        sizes = list()
+        for threshold in sorted(self.threshold):
+            if threshold == min(self.threshold):
+                sizes.append(len(self.selectedGeoms))
+            else:
+                above = np.nonzero(np.asarray(self.smallestDists) < threshold)[0]
+                sizes.append(len(self.selectedGeoms) if len(above) == 0 else int(above[0]))
+        return sizes
+
+    def SetExternalSet(self):
+        # Points left out of the largest sample, in diversity order when every point was ordered
+        largest = max(self.GetSampleSizes())
+        if self.writeFBSInputs and not self.autoStop:
+            self.externalSet = self.selectedGeoms[largest:]
+        else:
+            left             = set(self.selectedGeoms[:largest]) | set(self.excludedIDs)
+            self.externalSet = [ID for ID in range(self.npoints) if ID not in left]
+        print(f"POLUS: External Set Size {len(self.externalSet)}")
+
+    def GetOutputFilename(self,kind,size):
+        outDir = os.getcwd() if self.outputDir == None else self.outputDir
+        if not os.path.isdir(outDir):
+            os.makedirs(outDir)
+        return os.path.join(outDir,self.systemName.upper()+"-"+kind+"-"+str(size)+".dat")
+
+    def WriteIndexFile(self,size):
+        if self.divIndexFiles == None:
+            self.divIndexFiles = dict()
+        self.divIndexFiles[size] = self.GetOutputFilename("INDEX",size)
+        with open(self.divIndexFiles[size],"w") as myfile:
+            for i in self.selectedGeoms[:size]:
+                myfile.write(f"{i:<7}\n")
+
+    def WriteDiversityMetrics(self,size):
+        with open(self.GetOutputFilename("DIVERSITY",size),"w") as myfile:
+            myfile.write("#FIELDS POINT-ID sDist\n")
+            for i in range(size):
+                myfile.write(f"{i:<7} {self.smallestDists[i]:>12.8f} \n")
+
+    def Execute(self):
+        start = time.time()
+        self.SetFeatures()
+        self.ReadExcludedIndexFile()
+        self.SelectPoints()
+        self.SetExternalSet()
+        for size in self.GetSampleSizes():
+            self.WriteIndexFile(size)
+            self.WriteDiversityMetrics(size)
+        print(f"POLUS: Total duration (s) of the feature-based DAS procedure {time.time() - start:10.6e}")
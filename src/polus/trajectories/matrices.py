@@ -0,0 +1,216 @@
+import os
+import numpy as np
+from polus.utils.logging import RaiseError
+
+
+def SharedMemoryModule():
+    # multiprocessing.shared_memory only exists from Python 3.8 on (None before)
+    try:
+        from multiprocessing import shared_memory
+    except ImportError:
+        return None
+    return shared_memory
+
+def RequireSharedMemory():
+    shared_memory = SharedMemoryModule()
+    if shared_memory == None:
+        RaiseError(message=" Shared-memory RMSD matrix builds require Python 3.8 or later")
+    return shared_memory
+
+
+class MatrixStore():
+    """
+    Storage of a symmetric (ngeoms,ngeoms) distance matrix with a zero diagonal.
+    Blocks are written through SetBlock/SetEntries and read back through Row/Rows,
+    so that callers do not depend on how (or where) the entries are kept.
+    """
+    def __init__(self,ngeoms,dtype=np.float32,filename=None):
+        self.ngeoms   = ngeoms
+        self.dtype    = np.dtype(dtype)
+        self.filename = filename
+        self.data     = None
+        self.shm      = None
+
+    @property
+    def shape(self):
+        return (self.ngeoms,self.ngeoms)
+
+    def Allocate(self,shape,mode="w+"):
+        if self.filename == None:
+            return np.zeros(shape=shape,dtype=self.dtype)
+        if mode == "w+" and os.path.dirname(self.filename) and not os.path.isdir(os.path.dirname(self.filename)):
+            os.makedirs(os.path.dirname(self.filename))
+        return np.memmap(self.filename,dtype=self.dtype,mode=mode,shape=shape)
+
+    def Row(self,i,cols=None):
+        if cols is None:
+            cols = np.arange(self.ngeoms)
+        return self.Rows([i],cols)[0]
+
+    def ToDense(self):
+        return self.Rows(np.arange(self.ngeoms),np.arange(self.ngeoms))
+
+    def Flush(self):
+        if isinstance(self.data,np.memmap):
+            self.data.flush()
+
+    def Share(self):
+        """
+        Moves in-memory entries to shared memory (file-backed stores are already
+        shareable) and returns a small picklable handle that AttachMatrixStore turns
+        back into a store writing to the same entries from another process.
+        """
+        if self.filename == None and self.shm is None:
+            self.shm  = RequireSharedMemory().SharedMemory(create=True,size=max(self.data.nbytes,1))
+            view      = np.ndarray(self.data.shape,dtype=self.dtype,buffer=self.shm.buf)
+            view[...] = self.data
+            self.data = view
+        self.Flush()
+        return (type(self).__name__,self.ngeoms,self.dtype.str,self.filename,None if self.shm is None else self.shm.name)
+
+    def Unshare(self):
+        if self.shm is not None:
+            self.data = np.array(self.data)
+            self.shm.close()
+            self.shm.unlink()
+            self.shm  = None
+
+    def __getitem__(self,key):
+        rows, cols = key
+        values = self.Rows(np.atleast_1d(rows),np.atleast_1d(cols))
+        if np.ndim(rows) == 0 and np.ndim(cols) == 0:
+            return values[0,0]
+        if np.ndim(rows) == 0:
+            return values[0]
+        if np.ndim(cols) == 0:
+            return values[:,0]
+        return values
+
+
+class DenseMatrix(MatrixStore):
+    def __init__(self,ngeoms,dtype=np.float32,filename=None,mode="w+"):
+        super().__init__(ngeoms,dtype,filename)
+        self.data = self.Allocate(self.DataShape(),mode)
+
+    def DataShape(self):
+        return (self.ngeoms,self.ngeoms)
+
+    def Rows(self,rows,cols):
+        return self.data[np.ix_(rows,cols)]
+
+    def Row(self,i,cols=None):
+        if cols is None:
+            return np.asarray(self.data[i])
+        return self.data[i,cols]
+
+    def ToDense(self):
+        return np.asarray(self.data)
+
+    def SetBlock(self,i0,j0,block):
+        # Upper-triangle block (i0<=j0); its transpose fills the lower triangle
+        i1, j1 = i0+block.shape[0], j0+block.shape[1]
+        self.data[i0:i1,j0:j1] = block
+        self.data[j0:j1,i0:i1] = block.T
+
+    def SetEntries(self,rows,cols,values):
+        self.data[rows,cols] = values
+        self.data[cols,rows] = values
+
+
+class MemmapMatrix(DenseMatrix):
+    """
+    Dense matrix kept in a file on disk and accessed through np.memmap, for matrices
+    that do not fit in memory.
+    """
+    def __init__(self,ngeoms,dtype=np.float32,filename=None,mode="w+"):
+        if filename == None:
+            RaiseError(message=" A filename is required for a memory-mapped RMSD matrix")
+        super().__init__(ngeoms,dtype,filename,mode)
+
+
+class CondensedMatrix(MatrixStore):
+    """
+    Upper triangle (i<j) of the matrix stored row by row in a flat array of
+    ngeoms*(ngeoms-1)/2 entries, i.e. half of the memory of a dense matrix.
+    The flat array itself is memory-mapped if a filename is given.
+    """
+    def __init__(self,ngeoms,dtype=np.float32,filename=None,mode="w+"):
+        super().__init__(ngeoms,dtype,filename)
+        self.data = self.Allocate(self.DataShape(),mode)
+
+    def DataShape(self):
+        return (self.ngeoms*(self.ngeoms-1)//2,)
+
+    def Index(self,rows,cols):
+        # Position of entry (rows,cols), rows<cols, in the flat array
+        rows = np.asarray(rows,dtype=np.int64)
+        cols = np.asarray(cols,dtype=np.int64)
+        return self.ngeoms*rows - rows*(rows+1)//2 + cols - rows - 1
+
+    def Rows(self,rows,cols):
+        rows = np.asarray(rows,dtype=np.int64)[:,None]
+        cols = np.asarray(cols,dtype=np.int64)[None,:]
+        low, high = np.minimum(rows,cols), np.maximum(rows,cols)
+        upper     = low != high
+        values    = np.zeros(shape=low.shape,dtype=self.dtype)
+        values[upper] = self.data[self.Index(low[upper],high[upper])]
+        return values
+
+    def SetBlock(self,i0,j0,block):
+        # Entries of the block located strictly above the diagonal, one contiguous run per row
+        for r in range(block.shape[0]):
+            i      = i0 + r
+            jstart = max(j0,i+1)
+            jstop  = j0 + block.shape[1]
+            if jstart < jstop:
+                k0 = self.Index(i,jstart)
+                self.data[k0:k0+jstop-jstart] = block[r,jstart-j0:]
+
+    def SetEntries(self,rows,cols,values):
+        rows, cols = np.asarray(rows), np.asarray(cols)
+        upper      = rows != cols
+        low, high  = np.minimum(rows,cols)[upper], np.maximum(rows,cols)[upper]
+        self.data[self.Index(low,high)] = np.asarray(values)[upper]
+
+
+STORES = {"DenseMatrix":DenseMatrix,"MemmapMatrix":MemmapMatrix,"CondensedMatrix":CondensedMatrix}
+MATRIX_STORAGES = ["dense","condensed","memmap"]
+
+
+def AttachMatrixStore(handle):
+    # Reopens, in a worker process, a store shared through MatrixStore.Share
+    kind, ngeoms, dtype, filename, shmName = handle
+    cls = STORES[kind]
+    if filename != None:
+        return cls(ngeoms,dtype,filename,mode="r+")
+    store      = cls.__new__(cls)
+    MatrixStore.__init__(store,ngeoms,dtype)
+    store.shm  = RequireSharedMemory().SharedMemory(name=shmName)
+    store.data = np.ndarray(store.DataShape(),dtype=store.dtype,buffer=store.shm.buf)
+    return store
+
+def WrapMatrixStore(kind,ngeoms,data):
+    # Store reading its entries from an existing array (e.g. a memory-mapped cache entry)
+    store      = STORES[kind].__new__(STORES[kind])
+    MatrixStore.__init__(store,ngeoms,data.dtype)
+    store.data = data
+    return store
+
+def CreateMatrixStore(kind,ngeoms,dtype=np.float32,filename=None):
+    """
+    Returns an empty matrix store.
+
+    Parameters:
+    - kind:     str  -> "dense", "condensed" (upper triangle) or "memmap" (dense, on disk)
+    - ngeoms:   int  -> Number of geometries
+    - dtype:    type -> Precision of the entries
+    - filename: str  -> Backing file (required for "memmap", optional for "condensed")
+    """
+    if kind == "dense":
+        return DenseMatrix(ngeoms,dtype)
+    elif kind == "condensed":
+        return CondensedMatrix(ngeoms,dtype,filename)
+    elif kind == "memmap":
+        return MemmapMatrix(ngeoms,dtype,filename)
+    else:
+        RaiseError(message=f"Invalid RMSD matrix storage {kind}")
@@ -0,0 +1,101 @@
+import numpy as np
+from scipy.spatial import cKDTree
+from scipy.spatial.distance import cdist
+from sklearn.neighbors import BallTree
+from polus.utils.logging import RaiseError
+
+
+class SpatialIndex():
+    """
+    Ball tree or k-d tree over weighted, flattened coordinates of pre-aligned frames
+    (see WeightedCoordinates), whose Euclidean distances are RMSDs. Radius and nearest
+    neighbour queries then avoid scanning rows of the RMSD matrix.
+
+    Parameters:
+    - X:        array -> Weighted coordinates (nframes,3*natoms)
+    - ids:      array -> Frames to index (all frames if None); queries return these frame IDs
+    - kind:     str   -> "balltree" or "kdtree"
+    - leafSize: int   -> Number of frames per leaf of the tree
+    """
+    def __init__(self,X,ids=None,kind="balltree",leafSize=40):
+        self.ids    = np.arange(X.shape[0]) if ids is None else np.asarray(ids,dtype=np.int64)
+        self.kind   = kind
+        points      = np.asarray(X[self.ids],dtype=np.float64)
+        if kind == "balltree":
+            self.tree = BallTree(points,leaf_size=leafSize)
+        elif kind == "kdtree":
+            self.tree = cKDTree(points,leafsize=leafSize)
+        else:
+            RaiseError(message=f"Invalid spatial index {kind}")
+
+    def QueryNearest(self,points,k=1):
+        # Distances (npoints,k) and IDs (npoints,k) of the k indexed frames closest to each point
+        points     = np.atleast_2d(points)
+        dists, pos = self.tree.query(points,k=k)
+        return np.reshape(dists,(len(points),k)), self.ids[np.reshape(pos,(len(points),k))]
+
+    def QueryRadius(self,points,radius):
+        # IDs of the indexed frames within radius of each point
+        points = np.atleast_2d(points)
+        if self.kind == "balltree":
+            pos = self.tree.query_radius(points,r=radius)
+        else:
+            pos = self.tree.query_ball_point(points,r=radius)
+        return [self.ids[np.asarray(p,dtype=np.int64)] for p in pos]
+
+
+class DynamicSpatialIndex():
+    """
+    Nearest-neighbour index growing one point at a time, for online selections. Points
+    are searched in a SpatialIndex, rebuilt every rebuildSize insertions, and in a
+    buffer of the points inserted since, which is scanned directly. A query thus costs
+    O(log n + rebuildSize), however many points were inserted before.
+
+    Parameters:
+    - kind:        str -> "balltree" or "kdtree"
+    - rebuildSize: int -> Number of insertions between two rebuilds of the tree
+    - leafSize:    int -> Number of points per leaf of the tree
+    """
+    def __init__(self,kind="balltree",rebuildSize=256,leafSize=40):
+        self.kind        = kind
+        self.rebuildSize = rebuildSize
+        self.leafSize    = leafSize
+        self.points      = list()
+        self.ids         = list()
+        self.index       = None
+        self.nindexed    = 0
+
+    def __len__(self):
+        return len(self.ids)
+
+    def Add(self,point,pointID):
+        self.points.append(np.asarray(point,dtype=np.float64))
+        self.ids.append(int(pointID))
+        if len(self.points)-self.nindexed >= self.rebuildSize:
+            self.index    = SpatialIndex(np.array(self.points),kind=self.kind,leafSize=self.leafSize)
+            self.nindexed = len(self.points)
+
+    def QueryNearest(self,points):
+        # Distances to, and IDs of, the nearest inserted point of each point (inf and -1 if there is none)
+        points = np.atleast_2d(points)
+        dists  = np.full(len(points),np.inf)
+        ids    = np.full(len(points),-1,dtype=np.int64)
+        if self.index != None:
+            d, pos = self.index.QueryNearest(points)
+            dists  = d[:,0]
+            ids    = np.asarray(self.ids,dtype=np.int64)[pos[:,0]]
+        if len(self.points) > self.nindexed:
+            D      = cdist(points,np.array(self.points[self.nindexed:]))
+            k      = np.argmin(D,axis=1)
+            d      = D[np.arange(len(points)),k]
+            closer = d < dists
+            dists[closer], ids[closer] = d[closer], np.asarray(self.ids[self.nindexed:],dtype=np.int64)[k[closer]]
+        return dists, ids
+
+
+def ComputeCoverage(nearestDistances,thresholds):
+    # Fraction of frames lying within each threshold of their nearest sample frame
+    nearestDistances = np.asarray(nearestDistances)
+    if len(nearestDistances) == 0:
+        return [1.0 for _ in thresholds]
+    return [float(np.mean(nearestDistances <= t)) for t in thresholds]
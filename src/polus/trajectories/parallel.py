@@ -0,0 +1,142 @@
+import os
+import math
+import numpy as np
+import multiprocessing as mp
+from polus.trajectories.calculators import ComputeDistanceTile, ComputeRMSDManyToMany, WeightedCoordinates
+from polus.trajectories.matrices import AttachMatrixStore, RequireSharedMemory
+from polus.trajectories.cache import WriteAtomically
+
+# State of a worker process, set once by InitWorker
+WORKER = dict()
+
+
+def InitWorker(coordsName,coordsShape,coordsDtype,storeHandle,sqrtWeights,rotated,rotMethod):
+    shm = RequireSharedMemory().SharedMemory(name=coordsName)
+    WORKER["shm"]         = shm
+    WORKER["coords"]      = np.ndarray(coordsShape,dtype=coordsDtype,buffer=shm.buf)
+    WORKER["store"]       = None if storeHandle is None else AttachMatrixStore(storeHandle)
+    WORKER["sqrtWeights"] = sqrtWeights
+    WORKER["rotated"]     = rotated
+    WORKER["rotMethod"]   = rotMethod
+    if rotated:
+        X = WORKER["coords"]
+        WORKER["sq"] = np.einsum("ij,ij->i",X,X)
+
+def TileBlock(i0,i1,j0,j1):
+    # Rows [i0,i1) x columns [j0,j1) of the RMSD matrix
+    coords = WORKER["coords"]
+    if WORKER["rotated"]:
+        sq    = WORKER["sq"]
+        block = ComputeDistanceTile(coords[i0:i1],coords[j0:j1],sq[i0:i1],sq[j0:j1])
+    else:
+        block = ComputeRMSDManyToMany(coords[i0:i1],coords[j0:j1],WORKER["sqrtWeights"],False,WORKER["rotMethod"])
+    diag = np.arange(max(i0,j0),min(i1,j1))
+    block[diag-i0,diag-j0] = 0.0
+    return block
+
+def ComputeTile(tile):
+    # Computes a tile and writes it to the shared store
+    i0, i1, j0, j1 = tile
+    WORKER["store"].SetBlock(i0,j0,TileBlock(i0,i1,j0,j1))
+    return tile
+
+def SaveTile(task):
+    # Computes a tile and writes it to its own .npy file
+    tile, filename, dtype = task
+    block = TileBlock(*tile).astype(dtype,copy=False)
+    WriteAtomically(filename,lambda f: np.save(f,block))
+    return tile
+
+def PartitionTiles(ngeoms,tileSize,ntiles=1,tileIndex=None):
+    """
+    Upper-triangle tiles (i0,i1,j0,j1) of an RMSD matrix, dealt round-robin to ntiles
+    independent tasks (e.g. scheduler array tasks), so that every task gets a similar
+    mix of long and short tile rows.
+
+    Parameters:
+    - ngeoms:    int -> Number of geometries
+    - tileSize:  int -> Number of rows and columns per tile
+    - ntiles:    int -> Number of tasks sharing the tiles
+    - tileIndex: int -> Task index in [0,ntiles); all tiles are returned if None
+    """
+    tiles = [(i0,min(i0+tileSize,ngeoms),j0,min(j0+tileSize,ngeoms)) for i0 in range(0,ngeoms,tileSize) for j0 in range(i0,ngeoms,tileSize)]
+    if tileIndex is None:
+        return tiles
+    return tiles[tileIndex::ntiles]
+
+def TileFilename(tileDir,tile):
+    return os.path.join(tileDir,f"TILE-{tile[0]}-{tile[2]}.npy")
+
+
+class SharedRMSDEngine():
+    """
+    Parallel RMSD matrix builder. Coordinates are placed once in shared memory and the
+    matrix store is shared (shared memory or its backing file), so that worker processes
+    only receive tile coordinates and write their results straight into the store.
+    Pre-aligned frames are handled with GEMM tiles, other frames with batched alignments.
+
+    Parameters:
+    - Geoms:         array       -> Frames (nframes,natoms,3)
+    - sqrtWeights:   array       -> Square roots of the atomic weights
+    - store:         MatrixStore -> Output matrix (None if tiles are only saved to files)
+    - rotated:       bool        -> Whether frames are already superposed
+    - rotMethod:     str         -> Superposition method for frames that are not
+    - ncores:        int         -> Number of worker processes
+    - tileSize:      int         -> Number of columns per tile
+    - startMethod:   str         -> Multiprocessing start method (platform default if None)
+    """
+    def __init__(self,Geoms,sqrtWeights,store,rotated=True,rotMethod="KU",ncores=4,tileSize=2048,startMethod=None):
+        self.ngeoms      = Geoms.shape[0]
+        self.store       = store
+        self.rotated     = rotated
+        self.rotMethod   = rotMethod
+        self.ncores      = ncores
+        self.tileSize    = tileSize
+        self.startMethod = startMethod
+        self.sqrtWeights = sqrtWeights
+        if rotated:
+            self.coords  = WeightedCoordinates(Geoms,sqrtWeights,np.float64)
+        else:
+            self.coords  = np.asarray(Geoms,dtype=np.float64)
+        self.coordsShape = self.coords.shape
+        self.shm         = None
+        self.pool        = None
+
+    def __enter__(self):
+        self.shm     = RequireSharedMemory().SharedMemory(create=True,size=max(self.coords.nbytes,1))
+        shared       = np.ndarray(self.coords.shape,dtype=self.coords.dtype,buffer=self.shm.buf)
+        shared[...]  = self.coords
+        del shared
+        self.coords  = None
+        storeHandle  = None if self.store is None else self.store.Share()
+        initargs     = (self.shm.name,self.coordsShape,np.float64,storeHandle,self.sqrtWeights,self.rotated,self.rotMethod)
+        self.pool    = mp.get_context(self.startMethod).Pool(processes=self.ncores,initializer=InitWorker,initargs=initargs)
+        return self
+
+    def Tiles(self,firstRow,lastRow):
+        # Upper-triangle tiles covering rows [firstRow,lastRow), rows split so that every worker gets some
+        rowStep = max(1,min(self.tileSize,math.ceil((lastRow-firstRow)/self.ncores)))
+        tiles   = list()
+        for i0 in range(firstRow,lastRow,rowStep):
+            i1 = min(i0+rowStep,lastRow)
+            for j0 in range(i0,self.ngeoms,self.tileSize):
+                tiles.append((i0,i1,j0,min(j0+self.tileSize,self.ngeoms)))
+        return tiles
+
+    def ComputeRows(self,firstRow,lastRow):
+        tiles = self.Tiles(firstRow,lastRow)
+        self.pool.map(ComputeTile,tiles,chunksize=max(1,len(tiles)//(4*self.ncores)))
+        self.store.Flush()
+
+    def SaveTiles(self,tiles,tileDir,dtype=np.float32):
+        # Every tile ends up in its own file of tileDir, to be merged later into a store
+        tasks = [(tile,TileFilename(tileDir,tile),np.dtype(dtype)) for tile in tiles]
+        self.pool.map(SaveTile,tasks,chunksize=1)
+
+    def __exit__(self,*args):
+        self.pool.close()
+        self.pool.join()
+        if self.store is not None:
+            self.store.Unshare()
+        self.shm.close()
+        self.shm.unlink()
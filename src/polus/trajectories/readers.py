@@ -1,31 +1,255 @@
 import os
+import re
+import time
+import warnings
+import itertools
+import collections
+import numpy as np
 from polus.utils.logging import RaiseError
 
-def ReadXYZFile(Filename,readLabels=False):
+# First token (atom label) of every line of an XYZ body
+LABEL_TOKEN = re.compile(r"^[ \t]*\S+",re.M)
+
+def CountXYZAtoms(content):
+    natoms = 0
+    for line in content[2:]:
+        if len(line.split())>=4:
+            natoms+=1
+        else:
+            break
+    return natoms
+
+def ParseXYZFrames(content,natoms,dtype=np.float64):
+    """
+    Converts the lines of consecutive XYZ frames into an array of atom labels and
+    a contiguous (ngeoms,natoms,3) array of coordinates. Header lines are dropped by
+    reshaping, labels are stripped with a single regular expression and the numbers
+    are parsed in one numpy call, so that no Python loop runs over the tokens.
+
+    Parameters:
+    - content: list -> Lines of the XYZ frames (headers included)
+    - natoms:  int  -> Number of atoms per frame
+    - dtype:   type -> Floating point type of the coordinate array
+    """
+    jump   = natoms + 2
+    ngeoms = int(len(content)/jump)
+    if ngeoms == 0:
+        return np.array([],dtype=str), np.zeros(shape=(0,natoms,3),dtype=dtype)
+    body   = np.array(content[:ngeoms*jump],dtype=object).reshape(ngeoms,jump)[:,2:].ravel()
+    labels = np.array([line.split()[0] for line in body[:natoms]])
+    try:
+        with warnings.catch_warnings():
+            # Older numpy versions warn (instead of raising) on unparsable text
+            warnings.simplefilter("ignore",DeprecationWarning)
+            coords = np.fromstring(LABEL_TOKEN.sub(" ","\n".join(body)),dtype=dtype,sep=" ")
+    except ValueError:
+        coords = np.zeros(shape=0,dtype=dtype)
+    if coords.size != ngeoms*natoms*3:
+        # Unusual lines (extra columns): fall back to a per-line split
+        coords = np.array([line.split()[1:4] for line in body],dtype=dtype)
+    return labels, coords.reshape(ngeoms,natoms,3)
+
+def ReadXYZHeader(Filename,dtype=np.float64):
+    """
+    Reads the first frame of an XYZ trajectory only and returns its atom labels and
+    coordinates.
+
+    Parameters:
+    - Filename: str  -> Path to the XYZ trajectory
+    - dtype:    type -> Floating point type of the coordinate array
+    """
     if not os.path.isfile(Filename):
         RaiseError(message=f"File {Filename} not found")
-    else:
-        XYZ = dict()
-        with open(Filename,"r") as f:
-            content = f.readlines()
-        natoms = 0
-        for line in content[2:]:
-            if len(line.split())>=4:
-                natoms+=1
-            else:
+    content = list()
+    with open(Filename,"r") as f:
+        for line in f:
+            if len(content)>=2 and len(line.split())<4:
                 break
-        ngeoms = int(len(content)/(natoms+2))
-        for i in range(ngeoms):
-            geom_ = content[(natoms+2)*i:(natoms+2)*(i+1)]
-            geom  = list()
-            countAtoms = 0
-            for atom in geom_[2:]:
-                if not readLabels:
-                    geom.append([eval(x) for x in atom.split()[1:4]])
-                else:
-                    geom.append([x for x in atom.split()[:4]])
-                    geom[countAtoms][1:4] = [eval(x) for x in geom[countAtoms][1:4]]
-                countAtoms+=1
-            XYZ[i] = geom
+            content.append(line)
+    natoms = CountXYZAtoms(content)
+    labels, coords = ParseXYZFrames(content,natoms,dtype)
+    return labels, coords[0]
+
+def IterXYZBlocks(Filename,natoms,blockSize=1000,start=0,stop=None,stride=1,dtype=np.float64):
+    """
+    Streams an XYZ trajectory as blocks of at most blockSize frames. Only the lines of
+    the current block are held in memory. Yields the frame IDs of the block together
+    with a (nframes,natoms,3) array of coordinates.
+
+    Parameters:
+    - Filename:  str  -> Path to the XYZ trajectory
+    - natoms:    int  -> Number of atoms per frame
+    - blockSize: int  -> Maximum number of frames per block
+    - start:     int  -> ID of the first frame to read
+    - stop:      int  -> ID of the frame at which reading stops (excluded)
+    - stride:    int  -> Step between two frames read
+    - dtype:     type -> Floating point type of the coordinate arrays
+    """
+    jump = natoms + 2
+    with open(Filename,"r") as f:
+        # Skip frames preceding start without keeping them
+        collections.deque(itertools.islice(f,start*jump),maxlen=0)
+        frameID = start
+        while stop == None or frameID < stop:
+            nframes = blockSize*stride
+            if stop != None:
+                nframes = min(nframes,stop-frameID)
+            content = list(itertools.islice(f,nframes*jump))
+            nread   = int(len(content)/jump)
+            if nread == 0:
+                break
+            frames  = np.array(content[:nread*jump],dtype=object).reshape(nread,jump)[::stride]
+            _, coords = ParseXYZFrames(frames.ravel().tolist(),natoms,dtype)
+            yield np.arange(frameID,frameID+nread,stride), coords
+            # Realign on the stride grid for the next block
+            frameID = frameID + nread
+            skip    = (-nread)%stride
+            collections.deque(itertools.islice(f,skip*jump),maxlen=0)
+            frameID = frameID + skip
+            if nread < nframes:
+                break
+
+def TailXYZBlocks(Filename,natoms=None,blockSize=1000,pollInterval=1.0,idleTimeout=60.0,dtype=np.float64):
+    """
+    Follows an XYZ trajectory that is still being written (e.g. by an MD engine) and
+    yields blocks of at most blockSize complete frames as they appear, like IterXYZBlocks.
+    A frame is complete once its natoms+2 lines are terminated; text of unfinished frames
+    is kept for the next poll. Iteration stops after idleTimeout seconds without any new
+    complete frame (never if idleTimeout is None).
+
+    Parameters:
+    - Filename:     str   -> Path to the growing XYZ trajectory
+    - natoms:       int   -> Number of atoms per frame (read from the first line if None)
+    - blockSize:    int   -> Maximum number of frames per block
+    - pollInterval: float -> Seconds between two checks for new frames
+    - idleTimeout:  float -> Seconds without new frames after which iteration stops
+    - dtype:        type  -> Floating point type of the coordinate arrays
+    """
+    frameID  = 0
+    lines    = list()
+    partial  = b""
+    lastNew  = time.time()
+    f        = None
+    try:
+        while True:
+            if f == None and os.path.isfile(Filename):
+                f = open(Filename,"rb")
+            text = b"" if f == None else f.read()
+            if len(text) > 0:
+                chunks  = (partial+text).split(b"\n")
+                partial = chunks.pop()
+                lines.extend([chunk.decode() for chunk in chunks])
+            if natoms == None and len(lines) > 0:
+                natoms = int(lines[0].split()[0])
+            jump    = None if natoms == None else natoms + 2
+            nframes = 0 if jump == None else len(lines)//jump
+            if nframes == 0:
+                if idleTimeout != None and time.time()-lastNew > idleTimeout:
+                    break
+                time.sleep(pollInterval)
+                continue
+            lastNew = time.time()
+            for k in range(0,nframes,blockSize):
+                nblock    = min(blockSize,nframes-k)
+                _, coords = ParseXYZFrames(lines[k*jump:(k+nblock)*jump],natoms,dtype)
+                yield np.arange(frameID,frameID+nblock), coords
+                frameID   = frameID + nblock
+            lines = lines[nframes*jump:]
+    finally:
+        if f != None:
+            f.close()
+
+def IndexXYZFrames(Filename,natoms,chunkSize=1<<26):
+    """
+    Byte offsets of the frames of an XYZ trajectory, found in a single scan of the
+    newline positions of fixed-size binary chunks. Returns nframes+1 offsets: frame k
+    spans bytes [offsets[k],offsets[k+1]). Lines after the last complete frame are ignored.
+
+    Parameters:
+    - Filename:  str -> Path to the XYZ trajectory
+    - natoms:    int -> Number of atoms per frame
+    - chunkSize: int -> Number of bytes scanned at once
+    """
+    jump    = natoms + 2
+    starts  = [np.zeros(1,dtype=np.int64)]
+    nlines  = 0
+    size    = 0
+    with open(Filename,"rb") as f:
+        while True:
+            chunk = f.read(chunkSize)
+            if len(chunk) == 0:
+                break
+            ends  = np.flatnonzero(np.frombuffer(chunk,dtype=np.uint8) == 10).astype(np.int64)
+            # Line l (0-based) ends a frame when (l+1) is a multiple of jump
+            lines = nlines + np.arange(len(ends))
+            starts.append(size + ends[(lines+1)%jump == 0] + 1)
+            nlines = nlines + len(ends)
+            size   = size + len(chunk)
+            last   = chunk[-1:]
+    offsets = np.concatenate(starts)
+    if size > 0 and last != b"\n" and (nlines+1)%jump == 0:
+        # Last frame not terminated by a newline
+        offsets = np.append(offsets,size)
+    return offsets
+
+def ReadXYZFramesAt(Filename,offsets,frameIDs,natoms,dtype=np.float64):
+    """
+    Reads the frames frameIDs (in that order) of an XYZ trajectory by seeking to their
+    byte offsets (see IndexXYZFrames), so that the cost depends on the number of frames
+    read, not on the size of the trajectory. Returns a (nframes,natoms,3) array.
+
+    Parameters:
+    - Filename: str   -> Path to the XYZ trajectory
+    - offsets:  array -> Frame offsets of the trajectory
+    - frameIDs: list  -> IDs of the frames to read
+    - natoms:   int   -> Number of atoms per frame
+    - dtype:    type  -> Floating point type of the coordinate array
+    """
+    frameIDs = np.asarray(frameIDs,dtype=np.int64).ravel()
+    if len(frameIDs) > 0 and (frameIDs.min() < 0 or frameIDs.max() >= len(offsets)-1):
+        RaiseError(message=f" Frame IDs out of range (number of geometries {len(offsets)-1})")
+    # Frames are read in file order, then put back in the requested order
+    unique, inverse = np.unique(frameIDs,return_inverse=True)
+    content         = list()
+    with open(Filename,"rb") as f:
+        for frameID in unique.tolist():
+            f.seek(int(offsets[frameID]))
+            content.extend(f.read(int(offsets[frameID+1]-offsets[frameID])).decode().splitlines())
+    _, coords = ParseXYZFrames(content,natoms,dtype)
+    return coords[inverse]
+
+def ReadIndexFile(Filename):
+    # Frame IDs listed in the first column of an INDEX file (blank and comment lines skipped)
+    if not os.path.isfile(Filename):
+        RaiseError(message=f" Program cannot find index file {Filename}")
+    with open(Filename,"r") as f:
+        return [int(line.split()[0]) for line in f if len(line.split()) > 0 and not line.startswith("#")]
+
+def ReadXYZTrajectory(Filename,dtype=np.float64,blockSize=10000):
+    """
+    Reads a whole XYZ trajectory and returns an array of atom labels together with a
+    contiguous (ngeoms,natoms,3) array of coordinates. The text is parsed block by block
+    so that it is never held in memory next to the parsed array.
+
+    Parameters:
+    - Filename:  str  -> Path to the XYZ trajectory
+    - dtype:     type -> Floating point type of the coordinate array (float64 or float32)
+    - blockSize: int  -> Number of frames parsed at once
+    """
+    labels, first = ReadXYZHeader(Filename,dtype)
+    natoms = first.shape[0]
+    blocks = [coords for _, coords in IterXYZBlocks(Filename,natoms,blockSize,dtype=dtype)]
+    if len(blocks) == 1:
+        return labels, blocks[0]
+    return labels, np.concatenate(blocks,axis=0)
+
+def ReadXYZFile(Filename,readLabels=False):
+    labels, coords = ReadXYZTrajectory(Filename)
+    XYZ = dict()
+    for i in range(coords.shape[0]):
+        if not readLabels:
+            XYZ[i] = coords[i].tolist()
+        else:
+            XYZ[i] = [[label]+atom for label,atom in zip(labels.tolist(),coords[i].tolist())]
     return XYZ
 
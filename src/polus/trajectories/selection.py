@@ -0,0 +1,55 @@
+import numpy as np
+
+
+class FarthestPointSelector():
+    """
+    Farthest-point (max-min) selection driven by an incrementally updated vector of
+    distances between every candidate and its nearest selected geometry. Each pick
+    needs a single row of distances, so selecting k out of N geometries costs O(N*k)
+    time and O(N) memory, with or without an RMSD matrix. Given a NeighbourRow, later
+    picks only update the candidates lying within the distance of the pick to the
+    selection (no other candidate can get closer to the selection), so that a spatial
+    index returns far fewer distances than a full row as the selection grows.
+
+    Parameters:
+    - ngeoms:           int      -> Number of candidate geometries
+    - DistanceRow:      callable -> DistanceRow(gid) returns the (ngeoms,) distances from gid to all candidates
+    - initialDistances: array    -> Distances used for the first pick (e.g. to the centroid)
+    - keepInitial:      bool     -> Keep initialDistances as part of the min-distance state after the
+                                    first pick (warm starts) instead of using them for the first pick only
+    - NeighbourRow:     callable -> NeighbourRow(gid,radius) returns the IDs of the candidates within radius
+                                    of gid and their distances to gid (full rows are used if None)
+    """
+    def __init__(self,ngeoms,DistanceRow,initialDistances=None,keepInitial=False,NeighbourRow=None):
+        self.ngeoms            = ngeoms
+        self.DistanceRow       = DistanceRow
+        self.keepInitial       = keepInitial
+        self.NeighbourRow      = NeighbourRow
+        self.selected          = list()
+        self.smallestDistances = list()
+        if initialDistances is None:
+            self.minDist       = np.full(ngeoms,np.inf)
+        else:
+            self.minDist       = np.array(initialDistances,dtype=np.float64)
+
+    def Next(self):
+        # Selected geometries hold -inf and are never picked again
+        best = int(np.argmax(self.minDist))
+        dist = self.minDist[best]
+        if dist == -np.inf:
+            return None, None
+        self.Add(best,dist)
+        return best, dist
+
+    def Add(self,gid,dist=None):
+        if len(self.selected) == 0 and not self.keepInitial:
+            self.minDist = np.array(self.DistanceRow(gid),dtype=np.float64)
+        elif self.NeighbourRow != None and dist != None and np.isfinite(dist):
+            # dist is the largest min-distance, candidates farther from gid keep theirs
+            ids, row = self.NeighbourRow(gid,dist)
+            self.minDist[ids] = np.minimum(self.minDist[ids],row)
+        else:
+            np.minimum(self.minDist,np.asarray(self.DistanceRow(gid),dtype=np.float64),out=self.minDist)
+        self.minDist[gid] = -np.inf
+        self.selected.append(gid)
+        self.smallestDistances.append(dist)
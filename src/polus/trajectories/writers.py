@@ -0,0 +1,103 @@
+import numpy as np
+from polus.utils.logging import RaiseError
+
+MATRIX_FORMATS = ["txt","npy","condensed","npz"]
+XYZ_COORDS     = " %12.8f %12.8f %12.8f \n"
+
+
+def XYZFrameTemplate(symbols,labelWidth=5,coordsFormat=XYZ_COORDS):
+    # %-template of the atom lines of one frame, labels already in place
+    return "".join([f"{symbol:<{labelWidth}}"+coordsFormat for symbol in symbols])
+
+def FormatXYZFrames(frames,symbols,comments,labelWidth=5,coordsFormat=XYZ_COORDS):
+    """
+    Formats frames (nframes,natoms,3) as XYZ text, one string per frame. Each frame is
+    formatted by a single %-operation on a template holding the atom labels, instead of
+    one f-string per atom.
+
+    Parameters:
+    - frames:       array -> Coordinates of the frames
+    - symbols:      list  -> Atom labels written in the first column
+    - comments:     list  -> Comment (second) line of every frame
+    - labelWidth:   int   -> Width of the label column
+    - coordsFormat: str   -> %-format of the coordinates following the label on every atom line
+    """
+    template = XYZFrameTemplate(symbols,labelWidth,coordsFormat)
+    header   = f"{len(symbols)}\n"
+    coords   = np.asarray(frames,dtype=np.float64).reshape(len(frames),3*len(symbols)).tolist()
+    return [header+comment+"\n"+template % tuple(values) for comment, values in zip(comments,coords)]
+
+def WriteXYZFrames(f,frames,symbols,comments,labelWidth=5,coordsFormat=XYZ_COORDS,blockSize=1000):
+    """
+    Writes frames (nframes,natoms,3) as XYZ text to the open file f, one write per
+    block of blockSize formatted frames (see FormatXYZFrames).
+
+    Parameters:
+    - f:            file  -> Open text file
+    - frames:       array -> Coordinates of the frames
+    - symbols:      list  -> Atom labels written in the first column
+    - comments:     list  -> Comment (second) line of every frame
+    - labelWidth:   int   -> Width of the label column
+    - coordsFormat: str   -> %-format of the coordinates following the label on every atom line
+    - blockSize:    int   -> Number of frames formatted at once
+    """
+    for k0 in range(0,len(frames),blockSize):
+        f.write("".join(FormatXYZFrames(frames[k0:k0+blockSize],symbols,comments[k0:k0+blockSize],labelWidth,coordsFormat)))
+
+def WriteMatrixText(f,store,blockSize=64):
+    """
+    Writes every entry of a distance matrix store as a "ID1 ID2 value" line (IDs from 1).
+    The lines of one row share a template in which column IDs are already formatted,
+    so that only the values are formatted, blockSize rows per write.
+
+    Parameters:
+    - f:         file        -> Open text file
+    - store:     MatrixStore -> Distance matrix
+    - blockSize: int         -> Number of rows per write
+    """
+    ngeoms   = store.shape[0]
+    template = "".join([f"@ROW@ {j+1:>10} %12.6f\n" for j in range(ngeoms)])
+    cols     = np.arange(ngeoms)
+    for i0 in range(0,ngeoms,blockSize):
+        rows = np.arange(i0,min(i0+blockSize,ngeoms))
+        f.write("".join([template.replace("@ROW@",f"{i+1:>10}") % tuple(row) for i, row in zip(rows.tolist(),store.Rows(rows,cols).tolist())]))
+
+def SaveDistanceMatrix(store,filename,fileFormat="npy",blockSize=1024):
+    """
+    Saves a distance matrix store in binary form, rows being copied blockSize at a
+    time so that the dense matrix is never held in memory (except for "npz").
+
+    Parameters:
+    - store:      MatrixStore -> Distance matrix
+    - filename:   str         -> Output file
+    - fileFormat: str         -> "npy" (dense ngeoms x ngeoms), "condensed" (upper triangle,
+                                 in the order of scipy.spatial.distance.squareform) or
+                                 "npz" (compressed condensed matrix, key "condensed")
+    - blockSize:  int         -> Number of rows copied at once
+    """
+    ngeoms = store.shape[0]
+    cols   = np.arange(ngeoms)
+    if fileFormat == "npy":
+        out = np.lib.format.open_memmap(filename,mode="w+",dtype=store.dtype,shape=(ngeoms,ngeoms))
+        for i0 in range(0,ngeoms,blockSize):
+            rows = np.arange(i0,min(i0+blockSize,ngeoms))
+            out[rows[0]:rows[-1]+1] = store.Rows(rows,cols)
+        out.flush()
+    elif fileFormat in ["condensed","npz"]:
+        if fileFormat == "condensed":
+            out = np.lib.format.open_memmap(filename,mode="w+",dtype=store.dtype,shape=(ngeoms*(ngeoms-1)//2,))
+        else:
+            out = np.empty(shape=(ngeoms*(ngeoms-1)//2,),dtype=store.dtype)
+        k0 = 0
+        for i0 in range(0,ngeoms,blockSize):
+            rows  = np.arange(i0,min(i0+blockSize,ngeoms))
+            block = store.Rows(rows,cols)
+            for r, i in enumerate(rows.tolist()):
+                out[k0:k0+ngeoms-i-1] = block[r,i+1:]
+                k0 = k0 + ngeoms-i-1
+        if fileFormat == "condensed":
+            out.flush()
+        else:
+            np.savez_compressed(filename,condensed=out,ngeoms=ngeoms)
+    else:
+        RaiseError(message=f"Invalid distance matrix format {fileFormat}")
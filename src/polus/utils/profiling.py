@@ -0,0 +1,101 @@
+import os
+import sys
+import csv
+import json
+import time
+import contextlib
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Shared do-nothing context returned by disabled profilers
+NULL_STAGE = contextlib.nullcontext()
+FIELDS     = ["stage","wall(s)","cpu(s)","childrenCpu(s)","peakRSS(MB)"]
+
+
+def PeakRSS():
+    # Peak resident set size (MB) of this process so far (None where unavailable)
+    if resource == None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak/(1024.0*1024.0) if sys.platform == "darwin" else peak/1024.0
+
+def ChildrenCPUTime():
+    times = os.times()
+    return times.children_user + times.children_system
+
+
+class Profiler():
+    """
+    Opt-in timing and memory instrumentation of the stages of a job. Each stage records
+    its wall time, the CPU time of this process and of the worker processes it waited
+    for, and the peak RSS reached by the end of the stage. A disabled profiler hands out
+    a shared empty context, so that instrumented code costs nothing.
+
+    Parameters:
+    - enabled: bool -> Record stages
+    """
+    def __init__(self,enabled=False):
+        self.enabled = enabled
+        self.records = list()
+
+    def Stage(self,name):
+        """
+        Context manager timing the enclosed code as stage name. Stages recorded several
+        times (e.g. one matrix batch after the other) are accumulated in the report.
+
+        Parameters:
+        - name: str -> Name of the stage, e.g. "loading", "rotation", "matrix", "selection", "writing"
+        """
+        if not self.enabled:
+            return NULL_STAGE
+        return self.Record(name)
+
+    @contextlib.contextmanager
+    def Record(self,name):
+        wall0, cpu0, children0 = time.perf_counter(), time.process_time(), ChildrenCPUTime()
+        try:
+            yield
+        finally:
+            record = {"stage":name,"wall(s)":time.perf_counter()-wall0,"cpu(s)":time.process_time()-cpu0,
+                      "childrenCpu(s)":ChildrenCPUTime()-children0,"peakRSS(MB)":PeakRSS()}
+            self.records.append(record)
+            print(f"POLUS: Stage {name:<12} wall {record['wall(s)']:>12.4e} s  cpu {record['cpu(s)']:>12.4e} s  peak RSS {record['peakRSS(MB)']} MB")
+
+    def Summary(self):
+        # One entry per stage, in order of first appearance: times summed, largest peak RSS
+        summary = dict()
+        for record in self.records:
+            if record["stage"] not in summary:
+                summary[record["stage"]] = dict(record)
+            else:
+                entry = summary[record["stage"]]
+                for field in ["wall(s)","cpu(s)","childrenCpu(s)"]:
+                    entry[field] = entry[field] + record[field]
+                if record["peakRSS(MB)"] != None:
+                    entry["peakRSS(MB)"] = max(entry["peakRSS(MB)"],record["peakRSS(MB)"])
+        return list(summary.values())
+
+    def WriteReport(self,filename):
+        """
+        Writes the summary of the recorded stages as JSON, or as CSV if filename ends
+        with .csv. Nothing is written by a disabled profiler.
+
+        Parameters:
+        - filename: str -> Path to the report
+        """
+        if not self.enabled:
+            return
+        if os.path.dirname(filename) and not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        summary = self.Summary()
+        with open(filename,"w") as f:
+            if filename.endswith(".csv"):
+                writer = csv.DictWriter(f,fieldnames=FIELDS)
+                writer.writeheader()
+                writer.writerows(summary)
+            else:
+                json.dump({"stages":summary,"peakRSS(MB)":PeakRSS()},f,indent=2)
+        print(f"POLUS: Profiling report written to {filename}")
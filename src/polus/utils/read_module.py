@@ -67,6 +67,21 @@ def check_property(filename,prop="iqa"):
 
     return found
         
+def get_features_indices(header):
+    """
+    This function returns the indices of the feature columns (whose names start with 'f') of a .csv header.
+    
+    Parameters:
+    - header: str -> First line of the .csv file
+    """
+    features_indices = []
+    header_list      = header.split(',')
+    for j in range(len(header_list)):
+        if (header_list[j][0]=='f'):
+            features_indices.append(j)
+
+    return features_indices
+
 def readfile(filename, prop="iqa"):
     """
     This function reads the content of a file and returns many components including the header, the file body, a vector of target property values,
@@ -118,10 +133,7 @@ def readfile(filename, prop="iqa"):
             else:
                 prop_vector.append(eval(line.split(',')[prop_index]))
             
-        header_list=header.split(',')
-        for j in range(len(header_list)):
-            if (header_list[j][0]=='f'):
-                features_indices.append(j)
+        features_indices = get_features_indices(header)
         all_prop_indices = []       
         for value in range(len(header.split(','))):
             if value not in features_indices: